@@ -0,0 +1,91 @@
+import numpy as np
+
+# Articles taken from each (category or tag, language) posting list, newest first
+DEFAULT_MAX_POSTINGS = 1000
+
+# Newest articles in the user's language always added to the candidates
+DEFAULT_BACKFILL = 200
+
+class ArticleIndex:
+    """
+    Inverted index over an ArticleStore for candidate retrieval.
+
+    Posting lists map (category, language), (tag, language) and language to
+    article rows, most recently updated first. A user's candidates are the
+    newest max_postings articles of each of their categories (and tags) in
+    their language, plus the newest `backfill` articles in that language,
+    so the number of scored articles per request does not grow with the corpus.
+    """
+
+    def __init__(self, article_store, max_postings=DEFAULT_MAX_POSTINGS, backfill=DEFAULT_BACKFILL):
+        self.article_store = article_store
+        self.max_postings = max_postings
+        self.backfill = backfill
+        store = article_store
+        n = len(store)
+        n_langs = max(len(store.lang_vocab), 1)
+        self.n_langs = n_langs
+        self.tag_index = {tag: i for i, tag in enumerate(store.tag_vocab)}
+
+        # Every row, newest first (ties by row); rank[row] is its position
+        self.fresh_order = np.argsort(-np.asarray(store.updated_at), kind="stable")
+        rank = np.empty(n, dtype=np.int64)
+        rank[self.fresh_order] = np.arange(n)
+
+        lang_ids = np.asarray(store.lang_ids, dtype=np.int64)
+        tag_rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(store.tag_indptr))
+        self.cat_indptr, self.cat_postings = _postings(
+            np.asarray(store.cat_indices, dtype=np.int64) * n_langs + lang_ids[store.cat_rows],
+            store.cat_rows, len(store.cat_vocab) * n_langs, rank
+        )
+        self.tag_indptr, self.tag_postings = _postings(
+            np.asarray(store.tag_indices, dtype=np.int64) * n_langs + lang_ids[tag_rows],
+            tag_rows, len(store.tag_vocab) * n_langs, rank
+        )
+        self.lang_indptr, self.lang_postings = _postings(
+            lang_ids, np.arange(n, dtype=np.int64), len(store.lang_vocab), rank
+        )
+
+    def signature(self):
+        # Settings that change the candidate sets, for cache versioning
+        return f"postings={self.max_postings},backfill={self.backfill}"
+
+    def candidates(self, language, category_oids=(), tags=(), min_candidates=0):
+        """
+        Sorted article rows to score for a user.
+
+        At least min_candidates rows are returned (when the corpus is large
+        enough): if the user's postings come up short, the newest articles
+        of any language are added.
+        """
+        store = self.article_store
+        lang_id = store.lang_index.get(language.lower(), -1)
+        parts = []
+        if lang_id >= 0:
+            for oid in set(category_oids):
+                cat_id = store.cat_index.get(oid)
+                if cat_id is not None:
+                    parts.append(self._posting(self.cat_indptr, self.cat_postings,
+                                               cat_id * self.n_langs + lang_id))
+            for tag in set(tags):
+                tag_id = self.tag_index.get(tag)
+                if tag_id is not None:
+                    parts.append(self._posting(self.tag_indptr, self.tag_postings,
+                                               tag_id * self.n_langs + lang_id))
+            start = self.lang_indptr[lang_id]
+            parts.append(self.lang_postings[start:min(start + self.backfill, self.lang_indptr[lang_id + 1])])
+
+        rows = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        if len(rows) < min(min_candidates, len(store)):
+            rows = np.union1d(rows, self.fresh_order[:min_candidates])
+        return rows
+
+    def _posting(self, indptr, postings, key):
+        start = indptr[key]
+        return postings[start:min(start + self.max_postings, indptr[key + 1])]
+
+def _postings(keys, rows, n_keys, rank):
+    # CSR posting lists: rows grouped by key, ordered by rank within a key
+    order = np.lexsort((rank[rows], keys))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=n_keys))]).astype(np.int64)
+    return indptr, np.asarray(rows, dtype=np.int64)[order]
@@ -1,5 +1,6 @@
 import numpy as np
-from utils import build_user_article_feature
+from article_store import build_article_store, build_user_features, build_users_features
+from instrumentation import count, timed
 
 def rank_articles_for_user(
     model,
@@ -11,101 +12,211 @@ def rank_articles_for_user(
     custom_tag_clicks=None,
     alpha=8.0,              # User-Click influence multiplier
     k=25.0,                 # Scale factor for diminishing returns
-    novelty_boost=15.0      # Novelty boost bonus if user_clicks ~ 0
+    novelty_boost=15.0,     # Novelty boost bonus if user_clicks ~ 0
+    article_store=None,     # Precomputed ArticleStore for `articles` (built here if missing)
+    top_k=None,             # Only return the top_k articles (all articles if None)
+    article_index=None      # ArticleIndex over article_store: only score the user's candidates
 ):
 
-    # Base model predictions (scaled between 0 and 100)
-    all_features = []
-    for article in articles:
-        feat = build_user_article_feature(user, prefs_map, article)
-        all_features.append(feat)
+    if article_store is None:
+        article_store = build_article_store(articles)
+
+    user_pref = prefs_map.get(str(user["_id"]), {})
+    # Any user with click counts (custom or from the click log) gets the click reranking
+    has_clicks = bool(custom_cat_clicks or custom_tag_clicks)
+
+    # Candidate articles from the inverted index (every article without one)
+    rows = None
+    if article_index is not None:
+        with timed("candidates"):
+            rows = article_index.candidates(
+                user_pref.get("language", "english"),
+                user_pref.get("article_category", []),
+                tags=custom_tag_clicks or (),
+                min_candidates=len(article_store) if top_k is None else top_k
+            )
 
-    X = np.array(all_features, dtype=float)
-    predicted_scores = model.predict(X)
+    # Base model predictions (scaled between 0 and 100)
+    with timed("build_features"):
+        X = build_user_features(article_store, user_pref, rows=rows)
+    predicted_scores = predict_scores(model, X)
     base_scaled_scores = min_max_scale(predicted_scores)
 
-    # If not a custom user -> just return base scores
-    if str(user["_id"]) != "custom_user" or not custom_cat_clicks or not custom_tag_clicks:
-        return sorted(enumerate(base_scaled_scores), key=lambda x: x[1], reverse=True)
-
-    final_scores = []
-    user_lang = user.get("language", "english").lower()
-
-    for i, article in enumerate(articles):
-        base_score = base_scaled_scores[i]
-
-        # Startin with base score
-        score = base_score
-
-        # Diminishing Returns for clicked categories
-        cat_oids = article.get("category", [])
-        article_lang = article.get("language", "english").lower()
-
-        # Category Bonus & Tag Bonus are accumulated separately
-        cat_bonus = 0.0
-        for cdict in cat_oids:
-            oid = cdict.get("$oid")
-            if oid and category_map:
-                cat_name = category_map.get(oid, "unknown")
-                user_clicks = custom_cat_clicks.get(cat_name, 0)
-
-                # Diminishing returns formula
-                cat_bonus += alpha * (1.0 / (1.0 + user_clicks / k))
-
-        # Diminishing Returns for clicked tags
-        tag_bonus = 0.0
-        article_tags = article.get("tags", [])
-        for t in article_tags:
-
-            # if we had a tag map, we'd convert t -> tag_name (currently this is not handled)
-            # or if t is direct string -> just use t
-            if isinstance(t, str):
-                user_tag_clicks = custom_tag_clicks.get(t, 0)
-                tag_bonus += alpha * (1.0 / (1.0 + user_tag_clicks / k))
-
-        # Combining the category and tag bonus scores
-        score += (cat_bonus + tag_bonus)
-
-        # Novelty Boost (for near-zero clicks, which indicates that the user has rarely interacted with this type of article)
-        if article_lang == user_lang:
-            novelty_sum = 0.0
-            for cdict in cat_oids:
-                oid = cdict.get("$oid")
-                if oid and category_map:
-                    cat_name = category_map.get(oid, "unknown")
-                    user_clicks = custom_cat_clicks.get(cat_name, 0)
-
-                    # If user_clicks < 2 => big novelty boost
-                    # If user_clicks=1   => half novelty boost
-                    # If user_clicks=0   => full novelty boost
-                    # and so on...
-                    if user_clicks < 2:
-                        factor = max(0.0, (2 - user_clicks) / 2.0)  # range [1..0.5..0]
-                        novelty_sum += (novelty_boost * factor)
-
-            # Also checking tags for including in the novel boost
-            for t in article_tags:
-                if isinstance(t, str):
-                    user_tag_clicks = custom_tag_clicks.get(t, 0)
-                    if user_tag_clicks < 2:
-                        factor = max(0.0, (2 - user_tag_clicks) / 2.0)
-                        novelty_sum += (novelty_boost * factor)
-
-            score += novelty_sum
-
-        final_scores.append(score)
+    # Without click data -> just return base scores
+    if not has_clicks:
+        return _ranked_pairs(base_scaled_scores, top_k, rows)
+
+    final_scores = base_scaled_scores + click_bonus(
+        article_store,
+        user_pref.get("language", user.get("language", "english")),
+        category_map,
+        custom_cat_clicks or {},
+        custom_tag_clicks or {},
+        alpha=alpha,
+        k=k,
+        novelty_boost=novelty_boost,
+        rows=rows
+    )
 
     # Re-scale final scores to between 0 and 100 as integers in descending order
     final_scaled_scores = min_max_scale(final_scores)
-    ranked = sorted(enumerate(final_scaled_scores), key=lambda x: x[1], reverse=True)
-    return ranked
-
+    return _ranked_pairs(final_scaled_scores, top_k, rows)
+
+def click_bonus(article_store, user_language, category_map, custom_cat_clicks, custom_tag_clicks,
+                alpha=8.0, k=25.0, novelty_boost=15.0, rows=None):
+    """
+    Category/tag click bonus plus novelty boost for every article
+    (or only the article indices in `rows`), added on top of the base scores.
+    """
+    # Dense per-category / per-tag weights, then one sparse product for all articles
+    bonus_weights, novelty_weights = _click_weights(
+        article_store, category_map, custom_cat_clicks, custom_tag_clicks,
+        alpha=alpha, k=k, novelty_boost=novelty_boost
+    )
+    incidence = article_store.incidence_matrix()
+    lang_ids = article_store.lang_ids
+    if rows is not None:
+        incidence = incidence[rows]
+        lang_ids = lang_ids[rows]
+    bonuses = incidence @ np.column_stack([bonus_weights, novelty_weights])
+
+    # Novelty Boost only applies to articles in the user's language
+    same_lang = lang_ids == article_store.lang_index.get(user_language.lower(), -1)
+    return bonuses[:, 0] + np.where(same_lang, bonuses[:, 1], 0.0)
+
+def _click_weights(article_store, category_map, custom_cat_clicks, custom_tag_clicks,
+                   alpha=8.0, k=25.0, novelty_boost=15.0):
+    """
+    Per-column weights over article_store.incidence_matrix() (categories, then tags).
+
+    Returns (bonus, novelty):
+      bonus   = alpha / (1 + user_clicks / k)                  (diminishing returns)
+      novelty = novelty_boost * max(0, (2 - user_clicks) / 2)  (full boost at 0 clicks,
+                                                                half at 1, none from 2)
+    Categories only count when a category_map is given (OID -> name lookup).
+    """
+    if category_map:
+        cat_clicks = np.array([
+            custom_cat_clicks.get(category_map.get(oid, "unknown"), 0)
+            for oid in article_store.cat_vocab
+        ], dtype=float)
+        cat_on = 1.0
+    else:
+        cat_clicks = np.zeros(len(article_store.cat_vocab))
+        cat_on = 0.0
+    tag_clicks = np.array([
+        custom_tag_clicks.get(t, 0) for t in article_store.tag_vocab
+    ], dtype=float)
+
+    clicks = np.concatenate([cat_clicks, tag_clicks])
+    enabled = np.concatenate([
+        np.full(len(cat_clicks), cat_on), np.ones(len(tag_clicks))
+    ])
+    bonus = enabled * alpha * (1.0 / (1.0 + clicks / k))
+    novelty = enabled * novelty_boost * np.maximum(0.0, (2 - clicks) / 2.0)
+    return bonus, novelty
+
+def rank_articles_for_users(model, users, prefs_map, articles, article_store=None, top_k=100,
+                            article_index=None):
+    """
+    Base ranking for many users at once: one feature block, one model call.
+
+    Returns (indices, scores), both of shape (len(users), top_k), best first.
+    The feature block holds len(users) * len(articles) rows (len(users) *
+    candidates with an article_index), so callers ranking a whole user base
+    should pass users in chunks.
+    """
+    if article_store is None:
+        article_store = build_article_store(articles)
+
+    n_articles = len(article_store)
+    if not users or n_articles == 0:
+        empty = np.empty((len(users), 0), dtype=int)
+        return empty, empty.copy()
+
+    if article_index is not None:
+        return _rank_candidates(model, users, prefs_map, article_store, article_index, top_k)
+
+    with timed("build_features"):
+        X = build_users_features(article_store, [prefs_map.get(str(user["_id"]), {}) for user in users])
+    predicted_scores = predict_scores(model, X).reshape(len(users), n_articles)
+    scaled_scores = min_max_scale(predicted_scores)
+
+    indices = top_k_indices(scaled_scores, top_k)
+    return indices, np.take_along_axis(scaled_scores, indices, axis=-1)
+
+def _rank_candidates(model, users, prefs_map, article_store, article_index, top_k):
+    # rank_articles_for_users over each user's candidate rows (at least top_k per user)
+    width = len(article_store) if top_k is None else min(top_k, len(article_store))
+    prefs = [prefs_map.get(str(user["_id"]), {}) for user in users]
+    with timed("candidates"):
+        rows = [
+            article_index.candidates(
+                pref.get("language", "english"), pref.get("article_category", []), min_candidates=width
+            )
+            for pref in prefs
+        ]
+    with timed("build_features"):
+        X = np.concatenate([
+            build_user_features(article_store, pref, rows=user_rows)
+            for pref, user_rows in zip(prefs, rows)
+        ])
+    predicted_scores = predict_scores(model, X)
+    bounds = np.cumsum([0] + [len(user_rows) for user_rows in rows])
+
+    indices = np.empty((len(users), width), dtype=np.int64)
+    scores = np.empty((len(users), width), dtype=int)
+    for i, user_rows in enumerate(rows):
+        scaled_scores = min_max_scale(predicted_scores[bounds[i]:bounds[i + 1]])
+        local = top_k_indices(scaled_scores, width)
+        indices[i] = user_rows[local]
+        scores[i] = scaled_scores[local]
+    return indices, scores
+
+@timed("sort")
+def top_k_indices(scores, top_k=None):
+    """
+    Indices of the top_k integer scores along the last axis, best first.
+    Ties keep ascending article order (same as a stable descending sort),
+    using argpartition plus a sort of the top_k only.
+    """
+    scores = np.asarray(scores, dtype=np.int64)
+    n = scores.shape[-1]
+    if top_k is None or top_k > n:
+        top_k = n
+    if top_k == 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+
+    # Unique key per article: higher score first, then lower index first
+    keys = scores * n + (n - 1 - np.arange(n))
+    part = np.argpartition(-keys, top_k - 1, axis=-1)[..., :top_k]
+    order = np.argsort(-np.take_along_axis(keys, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+def _ranked_pairs(scaled_scores, top_k, rows=None):
+    # [(article_idx, score), ...] best first, as returned by rank_articles_for_user;
+    # rows maps positions in scaled_scores back to article indices
+    indices = top_k_indices(scaled_scores, top_k)
+    scores = np.asarray(scaled_scores)[indices]
+    if rows is not None:
+        indices = np.asarray(rows)[indices]
+    return list(zip(indices.tolist(), scores.tolist()))
+
+
+@timed("predict")
+def predict_scores(model, X):
+    # Bare Boosters predict in place without building a DMatrix; sklearn-style models use predict()
+    count("model_calls")
+    count("articles_scored", len(X))
+    if hasattr(model, "inplace_predict"):
+        return model.inplace_predict(X)
+    return model.predict(X)
 
 def min_max_scale(values):
+    # Scales to integers in [0..100] along the last axis (per user for 2-D input)
     arr = np.array(values, dtype=float)
-    mn = arr.min()
-    mx = arr.max()
-    if mx == mn:
-        return np.ones_like(arr, dtype=int) * 50
-    scaled = (arr - mn) / (mx - mn) * 100.0
+    mn = arr.min(axis=-1, keepdims=True)
+    mx = arr.max(axis=-1, keepdims=True)
+    span = mx - mn
+    scaled = np.divide(arr - mn, span, out=np.full_like(arr, 0.5), where=span > 0) * 100.0
     return np.round(scaled).astype(int)
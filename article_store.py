@@ -0,0 +1,574 @@
+import datetime
+import numpy as np
+import scipy.sparse as sp
+
+DEFAULT_UPDATED_AT = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+SECONDS_PER_DAY = 86400.0
+
+# Category sets over at most MAX_BITMASK_WORDS * 64 categories are intersected as
+# packed uint64 bitmasks (AND + popcount); larger vocabularies use a sparse product,
+# which is already faster from two words on
+MAX_BITMASK_WORDS = 1
+
+def parse_timestamp(updated_at_val):
+    """
+    Parses an 'updatedAt' value into epoch seconds (UTC).
+    Accepts an ISO string, a {"$date": "..."} dict or a datetime object.
+    """
+    if isinstance(updated_at_val, datetime.datetime):
+        dt = updated_at_val
+    else:
+        if isinstance(updated_at_val, dict):
+            updated_str = updated_at_val.get("$date", "")
+        elif isinstance(updated_at_val, str):
+            updated_str = updated_at_val
+        else:
+            updated_str = ""
+
+        try:
+            dt = datetime.datetime.fromisoformat(updated_str.replace("Z", "+00:00"))
+        except (ValueError, AttributeError):
+            dt = DEFAULT_UPDATED_AT
+
+    # Naive timestamps are treated as UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+def doc_id(doc):
+    # Document '_id' as a string, whether plain, {"$oid": ...} or an ObjectId
+    value = doc.get("_id")
+    if isinstance(value, dict):
+        value = value.get("$oid", "")
+    return str(value)
+
+def _oid(value):
+    # Category reference as {"$oid": ...} (JSON exports) or an ObjectId / string (MongoDB)
+    if isinstance(value, dict):
+        return value.get("$oid")
+    if value is None:
+        return None
+    return str(value)
+
+class ArticleStore:
+    """
+    Column-oriented view of the article corpus, normalized once at load time.
+
+    Columns (one row per article):
+        article_ids : article OID strings
+        lang_ids    : interned language codes (index into lang_vocab)
+        updated_at  : parsed 'updatedAt' as epoch seconds
+        primary_cat : index of the first listed category (-1 if none)
+    Titles are UTF-8 encoded back to back in title_data, split by title_offsets.
+    Categories are kept in CSR form (cat_indptr, cat_indices, cat_counts),
+    where cat_indices index into cat_vocab and cat_counts holds how often
+    the category appears in the article's raw category list.
+    String tags are kept the same way (tag_indptr, tag_indices, tag_counts, tag_vocab).
+    """
+
+    # Array attributes written to / read back from a snapshot, see to_arrays()
+    ARRAY_FIELDS = (
+        "article_ids", "lang_ids", "lang_vocab", "updated_at", "primary_cat",
+        "title_data", "title_offsets",
+        "cat_indptr", "cat_indices", "cat_counts", "cat_vocab",
+        "tag_indptr", "tag_indices", "tag_counts", "tag_vocab",
+    )
+
+    def __init__(self, article_ids, lang_ids, lang_vocab, updated_at, primary_cat,
+                 title_data, title_offsets,
+                 cat_indptr, cat_indices, cat_counts, cat_vocab,
+                 tag_indptr, tag_indices, tag_counts, tag_vocab):
+        self.article_ids = article_ids
+        self.lang_ids = lang_ids
+        self.lang_vocab = list(lang_vocab)
+        self.updated_at = updated_at
+        self.primary_cat = primary_cat
+        self.title_data = title_data
+        self.title_offsets = title_offsets
+        self.cat_indptr = cat_indptr
+        self.cat_indices = cat_indices
+        self.cat_counts = cat_counts
+        self.cat_vocab = list(cat_vocab)
+        self.tag_indptr = tag_indptr
+        self.tag_indices = tag_indices
+        self.tag_counts = tag_counts
+        self.tag_vocab = list(tag_vocab)
+
+        self.lang_index = {lang: i for i, lang in enumerate(self.lang_vocab)}
+        self.cat_index = {oid: i for i, oid in enumerate(self.cat_vocab)}
+
+        # Row id of every CSR entry, used to reduce per-entry values per article
+        self.cat_rows = np.repeat(
+            np.arange(len(self.article_ids), dtype=np.int64),
+            np.diff(self.cat_indptr)
+        )
+        self._incidence = None
+        self._cat_matrix = None
+        self._cat_bitmasks = None
+        self._id_index = None
+        self._days_old = None   # (as_of, days_old column) set by set_days_old()
+
+    def __len__(self):
+        return len(self.article_ids)
+
+    def id_index(self):
+        # article id -> row, built on first use
+        if self._id_index is None:
+            self._id_index = {aid: i for i, aid in enumerate(self.article_ids.tolist())}
+        return self._id_index
+
+    def title(self, i):
+        start, end = self.title_offsets[i], self.title_offsets[i + 1]
+        return bytes(self.title_data[start:end]).decode("utf-8")
+
+    def primary_category(self, i):
+        # OID of the article's first category, or None
+        cid = self.primary_cat[i]
+        return self.cat_vocab[cid] if cid >= 0 else None
+
+    def to_arrays(self):
+        """
+        Plain NumPy arrays for every column, suitable for np.save.
+        Vocabularies are stored as unicode arrays.
+        """
+        arrays = {}
+        for name in self.ARRAY_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = np.array(value, dtype=str)
+            arrays[name] = value
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # Inverse of to_arrays(); arrays may be read-only memory maps
+        kwargs = {name: arrays[name] for name in cls.ARRAY_FIELDS}
+        for name in ("lang_vocab", "cat_vocab", "tag_vocab"):
+            kwargs[name] = np.asarray(kwargs[name]).tolist()
+        return cls(**kwargs)
+
+    def category_mask(self, category_oids):
+        # Boolean vector over cat_vocab marking the given category OIDs
+        mask = np.zeros(len(self.cat_vocab), dtype=bool)
+        idx = [self.cat_index[oid] for oid in category_oids if oid in self.cat_index]
+        mask[idx] = True
+        return mask
+
+    def category_overlap(self, category_oids, rows=None):
+        # Number of distinct categories each article (or each of `rows`) shares with category_oids
+        mask = self.category_mask(category_oids)
+        if rows is None:
+            return np.bincount(
+                self.cat_rows,
+                weights=mask[self.cat_indices],
+                minlength=len(self)
+            )
+        starts = self.cat_indptr[rows]
+        lengths = self.cat_indptr[np.asarray(rows) + 1] - starts
+        local_rows = np.repeat(np.arange(len(starts)), lengths)
+        entries = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        entries += np.repeat(starts, lengths)
+        return np.bincount(
+            local_rows,
+            weights=mask[self.cat_indices[entries]],
+            minlength=len(starts)
+        )
+
+    def encode_categories(self, category_lists):
+        # CSR (indptr, indices) over cat_vocab of category OID lists; unknown OIDs are dropped
+        indices = [
+            [self.cat_index[oid] for oid in oids if oid in self.cat_index]
+            for oids in category_lists
+        ]
+        indptr = np.concatenate([[0], np.cumsum([len(idx) for idx in indices])]).astype(np.int64)
+        flat = np.fromiter((i for idx in indices for i in idx), dtype=np.int64, count=indptr[-1])
+        return indptr, flat
+
+    def category_matrix(self):
+        # Sparse boolean articles x categories matrix (presence, not counts), built on first use
+        if self._cat_matrix is None:
+            self._cat_matrix = boolean_csr(self.cat_indptr, self.cat_indices, len(self.cat_vocab))
+        return self._cat_matrix
+
+    def category_bitmasks(self):
+        # Categories of every article packed into uint64 words (see pack_bitmasks), built on first use
+        if self._cat_bitmasks is None:
+            self._cat_bitmasks = pack_bitmasks(self.cat_indptr, self.cat_indices, len(self.cat_vocab))
+        return self._cat_bitmasks
+
+    def incidence_matrix(self):
+        """
+        Sparse articles x (categories + tags) count matrix, built on first use.
+        Columns [0, len(cat_vocab)) are categories, the rest are tags.
+        """
+        if self._incidence is None:
+            n = len(self)
+            categories = sp.csr_matrix(
+                (self.cat_counts, self.cat_indices, self.cat_indptr),
+                shape=(n, len(self.cat_vocab))
+            )
+            tags = sp.csr_matrix(
+                (self.tag_counts, self.tag_indices, self.tag_indptr),
+                shape=(n, len(self.tag_vocab))
+            )
+            self._incidence = sp.hstack([categories, tags], format="csr", dtype=float)
+        return self._incidence
+
+    def set_days_old(self, days_old, as_of):
+        """
+        Pins the days_old column to values computed at time as_of; days_old()
+        without an explicit `now` then returns them instead of recomputing.
+        """
+        self._days_old = (as_of, np.asarray(days_old, dtype=float))
+
+    def days_old_reference(self):
+        # Time the pinned days_old column refers to (None if not pinned)
+        return None if self._days_old is None else self._days_old[0]
+
+    def days_old(self, now=None, rows=None):
+        # Whole days since each article (or each of `rows`) was updated, never negative
+        if now is None and self._days_old is not None:
+            days = self._days_old[1]
+            return days if rows is None else days[rows]
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        updated_at = self.updated_at if rows is None else self.updated_at[rows]
+        days = np.floor((now - updated_at) / SECONDS_PER_DAY)
+        return np.maximum(days, 0.0)
+
+def build_article_store(articles, lang_vocab=(), cat_vocab=(), tag_vocab=()):
+    """
+    Normalizes a list of article documents into an ArticleStore.
+    This is the only place that walks the article dicts in Python.
+    The vocabularies start from the given ones (extended as needed), so
+    stores built from a subset of articles share ids with an existing store.
+    """
+    lang_index = {v: i for i, v in enumerate(lang_vocab)}
+    cat_index = {v: i for i, v in enumerate(cat_vocab)}
+    tag_index = {v: i for i, v in enumerate(tag_vocab)}
+
+    article_ids = []
+    lang_ids = []
+    updated_at = []
+    primary_cat = []
+    titles = []
+    cat_indptr = [0]
+    cat_indices = []
+    cat_counts = []
+    tag_indptr = [0]
+    tag_indices = []
+    tag_counts = []
+
+    for article in articles:
+        article_ids.append(doc_id(article))
+
+        lang = article.get("language", "english").lower()
+        lang_ids.append(lang_index.setdefault(lang, len(lang_index)))
+
+        updated_at.append(parse_timestamp(article.get("updatedAt")))
+        titles.append(str(article.get("title", "Untitled Article")).encode("utf-8"))
+
+        # Collapsing repeated categories into (category, count) pairs
+        counts = {}
+        first_cid = -1
+        for pos, c in enumerate(article.get("category", [])):
+            oid = _oid(c)
+            if oid:
+                cid = cat_index.setdefault(oid, len(cat_index))
+                counts[cid] = counts.get(cid, 0) + 1
+                if pos == 0:
+                    first_cid = cid
+        primary_cat.append(first_cid)
+        cat_indices.extend(counts.keys())
+        cat_counts.extend(counts.values())
+        cat_indptr.append(len(cat_indices))
+
+        counts = {}
+        for t in article.get("tags", []):
+            if isinstance(t, str):
+                tid = tag_index.setdefault(t, len(tag_index))
+                counts[tid] = counts.get(tid, 0) + 1
+        tag_indices.extend(counts.keys())
+        tag_counts.extend(counts.values())
+        tag_indptr.append(len(tag_indices))
+
+    return ArticleStore(
+        article_ids=np.array(article_ids, dtype=str),
+        lang_ids=np.array(lang_ids, dtype=np.int32),
+        lang_vocab=list(lang_index),
+        updated_at=np.array(updated_at, dtype=np.float64),
+        primary_cat=np.array(primary_cat, dtype=np.int32),
+        title_data=np.frombuffer(b"".join(titles), dtype=np.uint8),
+        title_offsets=np.concatenate([[0], np.cumsum([len(t) for t in titles])]).astype(np.int64),
+        cat_indptr=np.array(cat_indptr, dtype=np.int64),
+        cat_indices=np.array(cat_indices, dtype=np.int32),
+        cat_counts=np.array(cat_counts, dtype=np.int32),
+        cat_vocab=list(cat_index),
+        tag_indptr=np.array(tag_indptr, dtype=np.int64),
+        tag_indices=np.array(tag_indices, dtype=np.int32),
+        tag_counts=np.array(tag_counts, dtype=np.int32),
+        tag_vocab=list(tag_index),
+    )
+
+def update_article_store(store, articles):
+    """
+    Applies changed or new article documents to a store.
+
+    Rows of changed articles are rewritten in place and new articles are
+    appended; the other rows are copied with array operations only, so the
+    Python-level work is proportional to len(articles). Returns a new store;
+    `store` is left unchanged (its id index is copied, not extended).
+    """
+    # The last version of a document wins
+    articles = list({doc_id(a): a for a in articles}.values())
+    if not articles:
+        return store
+
+    delta = build_article_store(
+        articles, lang_vocab=store.lang_vocab, cat_vocab=store.cat_vocab, tag_vocab=store.tag_vocab
+    )
+    index = dict(store.id_index())
+    n_rows = len(store)
+    target = np.empty(len(delta), dtype=np.int64)
+    for j, aid in enumerate(delta.article_ids.tolist()):
+        if aid not in index:
+            index[aid] = n_rows
+            n_rows += 1
+        target[j] = index[aid]
+
+    def column(name):
+        return splice_column(getattr(store, name), getattr(delta, name), target, n_rows)
+
+    title_offsets, (title_data,) = splice_csr(
+        store.title_offsets, (store.title_data,), delta.title_offsets, (delta.title_data,), target, n_rows
+    )
+    cat_indptr, (cat_indices, cat_counts) = splice_csr(
+        store.cat_indptr, (store.cat_indices, store.cat_counts),
+        delta.cat_indptr, (delta.cat_indices, delta.cat_counts), target, n_rows
+    )
+    tag_indptr, (tag_indices, tag_counts) = splice_csr(
+        store.tag_indptr, (store.tag_indices, store.tag_counts),
+        delta.tag_indptr, (delta.tag_indices, delta.tag_counts), target, n_rows
+    )
+
+    updated = ArticleStore(
+        article_ids=column("article_ids"),
+        lang_ids=column("lang_ids"),
+        lang_vocab=delta.lang_vocab,
+        updated_at=column("updated_at"),
+        primary_cat=column("primary_cat"),
+        title_data=title_data,
+        title_offsets=title_offsets,
+        cat_indptr=cat_indptr,
+        cat_indices=cat_indices,
+        cat_counts=cat_counts,
+        cat_vocab=delta.cat_vocab,
+        tag_indptr=tag_indptr,
+        tag_indices=tag_indices,
+        tag_counts=tag_counts,
+        tag_vocab=delta.tag_vocab,
+    )
+    updated._id_index = index
+    return updated
+
+def filter_article_store(store, keep):
+    """
+    Copy of a store without the rows where keep is False.
+    Vocabularies are unchanged; the id index is rebuilt lazily.
+    """
+    keep = np.asarray(keep, dtype=bool)
+    n_rows = len(store)
+    target = np.empty(0, dtype=np.int64)
+
+    def column(name):
+        values = getattr(store, name)
+        return splice_column(values, values[:0], target, n_rows, keep=keep)
+
+    def csr(indptr, columns):
+        return splice_csr(indptr, columns, np.zeros(1, dtype=np.int64),
+                          tuple(np.asarray(c)[:0] for c in columns), target, n_rows, keep=keep)
+
+    title_offsets, (title_data,) = csr(store.title_offsets, (store.title_data,))
+    cat_indptr, (cat_indices, cat_counts) = csr(store.cat_indptr, (store.cat_indices, store.cat_counts))
+    tag_indptr, (tag_indices, tag_counts) = csr(store.tag_indptr, (store.tag_indices, store.tag_counts))
+
+    return ArticleStore(
+        article_ids=column("article_ids"),
+        lang_ids=column("lang_ids"),
+        lang_vocab=store.lang_vocab,
+        updated_at=column("updated_at"),
+        primary_cat=column("primary_cat"),
+        title_data=title_data,
+        title_offsets=title_offsets,
+        cat_indptr=cat_indptr,
+        cat_indices=cat_indices,
+        cat_counts=cat_counts,
+        cat_vocab=store.cat_vocab,
+        tag_indptr=tag_indptr,
+        tag_indices=tag_indices,
+        tag_counts=tag_counts,
+        tag_vocab=store.tag_vocab,
+    )
+
+def splice_column(column, new_values, target, n_rows, keep=None):
+    """
+    Copy of a per-row column with rows `target` set to new_values,
+    grown to n_rows, optionally dropping rows where keep is False.
+    """
+    out = np.empty(n_rows, dtype=np.result_type(column, new_values))
+    out[:len(column)] = column
+    out[target] = new_values
+    return out if keep is None else out[keep]
+
+def splice_csr(indptr, columns, new_indptr, new_columns, target, n_rows, keep=None):
+    """
+    CSR counterpart of splice_column: row target[j] is replaced by row j of
+    (new_indptr, new_columns). columns are the parallel per-entry arrays.
+    Returns (indptr, columns).
+    """
+    n_old = len(indptr) - 1
+    old_lengths = np.diff(indptr)
+    new_lengths = np.diff(new_indptr)
+
+    overwritten = np.zeros(n_rows, dtype=bool)
+    overwritten[target] = True
+
+    # Entries of untouched old rows plus all new entries, grouped by final row
+    old_rows = np.repeat(np.arange(n_old, dtype=np.int64), old_lengths)
+    old_kept = ~overwritten[old_rows]
+    rows = np.concatenate([old_rows[old_kept], np.repeat(target, new_lengths)])
+    order = np.argsort(rows, kind="stable")
+    out_columns = [
+        np.concatenate([np.asarray(old)[old_kept], np.asarray(new)])[order]
+        for old, new in zip(columns, new_columns)
+    ]
+
+    lengths = np.zeros(n_rows, dtype=np.int64)
+    lengths[:n_old] = old_lengths
+    lengths[target] = new_lengths
+
+    if keep is not None:
+        entry_kept = keep[rows[order]]
+        out_columns = [col[entry_kept] for col in out_columns]
+        lengths = lengths[keep]
+
+    out_indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return out_indptr, tuple(out_columns)
+
+def pack_bitmasks(indptr, indices, n_bits):
+    """
+    Packs CSR rows of bit positions into an (n_rows, ceil(n_bits / 64)) uint64
+    array: bit i of a row is set when i is listed in the row (duplicates are harmless).
+    """
+    n_rows = len(indptr) - 1
+    masks = np.zeros((n_rows, max(1, -(-n_bits // 64))), dtype=np.uint64)
+    indices = np.asarray(indices, dtype=np.int64)
+    rows = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(indptr))
+    bits = np.left_shift(np.uint64(1), (indices & 63).astype(np.uint64))
+    np.bitwise_or.at(masks, (rows, indices >> 6), bits)
+    return masks
+
+def category_overlaps(store, indptr, indices, rows=None):
+    """
+    Number of distinct categories each category set shares with each article
+    (or each of the article rows in `rows`), for all pairs at once.
+
+    The sets are CSR rows (indptr, indices) over store.cat_vocab, e.g. from
+    store.encode_categories(). Returns an (n_sets, n_articles) integer matrix:
+    popcounts of AND-ed bitmasks for small vocabularies, otherwise the
+    product of the sets x categories and categories x articles boolean matrices.
+    """
+    n_sets = len(indptr) - 1
+    n_cats = len(store.cat_vocab)
+    if -(-n_cats // 64) <= MAX_BITMASK_WORDS:
+        article_masks = store.category_bitmasks()
+        if rows is not None:
+            article_masks = article_masks[rows]
+        set_masks = pack_bitmasks(indptr, indices, n_cats)
+        overlaps = np.zeros((n_sets, len(article_masks)), dtype=np.uint16)
+        for w in range(set_masks.shape[1]):
+            overlaps += np.bitwise_count(set_masks[:, w, None] & article_masks[None, :, w])
+        return overlaps
+
+    articles = store.category_matrix()
+    if rows is not None:
+        articles = articles[rows]
+    sets = boolean_csr(indptr, indices, n_cats)
+    return (sets @ articles.T).toarray()
+
+def boolean_csr(indptr, indices, n_cols):
+    # 0/1 CSR matrix with duplicate entries of a row merged; the index arrays are
+    # copied, as merging sorts them in place (and store columns may be read-only maps)
+    matrix = sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), np.array(indices), np.array(indptr)),
+        shape=(len(indptr) - 1, n_cols)
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+def build_user_features(store, user_pref, now=None, rows=None):
+    """
+    Vectorized equivalent of utils.build_user_article_feature for one user
+    against every article in the store, or only the article rows in `rows`.
+
+    Returns an array of shape (n_articles, 4) (or (len(rows), 4)):
+      [language_feature, lang_match, cat_overlap, days_old].
+    """
+    user_language = user_pref.get("language", "english").lower()
+    language_feature = 1 if user_language == "english" else 2
+    lang_ids = store.lang_ids if rows is None else store.lang_ids[rows]
+
+    X = np.empty((len(lang_ids), 4), dtype=float)
+    X[:, 0] = language_feature
+    X[:, 1] = lang_ids == store.lang_index.get(user_language, -1)
+    X[:, 2] = store.category_overlap(user_pref.get("article_category", []), rows=rows)
+    X[:, 3] = store.days_old(now, rows=rows)
+    return X
+
+def build_users_features(store, user_prefs, now=None, rows=None, dtype=float, keep=None):
+    """
+    build_user_features for many users at once: the blocks of every user in
+    user_prefs, concatenated in order (shape (len(user_prefs) * n_articles, 4)).
+    The category overlaps of all users come from one category_overlaps call.
+    With keep (flat indices into that block), only those rows are built.
+    """
+    return stack_users_features(store, users_match_columns(store, user_prefs, rows=rows), now=now,
+                                rows=rows, dtype=dtype, keep=keep)
+
+def users_match_columns(store, user_prefs, rows=None):
+    """
+    The user-dependent inputs of build_users_features:
+    (language_feature per user, lang_match and cat_overlap of shape (n_users, n_articles)).
+    Far smaller than the feature block, e.g. to select pairs before building it.
+    """
+    lang_ids = store.lang_ids if rows is None else store.lang_ids[rows]
+    languages = [pref.get("language", "english").lower() for pref in user_prefs]
+    user_lang_ids = np.array([store.lang_index.get(lang, -1) for lang in languages], dtype=np.int64)
+
+    language_feature = np.where(np.array(languages, dtype=object) == "english", 1, 2)
+    lang_match = lang_ids[None, :] == user_lang_ids[:, None]
+    cat_overlap = category_overlaps(
+        store, *store.encode_categories(pref.get("article_category", []) for pref in user_prefs), rows=rows
+    )
+    return language_feature, lang_match, cat_overlap
+
+def stack_users_features(store, match_columns, now=None, rows=None, dtype=float, keep=None):
+    # The feature block of build_users_features from users_match_columns output (rows `keep` only, if given)
+    language_feature, lang_match, cat_overlap = match_columns
+    n_users, n = lang_match.shape
+    days_old = store.days_old(now, rows=rows)
+    if keep is None:
+        X = np.empty((n_users, n, 4), dtype=dtype)
+        X[:, :, 0] = language_feature[:, None]
+        X[:, :, 1] = lang_match
+        X[:, :, 2] = cat_overlap
+        X[:, :, 3] = days_old[None, :]
+        return X.reshape(-1, 4)
+
+    X = np.empty((len(keep), 4), dtype=dtype)
+    X[:, 0] = language_feature[keep // n]
+    X[:, 1] = lang_match.ravel()[keep]
+    X[:, 2] = cat_overlap.ravel()[keep]
+    X[:, 3] = days_old[keep % n]
+    return X
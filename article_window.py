@@ -0,0 +1,98 @@
+import datetime
+import numpy as np
+
+from article_index import ArticleIndex
+from article_store import SECONDS_PER_DAY, filter_article_store, parse_timestamp, update_article_store
+
+# Default freshness horizon for the active news window
+DEFAULT_HORIZON_DAYS = 30
+
+class ArticleWindow:
+    """
+    Active news window: the articles updated within the last horizon_days,
+    partitioned into day buckets, with an ArticleIndex over them.
+
+    Bucket b holds the articles with updated_at in (anchor + (b-1) days,
+    anchor + b days], where anchor is the time of day of the daily refresh
+    (seconds after midnight UTC). At a refresh time as_of = anchor + m days
+    every article of bucket b is exactly m - b days old, so days_old is set
+    per bucket once a day and pinned on the store until the next refresh.
+    Buckets older than the horizon are evicted at each refresh, and arriving
+    articles join their bucket through add(). Stores are never changed in
+    place: each refresh pins days_old on a new copy, so the store passed in
+    (e.g. the shared corpus store) and a store that requests in flight are
+    still ranking over keep their values.
+    """
+
+    def __init__(self, article_store, horizon_days=DEFAULT_HORIZON_DAYS, anchor=0.0, now=None,
+                 **index_params):
+        self.horizon_days = horizon_days
+        self.anchor = anchor
+        self.index_params = index_params
+        self.article_store = article_store
+        self.article_index = None
+        self.row_buckets = None
+        self.as_of = None
+        self.refresh(now, force=True)
+
+    def __len__(self):
+        return len(self.article_store)
+
+    def bucket_sizes(self):
+        # {bucket: number of articles}, oldest first
+        buckets, counts = np.unique(self.row_buckets, return_counts=True)
+        return dict(zip(buckets.tolist(), counts.tolist()))
+
+    def refresh(self, now=None, force=False):
+        """
+        Advances the window to the latest daily refresh time before now:
+        evicts the buckets that aged out and moves days_old on by a day.
+        Returns True if the window changed.
+        """
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        as_of = self.anchor + np.floor((now - self.anchor) / SECONDS_PER_DAY) * SECONDS_PER_DAY
+        if as_of == self.as_of and not force:
+            return False
+        self.as_of = float(as_of)
+        self._apply(self.article_store)
+        return True
+
+    def add(self, articles):
+        """
+        Adds new or updated article documents. Articles already older than
+        the horizon are ignored. Returns True if the window changed.
+        """
+        day = self._today()
+        fresh = [
+            article for article in articles
+            if self._bucket(parse_timestamp(article.get("updatedAt"))) >= day - self.horizon_days
+        ]
+        if not fresh:
+            return False
+        self._apply(update_article_store(self.article_store, fresh))
+        return True
+
+    def _today(self):
+        return int(round((self.as_of - self.anchor) / SECONDS_PER_DAY))
+
+    def _bucket(self, updated_at):
+        return np.ceil((np.asarray(updated_at) - self.anchor) / SECONDS_PER_DAY).astype(np.int64)
+
+    def _apply(self, store):
+        # Evicting aged-out buckets, then pinning days_old and rebuilding the index
+        day = self._today()
+        buckets = self._bucket(store.updated_at)
+        keep = buckets >= day - self.horizon_days
+        store = filter_article_store(store, keep)
+        buckets = buckets[keep]
+
+        # days_old per bucket from its upper boundary (articles dated in the future count as 0)
+        first = buckets.min() if len(buckets) else day
+        last = max(buckets.max() if len(buckets) else day, day)
+        bucket_days = np.maximum(day - np.arange(first, last + 1), 0).astype(float)
+        store.set_days_old(bucket_days[buckets - first], self.as_of)
+
+        self.article_store = store
+        self.row_buckets = buckets
+        self.article_index = ArticleIndex(store, **self.index_params)
@@ -0,0 +1,326 @@
+import copy
+import datetime
+import hashlib
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pymongo import UpdateOne
+
+from article_index import ArticleIndex
+from article_ranking import rank_articles_for_users
+from article_store import SECONDS_PER_DAY, ArticleStore
+from article_window import ArticleWindow
+from compiled_scorer import get_compiled_scorer
+from data_loader import DATA_FOLDER
+from db_connection import get_database_connection
+from instrumentation import count, timed
+from model_training import load_model, resolve_model_path
+from ranking_cache import cache_version
+from snapshot import load_corpus
+
+BATCH_FOLDER = os.path.join(DATA_FOLDER, "batch")
+FEEDS_COLLECTION = "user_feeds"
+OUTPUT_FORMATS = ("npz", "ndjson", "mongo")
+
+# Users ranked per task (one feature block and one model call per chunk)
+DEFAULT_CHUNK_SIZE = 256
+
+# Chunks submitted ahead of the writer, per worker, so results never pile up in memory
+TASKS_IN_FLIGHT_PER_WORKER = 4
+
+def run_batch(use_local_json=True, output="npz", top_k=100, chunk_size=DEFAULT_CHUNK_SIZE, workers=None,
+              folder=BATCH_FOLDER, horizon_days=None, restart=False, db=None):
+    """
+    Precomputes the top_k feed of every rankable user (the user store holds the
+    de-duplicated users with at least one preferred category).
+
+    Users are ranked in chunks of chunk_size across `workers` processes, which
+    memory-map the article columns written to folder/. Feeds are written in
+    user order by this process:
+      npz    : folder/parts/ during the run, merged into folder/feeds.npz
+      ndjson : folder/feeds.ndjson, one {"user_id", "articles", "scores"} per line
+      mongo  : upserts into the FEEDS_COLLECTION collection (unordered bulk writes)
+    After each written chunk the next user offset is checkpointed, so an
+    interrupted run resumes where it stopped unless restart=True. The checkpoint
+    is tied to the corpus, model and settings; any change starts a new run.
+    Returns where the feeds were written.
+    """
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown output format: {output}")
+
+    model_path = resolve_model_path()
+    model = load_model(model_path)
+    get_compiled_scorer(model, model_path=model_path)
+
+    article_store, user_store, _ = load_corpus(use_local_json=use_local_json)
+    if horizon_days is not None:
+        article_window = ArticleWindow(article_store, horizon_days=horizon_days)
+        article_store = article_window.article_store
+    else:
+        # days_old as of the last midnight (UTC): every chunk scores against the same
+        # values however long the run takes, and a resume on the same day matches the run key.
+        # They are pinned on a shallow copy, so the store load_corpus returned is unchanged
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        as_of = np.floor(now / SECONDS_PER_DAY) * SECONDS_PER_DAY
+        article_store = copy.copy(article_store)
+        article_store.set_days_old(article_store.days_old(as_of), as_of)
+    article_index = ArticleIndex(article_store)
+
+    run_key = _run_key(article_store, user_store, model_path, article_index, output, top_k, chunk_size)
+    checkpoint = None if restart else _load_checkpoint(folder, run_key)
+    if checkpoint is None:
+        shutil.rmtree(folder, ignore_errors=True)
+        checkpoint = {"run": run_key, "next_user": 0, "bytes": 0}
+    os.makedirs(folder, exist_ok=True)
+    _write_worker_inputs(folder, article_store)
+
+    n_users = len(user_store)
+    start = checkpoint["next_user"]
+    if start:
+        print(f"Resuming batch ranking at user {start} of {n_users}")
+
+    writer = _open_writer(output, folder, article_store, checkpoint, db)
+    tasks = ((offset, _chunk_prefs(user_store, offset, chunk_size))
+             for offset in range(start, n_users, chunk_size))
+    for offset, user_ids, indices, scores in _rank_chunks(tasks, folder, model_path, top_k, workers):
+        with timed("batch_write"):
+            checkpoint["bytes"] = writer.write(offset, user_ids, indices, scores)
+        checkpoint["next_user"] = offset + len(user_ids)
+        _save_checkpoint(folder, checkpoint)
+        count("batch_users_ranked", len(user_ids))
+        print(f"Ranked {checkpoint['next_user']}/{n_users} users", end="\r", flush=True)
+
+    result = writer.close()
+    # A finished run leaves no checkpoint, so the next run starts from the first user
+    # (a run without users never saved one)
+    checkpoint_path = os.path.join(folder, "checkpoint.json")
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    shutil.rmtree(os.path.join(folder, "articles"), ignore_errors=True)
+    print(f"\nFeeds of {n_users} users written to {result}")
+    return result
+
+def load_feeds(path=os.path.join(BATCH_FOLDER, "feeds.npz")):
+    # The merged npz feeds as a dict of arrays (user_ids sorted, see feed_for_user)
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+def feed_for_user(feeds, user_id):
+    """
+    [(article_id, score), ...] best first for user_id from load_feeds(),
+    or None if the user has no precomputed feed.
+    """
+    user_ids = feeds["user_ids"]
+    i = np.searchsorted(user_ids, user_id)
+    if i == len(user_ids) or user_ids[i] != user_id:
+        return None
+    valid = feeds["indices"][i] >= 0
+    return list(zip(feeds["article_ids"][feeds["indices"][i][valid]].tolist(),
+                    feeds["scores"][i][valid].tolist()))
+
+def _rank_chunks(tasks, folder, model_path, top_k, workers):
+    # (offset, user_ids, indices, scores) per task, in task order
+    if workers == 1:
+        _init_batch_worker(folder, model_path, top_k)
+        for task in tasks:
+            yield _rank_chunk(task)
+        return
+
+    in_flight = TASKS_IN_FLIGHT_PER_WORKER * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(folder, model_path, top_k)) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(_rank_chunk, task))
+            if len(pending) >= in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+_worker_state = {}
+
+def _init_batch_worker(folder, model_path, top_k):
+    store_folder = os.path.join(folder, "articles")
+    article_store = ArticleStore.from_arrays({
+        name: np.load(os.path.join(store_folder, f"{name}.npy"), mmap_mode="r")
+        for name in ArticleStore.ARRAY_FIELDS
+    })
+    with open(os.path.join(store_folder, "days_old.json"), "r", encoding="utf-8") as f:
+        as_of = json.load(f)["as_of"]
+    article_store.set_days_old(np.load(os.path.join(store_folder, "days_old.npy")), as_of)
+
+    model = load_model(model_path)
+    _worker_state.update(
+        model=get_compiled_scorer(model, model_path=model_path),
+        article_store=article_store,
+        article_index=ArticleIndex(article_store),
+        top_k=top_k,
+    )
+
+def _rank_chunk(task):
+    offset, prefs = task
+    state = _worker_state
+    prefs_map = {pref["user_id"]: pref for pref in prefs}
+    indices, scores = rank_articles_for_users(
+        state["model"],
+        [{"_id": pref["user_id"]} for pref in prefs],
+        prefs_map,
+        None,
+        article_store=state["article_store"],
+        top_k=state["top_k"],
+        article_index=state["article_index"]
+    )
+    user_ids = [pref["user_id"] for pref in prefs]
+    return offset, user_ids, indices.astype(np.int32), scores.astype(np.uint8)
+
+def _chunk_prefs(user_store, offset, chunk_size):
+    return [user_store.pref(i) for i in range(offset, min(offset + chunk_size, len(user_store)))]
+
+def _write_worker_inputs(folder, article_store):
+    # Article columns and the pinned days_old, memory-mapped by every worker
+    store_folder = os.path.join(folder, "articles")
+    os.makedirs(store_folder, exist_ok=True)
+    for name, arr in article_store.to_arrays().items():
+        np.save(os.path.join(store_folder, f"{name}.npy"), np.asarray(arr))
+    np.save(os.path.join(store_folder, "days_old.npy"), article_store.days_old())
+    with open(os.path.join(store_folder, "days_old.json"), "w", encoding="utf-8") as f:
+        json.dump({"as_of": article_store.days_old_reference()}, f)
+
+def _run_key(article_store, user_store, model_path, article_index, output, top_k, chunk_size):
+    h = hashlib.sha256()
+    h.update(cache_version(article_store, model_path, article_index).encode("utf-8"))
+    h.update(np.ascontiguousarray(user_store.user_ids).tobytes())
+    h.update(np.ascontiguousarray(user_store.cat_indptr).tobytes())
+    h.update(np.ascontiguousarray(user_store.cat_indices).tobytes())
+    h.update(f"{output},{top_k},{chunk_size}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def _load_checkpoint(folder, run_key):
+    # The checkpoint of an interrupted run with the same key, or None
+    path = os.path.join(folder, "checkpoint.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    return checkpoint if checkpoint.get("run") == run_key else None
+
+def _save_checkpoint(folder, checkpoint):
+    path = os.path.join(folder, "checkpoint.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+def _open_writer(output, folder, article_store, checkpoint, db):
+    if output == "ndjson":
+        return _NdjsonWriter(os.path.join(folder, "feeds.ndjson"), article_store, checkpoint["bytes"])
+    if output == "npz":
+        return _NpzWriter(folder, article_store, checkpoint["next_user"])
+    if db is None:
+        db = get_database_connection()
+    return _MongoWriter(db[FEEDS_COLLECTION], article_store)
+
+class _NdjsonWriter:
+    # Appends one line per user; a resumed run first drops lines written after the checkpoint
+
+    def __init__(self, path, article_store, resume_bytes):
+        self.path = path
+        self.article_ids = article_store.article_ids
+        self.file = open(path, "a+b")
+        self.file.truncate(resume_bytes)
+        self.file.seek(resume_bytes)
+
+    def write(self, offset, user_ids, indices, scores):
+        lines = [
+            json.dumps({
+                "user_id": user_id,
+                "articles": self.article_ids[indices[i]].tolist(),
+                "scores": scores[i].tolist(),
+            })
+            for i, user_id in enumerate(user_ids)
+        ]
+        self.file.write(("\n".join(lines) + "\n").encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        return self.path
+
+class _NpzWriter:
+    # One part file per chunk (named by its user offset), merged into feeds.npz at the end
+
+    def __init__(self, folder, article_store, resume_user):
+        self.folder = folder
+        self.parts = os.path.join(folder, "parts")
+        self.article_ids = article_store.article_ids
+        os.makedirs(self.parts, exist_ok=True)
+        # Parts of chunks after the checkpoint may be incomplete
+        for name in os.listdir(self.parts):
+            if int(name.split(".")[0]) >= resume_user:
+                os.remove(os.path.join(self.parts, name))
+
+    def write(self, offset, user_ids, indices, scores):
+        np.savez(os.path.join(self.parts, f"{offset:012d}.npz"),
+                 user_ids=np.array(user_ids, dtype=str), indices=indices, scores=scores)
+        return 0
+
+    def close(self):
+        """
+        Merges the parts into feeds.npz: user_ids sorted for lookups, indices
+        into the article_ids of the feeds only (-1 pads short feeds) and scores.
+        """
+        parts = []
+        for name in sorted(os.listdir(self.parts)):
+            with np.load(os.path.join(self.parts, name)) as data:
+                parts.append({key: data[key] for key in data.files})
+        width = max((part["indices"].shape[1] for part in parts), default=0)
+        user_ids = np.concatenate([part["user_ids"] for part in parts]) if parts else np.array([], dtype=str)
+        indices = np.full((len(user_ids), width), -1, dtype=np.int32)
+        scores = np.zeros((len(user_ids), width), dtype=np.uint8)
+        row = 0
+        for part in parts:
+            n, w = part["indices"].shape
+            indices[row:row + n, :w] = part["indices"]
+            scores[row:row + n, :w] = part["scores"]
+            row += n
+
+        order = np.argsort(user_ids, kind="stable")
+        used, local = np.unique(indices[indices >= 0], return_inverse=True)
+        compact = np.full_like(indices, -1)
+        compact[indices >= 0] = local
+        path = os.path.join(self.folder, "feeds.npz")
+        np.savez(path, user_ids=user_ids[order], indices=compact[order], scores=scores[order],
+                 article_ids=np.asarray(self.article_ids)[used])
+        shutil.rmtree(self.parts)
+        return path
+
+class _MongoWriter:
+    # Unordered bulk upserts keyed by user id (re-writing a chunk after a resume is harmless)
+
+    def __init__(self, collection, article_store):
+        self.collection = collection
+        self.article_ids = article_store.article_ids
+
+    def write(self, offset, user_ids, indices, scores):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.collection.bulk_write([
+            UpdateOne(
+                {"_id": user_id},
+                {"$set": {
+                    "articles": self.article_ids[indices[i]].tolist(),
+                    "scores": scores[i].tolist(),
+                    "updatedAt": now,
+                }},
+                upsert=True
+            )
+            for i, user_id in enumerate(user_ids)
+        ], ordered=False)
+        return 0
+
+    def close(self):
+        return f"the {self.collection.name} collection"
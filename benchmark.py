@@ -0,0 +1,224 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import xgboost as xgb
+
+from data_loader import DATA_FOLDER, RANKING_PROJECTIONS, load_data
+from article_store import build_article_store
+from user_store import build_user_store
+from utils import build_category_map
+from user_cohort import assign_cohorts
+from model_training import build_feature_matrix, train_xgboost_model
+from article_ranking import rank_articles_for_user
+from article_index import ArticleIndex
+from compiled_scorer import compile_scorer
+from instrumentation import METRICS
+from synthetic_corpus import generate_corpus
+
+BENCH_FOLDER = os.path.join(DATA_FOLDER, "bench")
+REPORT_PATH = "benchmark_report.json"
+BASELINE_PATH = "benchmark_baseline.json"
+
+# Corpus sizes as users x articles
+DEFAULT_SIZES = "1000x10000,10000x100000"
+
+# A stage counts as a regression when it is this much slower than the baseline
+# (relative) and at least MIN_REGRESSION_SECONDS slower in absolute terms
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+
+class StageRecorder:
+    """
+    Runs pipeline stages, recording wall-clock seconds and (optionally) the
+    tracemalloc peak of the allocations made during each stage.
+    """
+
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.stages = {}
+
+    def run(self, name, fn, *args, **kwargs):
+        # tracemalloc is only started and stopped here if nothing traces already
+        # (--profile keeps it on for the instrumentation's stage peaks); otherwise
+        # just its peak is reset, after handing the peak so far to the open stage
+        started = self.track_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif self.track_memory:
+            stack = METRICS.stack()
+            if METRICS.track_memory and stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+            if started:
+                tracemalloc.stop()
+        self.stages[name] = {
+            "seconds": round(seconds, 4),
+            "peak_mb": None if peak is None else round(peak / 2**20, 2),
+        }
+        print(f"  {name}: {seconds:.3f}s" + ("" if peak is None else f", peak {peak / 2**20:.1f} MB"))
+        return result
+
+def parse_sizes(text):
+    # "1000x10000,10000x100000" -> [(1000, 10000), (10000, 100000)]
+    sizes = []
+    for item in text.split(","):
+        users, _, articles = item.strip().lower().partition("x")
+        sizes.append((int(users), int(articles)))
+    return sizes
+
+def corpus_folder(n_users, n_articles, bench_folder=BENCH_FOLDER, seed=0):
+    """
+    Folder holding the synthetic corpus for one size, generated on first use.
+    """
+    folder = os.path.join(bench_folder, f"u{n_users}_a{n_articles}_s{seed}")
+    if not os.path.exists(os.path.join(folder, "articles.json")):
+        print(f"Generating synthetic corpus: {n_users} users x {n_articles} articles...")
+        generate_corpus(folder, n_users=n_users, n_articles=n_articles, seed=seed)
+    return folder
+
+def benchmark_size(n_users, n_articles, bench_folder=BENCH_FOLDER, train_users=200, rounds=50,
+                   rank_queries=50, track_memory=True, seed=0):
+    """
+    Times the pipeline stages on one synthetic corpus size.
+    Training uses a sample of train_users users (the full cross product grows
+    as users x articles); ranking is averaged over rank_queries random users.
+    """
+    folder = corpus_folder(n_users, n_articles, bench_folder, seed)
+    recorder = StageRecorder(track_memory=track_memory)
+    rng = random.Random(seed)
+    print(f"Benchmarking {n_users} users x {n_articles} articles")
+
+    data = recorder.run("load_data", load_data, use_local_json=True,
+                        projections=RANKING_PROJECTIONS, data_folder=folder)
+    users, user_prefs = data["users"], data["user_preferences"]
+    category_map = build_category_map(data["article_categories"])
+
+    article_store = recorder.run("build_article_store", build_article_store, data["articles"])
+    user_store = recorder.run("build_user_store", build_user_store, users, user_prefs)
+    recorder.run("assign_cohorts", assign_cohorts, user_store.users(), user_store.user_preferences(),
+                 category_map, n_clusters=15, method="sparse")
+
+    train_sample = rng.sample(users, min(train_users, len(users)))
+    X, y = recorder.run("build_feature_matrix", build_feature_matrix, train_sample, user_prefs,
+                        None, article_store=article_store)
+    model = recorder.run("train_xgboost_model", train_xgboost_model, X, y, num_boost_round=rounds)
+    scorer = compile_scorer(model)
+    article_index = recorder.run("build_article_index", ArticleIndex, article_store)
+
+    prefs_map = user_store.prefs_map()
+    queries = [{"_id": uid} for uid in rng.sample(list(prefs_map), min(rank_queries, len(prefs_map)))]
+
+    def rank_all(index):
+        for user in queries:
+            rank_articles_for_user(scorer, user, prefs_map, None, article_store=article_store,
+                                   top_k=100, article_index=index)
+
+    recorder.run("rank_articles_for_user", rank_all, None)
+    recorder.run("rank_articles_for_user_indexed", rank_all, article_index)
+
+    return {
+        "users": n_users,
+        "articles": n_articles,
+        "training_rows": int(len(X)),
+        "rank_queries": len(queries),
+        "stages": recorder.stages,
+    }
+
+def run_benchmarks(sizes, **kwargs):
+    return {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "xgboost": xgb.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": [benchmark_size(n_users, n_articles, **kwargs) for n_users, n_articles in sizes],
+    }
+
+def compare_reports(report, baseline, tolerance=DEFAULT_TOLERANCE, min_seconds=MIN_REGRESSION_SECONDS):
+    """
+    Stages slower than in the baseline report, as human-readable lines.
+    Sizes or stages missing from the baseline are ignored.
+    """
+    base = {
+        (result["users"], result["articles"], stage): values["seconds"]
+        for result in baseline.get("results", [])
+        for stage, values in result["stages"].items()
+    }
+    regressions = []
+    for result in report["results"]:
+        for stage, values in result["stages"].items():
+            key = (result["users"], result["articles"], stage)
+            if key not in base:
+                continue
+            before, after = base[key], values["seconds"]
+            if after > before * (1 + tolerance) and after - before >= min_seconds:
+                regressions.append(
+                    f"{result['users']}x{result['articles']} {stage}: {before:.3f}s -> {after:.3f}s "
+                    f"(+{(after / before - 1) * 100 if before else float('inf'):.0f}%)"
+                )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic corpora")
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES,
+                        help="Comma-separated users x articles sizes, e.g. 1000x10000,100000x1000000")
+    parser.add_argument("--bench-folder", type=str, default=BENCH_FOLDER,
+                        help="Where the synthetic corpora are generated (reused across runs)")
+    parser.add_argument("--train-users", type=int, default=200, help="Users sampled for the training stages")
+    parser.add_argument("--rounds", type=int, default=50, help="Maximum boosting rounds in the training stage")
+    parser.add_argument("--rank-queries", type=int, default=50, help="Users ranked in the ranking stages")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc peak tracking")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", type=str, default=REPORT_PATH, help="JSON report output path")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH, help="Baseline report to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown per stage before it counts as a regression")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        parse_sizes(args.sizes),
+        bench_folder=args.bench_folder,
+        train_users=args.train_users,
+        rounds=args.rounds,
+        rank_queries=args.rank_queries,
+        track_memory=not args.no_memory,
+        seed=args.seed,
+    )
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {args.report}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_reports(report, json.load(f), tolerance=args.tolerance)
+        if regressions:
+            print("Performance regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
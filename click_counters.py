@@ -0,0 +1,499 @@
+import argparse
+import fcntl
+import json
+import os
+import time
+import numpy as np
+
+from data_loader import DATA_FOLDER
+from instrumentation import count, timed
+from snapshot import load_corpus
+
+# Append-only click event log, one JSON object per line:
+#   {"user_id": "...", "article_id": "...", "ts": 1717000000.0}
+# "categories" (category names) and "tags" may be given explicitly; otherwise
+# they are looked up from the clicked article.
+CLICK_LOG_PATH = os.path.join(DATA_FOLDER, "clicks.ndjson")
+
+# User id the interactive create_user.py sessions log their clicks under (main.py's custom user)
+CUSTOM_USER_ID = "custom_user"
+
+# Compacted counters (base-<generation>.npz), ingested delta segments and state.json,
+# which names the current generation, its delta segments and the log offset
+CLICK_FOLDER = os.path.join(DATA_FOLDER, "clicks")
+
+# Delta segments kept on disk before they are folded into the base
+COMPACT_EVERY = 16
+
+# Events whose article is unknown (not synced yet) are retried at each
+# ingestion for this long before they are skipped
+UNRESOLVED_RETRY_SECONDS = 24 * 3600
+
+# Pending in-memory counts merged into the compacted arrays beyond this many entries
+MAX_PENDING = 1 << 16
+
+class CounterMatrix:
+    """
+    Sparse users x keys click counts.
+
+    Compacted counts are CSR (indptr, indices, counts) with sorted keys per
+    row. Added counts are appended as COO blocks and only merged in by
+    compact(), so adding costs time proportional to the new counts.
+    """
+
+    def __init__(self, indptr=None, indices=None, counts=None):
+        self.indptr = np.zeros(1, dtype=np.int64) if indptr is None else np.asarray(indptr, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int64) if indices is None else np.asarray(indices, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.pending = []    # (rows, cols, counts) blocks not compacted yet
+        self.n_pending = 0
+
+    def add(self, rows, cols, counts):
+        self.pending.append((
+            np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64), np.asarray(counts, dtype=np.int64)
+        ))
+        self.n_pending += len(self.pending[-1][0])
+        if self.n_pending > MAX_PENDING:
+            self.compact()
+
+    def row(self, i):
+        # (keys, counts) of row i, pending counts included
+        keys, counts = [], []
+        if i < len(self.indptr) - 1:
+            start, end = self.indptr[i], self.indptr[i + 1]
+            keys.append(self.indices[start:end])
+            counts.append(self.counts[start:end])
+        for rows, cols, block_counts in self.pending:
+            mask = rows == i
+            keys.append(cols[mask])
+            counts.append(block_counts[mask])
+        if not keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        return keys, np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+
+    def compact(self):
+        # Merges the pending blocks into the CSR arrays, summing counts per (row, key)
+        if self.n_pending == 0:
+            self.pending = []
+            return
+        n_old = len(self.indptr) - 1
+        rows = np.concatenate([np.repeat(np.arange(n_old, dtype=np.int64), np.diff(self.indptr))]
+                              + [block[0] for block in self.pending])
+        cols = np.concatenate([self.indices] + [block[1] for block in self.pending])
+        counts = np.concatenate([self.counts] + [block[2] for block in self.pending])
+
+        n_rows = max(n_old, int(rows.max()) + 1)
+        n_cols = int(cols.max()) + 1
+        keys, inverse = np.unique(rows * n_cols + cols, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        self.indices = keys % n_cols
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(keys // n_cols, minlength=n_rows))])
+        self.pending = []
+        self.n_pending = 0
+
+class ClickCounters:
+    """
+    Per-user category and tag click counters, in the shape the click
+    reranking consumes (custom_cat_clicks / custom_tag_clicks).
+
+    User ids, category names and tags are interned into vocabularies; the
+    counts are users x categories and users x tags CounterMatrix. offset is
+    the byte position in the click log up to which events are counted;
+    generation and deltas record which persisted files the counts include.
+    """
+
+    # Array attributes written to / read back from the base files, see to_arrays()
+    ARRAY_FIELDS = (
+        "user_vocab", "cat_vocab", "tag_vocab",
+        "cat_indptr", "cat_indices", "cat_counts",
+        "tag_indptr", "tag_indices", "tag_counts",
+    )
+
+    def __init__(self, user_vocab=(), cat_vocab=(), tag_vocab=(), cat_clicks=None, tag_clicks=None, offset=0,
+                 generation=0, deltas=()):
+        self.user_vocab = list(user_vocab)
+        self.cat_vocab = list(cat_vocab)
+        self.tag_vocab = list(tag_vocab)
+        self.user_index = {v: i for i, v in enumerate(self.user_vocab)}
+        self.cat_index = {v: i for i, v in enumerate(self.cat_vocab)}
+        self.tag_index = {v: i for i, v in enumerate(self.tag_vocab)}
+        self.cat_clicks = CounterMatrix() if cat_clicks is None else cat_clicks
+        self.tag_clicks = CounterMatrix() if tag_clicks is None else tag_clicks
+        self.offset = offset
+        self.generation = generation
+        self.deltas = list(deltas)
+
+    def __len__(self):
+        return len(self.user_vocab)
+
+    def add(self, user_ids, categories, tags):
+        """
+        Counts one click per (user, category) and (user, tag) pair; categories[i]
+        and tags[i] are the category names and tags clicked by user_ids[i].
+        """
+        for kind, values, vocab, index, matrix in (
+            ("cat", categories, self.cat_vocab, self.cat_index, self.cat_clicks),
+            ("tag", tags, self.tag_vocab, self.tag_index, self.tag_clicks),
+        ):
+            rows, cols = [], []
+            for user_id, keys in zip(user_ids, values):
+                row = _intern(self.user_vocab, self.user_index, user_id)
+                for key in keys:
+                    rows.append(row)
+                    cols.append(_intern(vocab, index, key))
+            if rows:
+                matrix.add(rows, cols, np.ones(len(rows), dtype=np.int64))
+
+    def add_counts(self, kind, user_ids, keys, counts):
+        # Adds aggregated counts, e.g. read back from a delta segment
+        vocab, index, matrix = (
+            (self.cat_vocab, self.cat_index, self.cat_clicks) if kind == "cat"
+            else (self.tag_vocab, self.tag_index, self.tag_clicks)
+        )
+        rows = [_intern(self.user_vocab, self.user_index, user_id) for user_id in user_ids]
+        cols = [_intern(vocab, index, key) for key in keys]
+        if rows:
+            matrix.add(rows, cols, counts)
+
+    def clicks(self, user_id):
+        """
+        ({category name: clicks}, {tag: clicks}) for user_id, both empty for
+        users without clicks.
+        """
+        row = self.user_index.get(user_id)
+        if row is None:
+            return {}, {}
+        cat_keys, cat_counts = self.cat_clicks.row(row)
+        tag_keys, tag_counts = self.tag_clicks.row(row)
+        return (
+            {self.cat_vocab[k]: c for k, c in zip(cat_keys.tolist(), cat_counts.tolist())},
+            {self.tag_vocab[k]: c for k, c in zip(tag_keys.tolist(), tag_counts.tolist())},
+        )
+
+    def compact(self):
+        self.cat_clicks.compact()
+        self.tag_clicks.compact()
+
+    def to_arrays(self):
+        self.compact()
+        arrays = {
+            "user_vocab": np.array(self.user_vocab, dtype=str),
+            "cat_vocab": np.array(self.cat_vocab, dtype=str),
+            "tag_vocab": np.array(self.tag_vocab, dtype=str),
+        }
+        for kind, matrix in (("cat", self.cat_clicks), ("tag", self.tag_clicks)):
+            arrays[f"{kind}_indptr"] = matrix.indptr
+            arrays[f"{kind}_indices"] = matrix.indices
+            arrays[f"{kind}_counts"] = matrix.counts
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, offset=0, generation=0):
+        return cls(
+            user_vocab=np.asarray(arrays["user_vocab"]).tolist(),
+            cat_vocab=np.asarray(arrays["cat_vocab"]).tolist(),
+            tag_vocab=np.asarray(arrays["tag_vocab"]).tolist(),
+            cat_clicks=CounterMatrix(arrays["cat_indptr"], arrays["cat_indices"], arrays["cat_counts"]),
+            tag_clicks=CounterMatrix(arrays["tag_indptr"], arrays["tag_indices"], arrays["tag_counts"]),
+            offset=offset,
+            generation=generation,
+        )
+
+    def add_delta(self, path):
+        # Folds in a delta segment written by _save_delta
+        with np.load(path) as data:
+            for kind in ("cat", "tag"):
+                self.add_counts(kind, data[f"{kind}_users"].tolist(), data[f"{kind}_keys"].tolist(),
+                                data[f"{kind}_counts"])
+        self.deltas.append(os.path.basename(path))
+
+def _intern(vocab, index, value):
+    i = index.get(value)
+    if i is None:
+        i = index[value] = len(vocab)
+        vocab.append(value)
+    return i
+
+def log_clicks(events, log_path=CLICK_LOG_PATH):
+    """
+    Appends click events (dicts, see CLICK_LOG_PATH) to the log.
+    Events without a "ts" are stamped with the current time.
+    """
+    os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+    now = time.time()
+    with open(log_path, "a", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps({"ts": now, **event}) + "\n")
+
+def load_click_counters(folder=CLICK_FOLDER):
+    """
+    Counters as of the last ingestion: the base of the current generation
+    plus the delta segments listed in state.json (segments written by an
+    interrupted ingestion are not listed and are ignored). Empty if nothing
+    was ingested.
+    """
+    with _folder_lock(folder):
+        return _load_counters(folder, _load_state(folder))
+
+@timed("ingest_clicks")
+def ingest_clicks(counters, article_store=None, category_map=None, log_path=CLICK_LOG_PATH,
+                  folder=CLICK_FOLDER):
+    """
+    Folds the events appended to the log since the last ingestion into the
+    counters and persists them as a delta segment. Only the new part of the
+    log is read, and a trailing incomplete line is left for the next run.
+
+    Several processes may ingest into the same folder: ingestion holds a
+    file lock, and counters behind the persisted state (another process
+    ingested or compacted since) are brought up to date first, so every
+    event is counted exactly once.
+
+    Events without explicit categories/tags are resolved through article_store
+    (category OIDs named via category_map); events for articles it does not
+    know yet are kept and retried by the next ingestions, and skipped only
+    after UNRESOLVED_RETRY_SECONDS.
+    A log shorter than the offset is treated as a new (rotated) log.
+    Returns (counters, number of events counted); the counters are a newly
+    loaded instance when the given ones could not be brought up to date.
+    """
+    with _folder_lock(folder):
+        counters = _sync_counters(counters, folder)
+        return counters, _ingest(counters, article_store, category_map, log_path, folder)
+
+def _ingest(counters, article_store, category_map, log_path, folder):
+    state = _load_state(folder)
+    pending = _load_unresolved(folder, state)
+    data = b""
+    if os.path.exists(log_path):
+        size = os.path.getsize(log_path)
+        if size < counters.offset:
+            counters.offset = 0
+        if size > counters.offset:
+            with open(log_path, "rb") as f:
+                f.seek(counters.offset)
+                data = f.read()
+    end = data.rfind(b"\n") + 1
+    if end == 0 and not pending:
+        return 0
+
+    events, skipped = list(pending), 0
+    for line in data[:end].splitlines():
+        try:
+            event = json.loads(line)
+            str(event["user_id"])
+        except (ValueError, KeyError, TypeError):
+            skipped += 1
+            continue
+        events.append(event)
+
+    now = time.time()
+    user_ids, categories, tags = [], [], []
+    unresolved = []
+    for event in events:
+        resolved = _event_keys(event, article_store, category_map)
+        if resolved is None:
+            # Kept for the next ingestion: the article may not be synced yet
+            if now - event.setdefault("unresolved_since", now) < UNRESOLVED_RETRY_SECONDS:
+                unresolved.append(event)
+            else:
+                skipped += 1
+            continue
+        user_ids.append(str(event["user_id"]))
+        categories.append(resolved[0])
+        tags.append(resolved[1])
+
+    if end == 0 and len(unresolved) == len(pending):
+        return 0
+    delta = None
+    if user_ids:
+        delta = ClickCounters()
+        delta.add(user_ids, categories, tags)
+    name = _save_delta(delta, counters.offset + end, folder, unresolved)
+    counters.add(user_ids, categories, tags)
+    counters.offset += end
+    if name is not None:
+        counters.deltas.append(name)
+    count("click_events_ingested", len(user_ids))
+    count("click_events_skipped", skipped)
+    return len(user_ids)
+
+def _event_keys(event, article_store, category_map):
+    # (category names, tags) of a click event, or None if they cannot be resolved
+    cats = event.get("categories")
+    tags = event.get("tags")
+    if cats is None or tags is None:
+        article_id = event.get("article_id")
+        row = None if article_store is None else article_store.id_index().get(str(article_id))
+        if row is None:
+            if cats is None and tags is None:
+                return None
+        else:
+            if cats is None:
+                start, end = article_store.cat_indptr[row], article_store.cat_indptr[row + 1]
+                oids = [article_store.cat_vocab[c] for c in article_store.cat_indices[start:end]]
+                cats = [category_map[oid] for oid in oids if category_map and oid in category_map]
+            if tags is None:
+                start, end = article_store.tag_indptr[row], article_store.tag_indptr[row + 1]
+                tags = [article_store.tag_vocab[t] for t in article_store.tag_indices[start:end]]
+    return list(dict.fromkeys(cats or ())), list(dict.fromkeys(tags or ()))
+
+def _save_delta(delta, offset, folder, unresolved=()):
+    """
+    Writes the segment (none for delta = None) and the unresolved events
+    first and lists them in state.json second, so a crash never counts
+    them twice. Names are unique within a generation (they carry the
+    segment's position in the list); returns the name, or None.
+    """
+    os.makedirs(folder, exist_ok=True)
+    state = _load_state(folder)
+    deltas = state["deltas"]
+    name = None
+    if delta is not None:
+        name = f"delta-{state['generation']:08d}-{len(deltas):06d}.npz"
+        if name in deltas:
+            raise RuntimeError(f"delta segment {name} is already listed in {folder}/state.json")
+        arrays = {}
+        for kind, vocab, matrix in (("cat", delta.cat_vocab, delta.cat_clicks),
+                                    ("tag", delta.tag_vocab, delta.tag_clicks)):
+            matrix.compact()
+            rows = np.repeat(np.arange(len(matrix.indptr) - 1), np.diff(matrix.indptr))
+            arrays[f"{kind}_users"] = np.array(delta.user_vocab, dtype=str)[rows]
+            arrays[f"{kind}_keys"] = np.array(vocab, dtype=str)[matrix.indices]
+            arrays[f"{kind}_counts"] = matrix.counts
+        np.savez(os.path.join(folder, name), **arrays)
+        deltas = deltas + [name]
+
+    unresolved_name = None
+    if unresolved:
+        unresolved_name = f"unresolved-{time.time_ns()}.ndjson"
+        with open(os.path.join(folder, unresolved_name), "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(event) + "\n" for event in unresolved)
+    _save_state(folder, {**state, "offset": offset, "deltas": deltas, "unresolved": unresolved_name})
+    if state.get("unresolved"):
+        os.remove(os.path.join(folder, state["unresolved"]))
+    return name
+
+def _load_unresolved(folder, state):
+    # Events kept by an earlier ingestion because their article was unknown
+    if not state.get("unresolved"):
+        return []
+    with open(os.path.join(folder, state["unresolved"]), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def compact_click_counters(counters, folder=CLICK_FOLDER):
+    """
+    Writes the counters as the base of a new generation and drops the delta
+    segments. Returns the (possibly reloaded, see ingest_clicks) counters.
+    """
+    with _folder_lock(folder):
+        counters = _sync_counters(counters, folder)
+        _compact(counters, folder)
+        return counters
+
+def _compact(counters, folder):
+    # The state.json swap is the commit point: before it the old base and
+    # deltas are current, after it only the new base (which includes them)
+    os.makedirs(folder, exist_ok=True)
+    state = _load_state(folder)
+    generation = state["generation"] + 1
+    np.savez(os.path.join(folder, _base_name(generation)), offset=counters.offset, **counters.to_arrays())
+    _save_state(folder, {**state, "generation": generation, "offset": counters.offset, "deltas": []})
+    counters.generation = generation
+    counters.deltas = []
+
+    for name in state["deltas"] + ([_base_name(state["generation"])] if state["generation"] else []):
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def update_click_counters(article_store=None, category_map=None, counters=None, log_path=CLICK_LOG_PATH,
+                          folder=CLICK_FOLDER):
+    """
+    Loads the counters (unless given) and ingests the new log events,
+    compacting once COMPACT_EVERY delta segments have accumulated.
+    Returns the up-to-date counters (see ingest_clicks).
+    """
+    with _folder_lock(folder):
+        counters = _sync_counters(counters, folder)
+        ingested = _ingest(counters, article_store, category_map, log_path, folder)
+        if ingested and len(counters.deltas) >= COMPACT_EVERY:
+            _compact(counters, folder)
+        return counters
+
+def _sync_counters(counters, folder):
+    """
+    Brings counters up to the persisted state: delta segments other processes
+    listed since are folded in; after a compaction elsewhere (new generation)
+    or for counters = None, the counters are loaded afresh.
+    """
+    state = _load_state(folder)
+    if counters is None or counters.generation != state["generation"]:
+        return _load_counters(folder, state)
+    if state["deltas"][:len(counters.deltas)] != counters.deltas:
+        return _load_counters(folder, state)
+    for name in state["deltas"][len(counters.deltas):]:
+        counters.add_delta(os.path.join(folder, name))
+    counters.offset = state["offset"]
+    return counters
+
+def _load_counters(folder, state):
+    base_path = os.path.join(folder, _base_name(state["generation"]))
+    if state["generation"] and os.path.exists(base_path):
+        with np.load(base_path) as data:
+            counters = ClickCounters.from_arrays(data, offset=state["offset"], generation=state["generation"])
+    else:
+        counters = ClickCounters(offset=state["offset"], generation=state["generation"])
+    for name in state["deltas"]:
+        counters.add_delta(os.path.join(folder, name))
+    return counters
+
+def _base_name(generation):
+    return f"base-{generation:08d}.npz"
+
+class _folder_lock:
+    # Exclusive advisory lock on folder/ingest.lock, serializing ingestion across processes
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, "ingest.lock")
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        return False
+
+def _load_state(folder):
+    path = os.path.join(folder, "state.json")
+    if not os.path.exists(path):
+        return {"generation": 0, "offset": 0, "deltas": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return {"generation": 0, **json.load(f)}
+
+def _save_state(folder, state):
+    path = os.path.join(folder, "state.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Click event log ingester")
+    parser.add_argument("--local", action="store_true", help="Use local JSON files instead of MongoDB")
+    parser.add_argument("--log", type=str, default=CLICK_LOG_PATH, help="Click event log (NDJSON)")
+    parser.add_argument("--compact", action="store_true", help="Compact the counters after ingesting")
+    args = parser.parse_args()
+
+    article_store, _, category_map = load_corpus(use_local_json=args.local)
+    counters = update_click_counters(article_store, category_map, log_path=args.log)
+    if args.compact:
+        counters = compact_click_counters(counters)
+    print(f"Click counters for {len(counters)} users, log offset {counters.offset}")
+
+if __name__ == "__main__":
+    main()
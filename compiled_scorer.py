@@ -0,0 +1,109 @@
+import hashlib
+import os
+import numpy as np
+
+from article_ranking import predict_scores
+from model_training import MODEL_PATH
+
+# Bounds of the enumerated feature grid:
+#   language_feature in {1, 2}, lang_match in {0, 1},
+#   cat_overlap in [0..GRID_MAX_OVERLAP], days_old in [0..GRID_MAX_DAYS]
+GRID_MAX_OVERLAP = 16
+GRID_MAX_DAYS = 3650
+
+class CompiledScorer:
+    """
+    Lookup-table stand-in for the trained model.
+
+    The 4 features [language_feature, lang_match, cat_overlap, days_old] are
+    small integers, so the model is evaluated once over the whole grid and
+    predict() becomes a NumPy gather. Rows outside the grid fall back to the
+    wrapped model.
+    """
+
+    def __init__(self, table, model):
+        self.table = table   # shape (2, 2, max_overlap + 1, max_days + 1)
+        self.model = model
+
+    def predict(self, X):
+        X = np.asarray(X)
+        lang_feature = X[:, 0].astype(np.int64) - 1
+        lang_match = X[:, 1].astype(np.int64)
+        cat_overlap = X[:, 2].astype(np.int64)
+        days_old = X[:, 3].astype(np.int64)
+
+        in_grid = (
+            (X == np.round(X)).all(axis=1)
+            & (lang_feature >= 0) & (lang_feature < self.table.shape[0])
+            & (lang_match >= 0) & (lang_match < self.table.shape[1])
+            & (cat_overlap >= 0) & (cat_overlap < self.table.shape[2])
+            & (days_old >= 0) & (days_old < self.table.shape[3])
+        )
+
+        scores = np.empty(len(X), dtype=self.table.dtype)
+        if in_grid.all():
+            scores[:] = self.table[lang_feature, lang_match, cat_overlap, days_old]
+            return scores
+
+        scores[in_grid] = self.table[
+            lang_feature[in_grid], lang_match[in_grid], cat_overlap[in_grid], days_old[in_grid]
+        ]
+        # The wrapped model directly: this call is already inside the caller's predict_scores
+        model = self.model
+        outside = X[~in_grid]
+        scores[~in_grid] = model.inplace_predict(outside) if hasattr(model, "inplace_predict") else model.predict(outside)
+        return scores
+
+def compile_scorer(model, max_overlap=GRID_MAX_OVERLAP, max_days=GRID_MAX_DAYS):
+    """
+    Evaluates the model once over the full feature grid.
+    """
+    grid = np.stack(np.meshgrid(
+        np.arange(1, 3),
+        np.arange(0, 2),
+        np.arange(0, max_overlap + 1),
+        np.arange(0, max_days + 1),
+        indexing="ij"
+    ), axis=-1)
+    shape = grid.shape[:-1]
+    table = predict_scores(model, grid.reshape(-1, 4).astype(float))
+    return CompiledScorer(np.asarray(table, dtype=np.float32).reshape(shape), model)
+
+def compiled_scorer_path(model_path):
+    # trained_model.ubj -> trained_model.grid.npz
+    return os.path.splitext(model_path)[0] + ".grid.npz"
+
+def save_compiled_scorer(scorer, model_path=MODEL_PATH):
+    np.savez(
+        compiled_scorer_path(model_path),
+        table=scorer.table,
+        model_digest=file_digest(model_path)
+    )
+
+def load_compiled_scorer(model, model_path=MODEL_PATH):
+    """
+    Loads the grid saved next to model_path.
+    Returns None if it is missing or was compiled from a different model file.
+    """
+    grid_path = compiled_scorer_path(model_path)
+    if not os.path.exists(grid_path):
+        return None
+    with np.load(grid_path) as data:
+        if str(data["model_digest"]) != file_digest(model_path):
+            return None
+        return CompiledScorer(data["table"], model)
+
+def get_compiled_scorer(model, model_path=MODEL_PATH):
+    # Loading the saved grid, or compiling and saving it if missing/stale
+    scorer = load_compiled_scorer(model, model_path)
+    if scorer is None:
+        scorer = compile_scorer(model)
+        save_compiled_scorer(scorer, model_path)
+    return scorer
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
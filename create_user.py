@@ -1,14 +1,16 @@
 from data_loader import load_data
+from click_counters import CUSTOM_USER_ID, log_clicks
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import re
 import os
 import json
 import random
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 nltk.download('punkt')
 nltk.download('stopwords')
@@ -22,60 +24,100 @@ def conv_todict(lis):
                 merged_dict[key] = value
     return merged_dict
 
+TAG_OPTIONS = ["accidents","cricket","awards and recognitions","human rights","crime","politics","education","natural disasters","economy","climate and weather","elections","celebrity","movies","supply chain and logistics","financial markets","religious events and festivals","government","pharma and healthcare","sports","energy","conflicts & war","telecom","diseases","automotive","research","mental health","wildlife","corporate news","social media and internet","ocean conservation","startups & entrepreneurship","eco-friendly","pollution","banking and finance","soccer","entertainment","fmcg","tourism","television","food","technology","health and fitness","national security","insurance","real estate","cybercrime and cybersecurity","fashion and lifestyle","artificial intelligence","wrestling","gaming","international trade","e-commerce","home and interior design","cryptocurrencies","american football","baseball","basketball","law and justice","golf","religion","recycling","metal & mining","nonprofit organizations","corporate social responsibility","science and innovations","agriculture and farming","space","mixed martial arts","tennis","motorsports","renewable energy","aviation","terrorism","lgbtq","boxing","field hockey","volleyball","textile","immigration and migrant issues","rugby","chemicals","work-life balance","philanthropy"]
+
+# Articles per task sent to a cleaning worker
+CLEAN_CHUNK_SIZE = 256
+
+@lru_cache(maxsize=None)
+def _stop_words():
+    # Loaded once per process
+    return frozenset(stopwords.words('english'))
+
 def clean_text(text):
     text = re.sub(r'[^\w\s]', '', text)
     text = text.lower()
-    stop_words = set(stopwords.words('english'))
+    stop_words = _stop_words()
     word_tokens = word_tokenize(text)
     filtered_text = [w for w in word_tokens if not w in stop_words]
     return " ".join(filtered_text)
 
-def make_local_users(use_local_json=True):
+def clean_texts(texts, workers=None):
+    """
+    clean_text over many texts, spread across a process pool.
+    Small inputs are cleaned in this process.
+    """
+    if workers == 1 or len(texts) < 2 * CLEAN_CHUNK_SIZE:
+        return [clean_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(clean_text, texts, chunksize=CLEAN_CHUNK_SIZE))
+
+def tag_articles(articles, tag_options=TAG_OPTIONS, workers=None):
+    """
+    Appends the most similar tag to every article ([language, title, category, body]).
+
+    All texts are vectorized into one sparse matrix; since TF-IDF rows are
+    L2-normalized, one sparse product with the tag matrix gives the cosine
+    similarities and a row-wise argmax picks the tags.
+    """
+    if not articles:
+        return articles
+
+    cleaned_tag_options = [clean_text(tag) for tag in tag_options]
+    vectorizer = TfidfVectorizer()
+    tag_matrix = vectorizer.fit_transform(cleaned_tag_options)
+
+    art_nos = list(articles)
+    texts = [articles[art_no][1] + " " + articles[art_no][3] for art_no in art_nos]
+    text_matrix = vectorizer.transform(clean_texts(texts, workers=workers))
+
+    similarities = (text_matrix @ tag_matrix.T).toarray()
+    most_similar = similarities.argmax(axis=1)
+    for art_no, tag_index in zip(art_nos, most_similar.tolist()):
+        articles[art_no].append(tag_options[tag_index])
+    return articles
+
+def make_local_users(use_local_json=True, workers=None):
+    """
+    Articles as {oid: [language, title, category name, body, tag]}.
+
+    Tagged articles are cached in articles.json; only articles missing
+    from the cache are cleaned and tagged.
+    """
     data_dict = load_data(use_local_json=use_local_json, db=None)
 
     article_categories = data_dict["article_categories"]
     article_categories = conv_todict([{cat["_id"]: cat["name"]} for cat in article_categories])
 
     article_file = "articles.json"
-    articles = {}
+    cached = {}
 
-    if os.path.exists(article_file) and use_local_json:
+    if os.path.exists(article_file):
         print("Loading articles from cached file...")
         with open(article_file, 'r') as f:
-            articles = json.load(f)
-    else:
-        articles = data_dict["articles"]
-        articles = conv_todict([{art["_id"]["$oid"] : [art["language"], art["title"], [cat["$oid"] for cat in art["category"]][0], art["body"] ]} for art in articles if art["body"]])
-
-        articles_updated = {}
-
-        for art_no, art in articles.items():
-            try:
-                art[2] = article_categories[art[2]]
-                articles_updated.update({art_no: art})
-            except KeyError:
-                pass
-
-        articles = articles_updated
-
-        tag_options = ["accidents","cricket","awards and recognitions","human rights","crime","politics","education","natural disasters","economy","climate and weather","elections","celebrity","movies","supply chain and logistics","financial markets","religious events and festivals","government","pharma and healthcare","sports","energy","conflicts & war","telecom","diseases","automotive","research","mental health","wildlife","corporate news","social media and internet","ocean conservation","startups & entrepreneurship","eco-friendly","pollution","banking and finance","soccer","entertainment","fmcg","tourism","television","food","technology","health and fitness","national security","insurance","real estate","cybercrime and cybersecurity","fashion and lifestyle","artificial intelligence","wrestling","gaming","international trade","e-commerce","home and interior design","cryptocurrencies","american football","baseball","basketball","law and justice","golf","religion","recycling","metal & mining","nonprofit organizations","corporate social responsibility","science and innovations","agriculture and farming","space","mixed martial arts","tennis","motorsports","renewable energy","aviation","terrorism","lgbtq","boxing","field hockey","volleyball","textile","immigration and migrant issues","rugby","chemicals","work-life balance","philanthropy"]
-        
-        cleaned_tag_options = [clean_text(tag) for tag in tag_options]
-        vectorizer = TfidfVectorizer()
-        tag_matrix = vectorizer.fit_transform(cleaned_tag_options)
-
-        for art_no, art in articles.items():
-            title = art[1]
-            body = art[3]
-            text = title + " " + body
-            cleaned_text = clean_text(text)
-            text_vector = vectorizer.transform([cleaned_text])
-            similarities = cosine_similarity(text_vector, tag_matrix)
-            most_similar_index = similarities.argmax()
-            articles[art_no].append(tag_options[most_similar_index])
-
-        with open(article_file, 'w') as f:
-            json.dump(articles, f, indent=4)
+            cached = json.load(f)
+
+    articles = data_dict["articles"]
+    articles = conv_todict([{art["_id"]["$oid"] : [art["language"], art["title"], [cat["$oid"] for cat in art["category"]][0], art["body"] ]} for art in articles if art["body"] and art["_id"]["$oid"] not in cached])
+
+    articles_updated = {}
+
+    for art_no, art in articles.items():
+        try:
+            art[2] = article_categories[art[2]]
+            articles_updated.update({art_no: art})
+        except KeyError:
+            pass
+
+    articles = articles_updated
+    if not articles:
+        return cached
+
+    print(f"Tagging {len(articles)} new articles...")
+    articles = {**cached, **tag_articles(articles, workers=workers)}
+
+    with open(article_file, 'w') as f:
+        json.dump(articles, f, indent=4)
 
     return articles
 
@@ -95,7 +137,7 @@ def get_user_preferences():
             print("Invalid gender. Please enter 'male' or 'female'.")
     return language, gender
 
-def article_interaction(articles, language):
+def article_interaction(articles, language, user_id=CUSTOM_USER_ID):
     favorite_categories = []
     favorite_tags = []
     displayed_article_ids = set()
@@ -140,6 +182,12 @@ def article_interaction(articles, language):
                 chosen_art_id, chosen_article = displayed_articles_subset[choice_index]
                 favorite_categories.append(chosen_article[2])
                 favorite_tags.append(chosen_article[4])
+                log_clicks([{
+                    "user_id": user_id,
+                    "article_id": chosen_art_id,
+                    "categories": [chosen_article[2]],
+                    "tags": [chosen_article[4]],
+                }])
                 print(f"You chose: {chosen_article[1]}")
             else:
                 print("Invalid article number.")
@@ -163,6 +211,7 @@ def save_user_data(user_data, user_data_freq):
 def main():
     articles = make_local_users()
     language, gender = get_user_preferences()
+    # Clicks are logged under the id main.py ranks the custom user as
     favorite_categories, favorite_tags = article_interaction(articles, language)
 
     # Count the occurrences of each category and tag
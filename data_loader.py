@@ -1,34 +1,159 @@
+import datetime
 import json
 import os
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
 from pymongo.collection import Collection
 
+from db_connection import get_database_connection
+from article_store import doc_id, parse_timestamp
+from instrumentation import timed
+
 DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'data')
 
-def load_local_json(filename: str) -> List[Dict]:
+# Collections returned by load_data (also the file name stems in data/)
+COLLECTIONS = ("users", "user_preferences", "articles", "article_categories", "tags", "tag")
+
+# Fields each collection needs for ranking and training; everything else
+# (article bodies, device tokens, source lists, ...) is dropped while loading.
+RANKING_PROJECTIONS = {
+    "users": ("_id", "user_id"),
+    "user_preferences": ("user_id", "language", "article_category"),
+    "articles": ("_id", "title", "language", "category", "tags", "updatedAt"),
+    "article_categories": ("_id", "name"),
+    "tags": ("_id", "name"),
+    "tag": ("_id", "name"),
+}
+
+# Incremental sync: merged document snapshots + watermarks, and local delta drops
+SYNC_FOLDER = os.path.join(DATA_FOLDER, "sync")
+DELTA_FOLDER = os.path.join(DATA_FOLDER, "deltas")
+SYNC_STATE_FILE = "state.json"
+
+# MongoDB cursor batch sizes; documents per round trip
+MONGO_BATCH_SIZES = {
+    "users": 5000,
+    "user_preferences": 5000,
+    "articles": 2000,
+}
+DEFAULT_MONGO_BATCH_SIZE = 1000
+
+_READ_SIZE = 1 << 16
+
+def iter_local_json(filename: str, fields=None, data_folder=DATA_FOLDER) -> Iterator[Dict]:
     """
-    Load JSON from data/ folder. Returns a list of dict objects.
+    Incrementally parses a JSON file from the data/ folder, yielding one object at a time.
+    Accepts a JSON array, a single object, or NDJSON (one object per line).
+    If fields is given, only those keys of each object are kept.
     """
-    file_path = os.path.join(DATA_FOLDER, filename)
+    file_path = os.path.join(data_folder, filename)
     if not os.path.exists(file_path):
         print(f"File not found: {file_path}")
-        return []
+        return
+
+    decoder = json.JSONDecoder()
     with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        # If the JSON is a dict, wrap it into a list
-        if isinstance(data, dict):
-            data = [data]
-        return data
+        buf = f.read(_READ_SIZE)
+        eof = not buf
+        pos = _skip_whitespace(buf, 0)
+        in_array = buf[pos:pos + 1] == "["
+        if in_array:
+            pos += 1
+        read_size = _READ_SIZE
 
-def fetch_collection_as_list(collection: Collection) -> List[Dict]:
-    # Returning the entire collection as a list of disctionaries
-    return list(collection.find({}))
+        while True:
+            pos = _skip_whitespace(buf, pos)
+            if in_array and buf[pos:pos + 1] == ",":
+                pos = _skip_whitespace(buf, pos + 1)
+            if in_array and buf[pos:pos + 1] == "]":
+                return
 
-def load_data(use_local_json=True, db=None) -> Dict[str, List[Dict]]:
+            if pos < len(buf):
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # Most likely the object continues past the buffer
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    read_size = _READ_SIZE
+                    yield _project(obj, fields)
+                    continue
+            elif eof:
+                return
+
+            # Dropping consumed text and reading more; the read size doubles
+            # while a single object keeps spanning the buffer
+            buf = buf[pos:]
+            pos = 0
+            chunk = f.read(read_size)
+            read_size *= 2
+            eof = not chunk
+            buf += chunk
+
+def load_local_json(filename: str, fields=None, data_folder=DATA_FOLDER) -> List[Dict]:
+    """
+    Load JSON from data/ folder. Returns a list of dict objects.
+    """
+    return list(iter_local_json(filename, fields=fields, data_folder=data_folder))
+
+def local_collection_file(name: str, data_folder=DATA_FOLDER) -> str:
+    # <name>.json, falling back to an NDJSON export (<name>.ndjson / <name>.jsonl)
+    for ext in (".json", ".ndjson", ".jsonl"):
+        if os.path.exists(os.path.join(data_folder, name + ext)):
+            return name + ext
+    return name + ".json"
+
+def _skip_whitespace(buf, pos):
+    while pos < len(buf) and buf[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+def _project(obj, fields):
+    if fields is None or not isinstance(obj, dict):
+        return obj
+    return {key: obj[key] for key in fields if key in obj}
+
+def iter_mongo_collection(collection: Collection, projection=None, batch_size=None) -> Iterator[Dict]:
+    """
+    Streams a collection from MongoDB.
+    projection is a list of fields to keep (the server drops the rest).
+    """
+    if batch_size is None:
+        batch_size = MONGO_BATCH_SIZES.get(collection.name, DEFAULT_MONGO_BATCH_SIZE)
+    projection = list(projection) if projection is not None else None
+    return iter(collection.find({}, projection).batch_size(batch_size))
+
+def fetch_collection_as_list(collection: Collection, projection=None, batch_size=None) -> List[Dict]:
+    # Returning the entire collection as a list of dictionaries
+    return list(iter_mongo_collection(collection, projection=projection, batch_size=batch_size))
+
+def iter_collection(name: str, use_local_json=True, db=None, fields=None,
+                    data_folder=DATA_FOLDER) -> Iterator[Dict]:
+    """
+    Yields the documents of one collection, from data/ (or data_folder) or from MongoDB.
+    """
+    if use_local_json:
+        return iter_local_json(local_collection_file(name, data_folder), fields=fields,
+                               data_folder=data_folder)
+    if db is None:
+        db = get_database_connection()
+    return iter_mongo_collection(db[name], projection=fields)
+
+@timed("load_data")
+def load_data(use_local_json=True, db=None, projections=None, lazy=False,
+              data_folder=DATA_FOLDER) -> Dict[str, List[Dict]]:
     """
     Main data loading function:
-      - If use_local_json=True, loads data from local JSON files in the data folder.
-      - Otherwise, fetch from MongoDB database.
+      - If use_local_json=True, loads data from local JSON files in data_folder
+        (the data folder by default).
+      - Otherwise, fetch from MongoDB database (db, or get_database_connection()),
+        all collections in parallel.
+
+    projections maps a collection name to the fields to keep
+    (e.g. RANKING_PROJECTIONS); collections without an entry are kept whole.
+    With lazy=True every value is a generator instead of a list.
 
     Structure of the returned dictionary:
       {
@@ -40,22 +165,194 @@ def load_data(use_local_json=True, db=None) -> Dict[str, List[Dict]]:
          'tag': [...]
       }
     """
+    projections = projections or {}
+
+    if not use_local_json and not lazy:
+        if db is None:
+            db = get_database_connection()
+
+        # Fetching all collections concurrently over the shared client's connection pool
+        with ThreadPoolExecutor(max_workers=len(COLLECTIONS)) as pool:
+            futures = {
+                name: pool.submit(fetch_collection_as_list, db[name], projection=projections.get(name))
+                for name in COLLECTIONS
+            }
+            return {name: future.result() for name, future in futures.items()}
+
     data_dict = {}
-    if use_local_json:
-        # Loading data from local data folder
-        data_dict["users"] = load_local_json("users.json")
-        data_dict["user_preferences"] = load_local_json("user_preferences.json")
-        data_dict["articles"] = load_local_json("articles.json")
-        data_dict["article_categories"] = load_local_json("article_categories.json")
-        data_dict["tags"] = load_local_json("tags.json")  # or if you have both tags.json and tag.json
-        data_dict["tag"] = load_local_json("tag.json")
-    else:
-        # Loading data from MongoDB
-        data_dict["users"] = fetch_collection_as_list(db["users"])
-        data_dict["user_preferences"] = fetch_collection_as_list(db["user_preferences"])
-        data_dict["articles"] = fetch_collection_as_list(db["articles"])
-        data_dict["article_categories"] = fetch_collection_as_list(db["article_categories"])
-        data_dict["tags"] = fetch_collection_as_list(db["tags"])
-        data_dict["tag"] = fetch_collection_as_list(db["tag"])
+    for name in COLLECTIONS:
+        docs = iter_collection(name, use_local_json=use_local_json, db=db, fields=projections.get(name),
+                               data_folder=data_folder)
+        data_dict[name] = docs if lazy else list(docs)
 
     return data_dict
+
+def sync_collections(use_local_json=True, db=None, projections=None, names=COLLECTIONS,
+                     sync_folder=SYNC_FOLDER, data_folder=DATA_FOLDER,
+                     delta_folder=None) -> Dict[str, List[Dict]]:
+    """
+    Brings the local document snapshot in sync_folder up to date and
+    returns the new/changed documents of each collection.
+
+    Each collection keeps a high-water mark: the latest updatedAt/createdAt
+    seen. MongoDB is queried for documents at or after it. Locally, the base
+    file <data_folder>/<name>.json is re-read only if modified since the last
+    sync (keeping documents at or after the mark), and every file dropped into
+    <delta_folder>/<name>/ (default <data_folder>/deltas) since then is taken
+    whole. Documents without timestamps cannot be compared with the mark, so
+    they are re-read every time; from MongoDB only those that differ from the
+    synced copy count as changed. The first sync is a full load. Changed
+    documents are appended to sync_folder/<name>.ndjson.
+    """
+    projections = projections or {}
+    delta_folder = delta_folder or os.path.join(data_folder, os.path.basename(DELTA_FOLDER))
+    if not use_local_json and db is None:
+        db = get_database_connection()
+
+    state = _load_sync_state(sync_folder)
+    changes = {}
+    for name in names:
+        col_state = state.setdefault(name, {"watermark": None, "synced_mtime": None, "lines": 0})
+        fields = projections.get(name)
+        if fields is not None:
+            # The timestamps drive the watermark, so they are always kept
+            fields = tuple(fields) + ("updatedAt", "createdAt")
+
+        if use_local_json:
+            docs = _local_changes(name, col_state, fields, data_folder, delta_folder)
+        else:
+            docs = _mongo_changes(db[name], col_state, fields, sync_folder)
+
+        _append_ndjson(os.path.join(sync_folder, name + ".ndjson"), docs)
+        col_state["lines"] += len(docs)
+        for doc in docs:
+            ts = _doc_timestamp(doc)
+            if ts is not None and (col_state["watermark"] is None or ts > col_state["watermark"]):
+                col_state["watermark"] = ts
+        changes[name] = docs
+
+    _save_sync_state(state, sync_folder)
+    return changes
+
+def load_synced_collection(name: str, sync_folder=SYNC_FOLDER) -> List[Dict]:
+    """
+    Current version of every document in the synced snapshot of a collection.
+    The append log is compacted when it holds more than twice as many lines
+    as distinct documents.
+    """
+    path = name + ".ndjson"
+    docs = {}
+    lines = 0
+    for doc in iter_local_json(path, data_folder=sync_folder):
+        docs[doc_id(doc)] = doc
+        lines += 1
+
+    if lines > 2 * len(docs):
+        tmp = os.path.join(sync_folder, path + ".tmp")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _append_ndjson(tmp, docs.values())
+        os.replace(tmp, os.path.join(sync_folder, path))
+        state = _load_sync_state(sync_folder)
+        state.setdefault(name, {"watermark": None, "synced_mtime": None})["lines"] = len(docs)
+        _save_sync_state(state, sync_folder)
+
+    return list(docs.values())
+
+def _local_changes(name, col_state, fields, data_folder, delta_folder):
+    last_mtime = col_state["synced_mtime"]
+    docs = []
+
+    base = os.path.join(data_folder, local_collection_file(name, data_folder))
+    delta_dir = os.path.join(delta_folder, name)
+    delta_files = []
+    if os.path.isdir(delta_dir):
+        delta_files = sorted(
+            os.path.join(delta_dir, f) for f in os.listdir(delta_dir)
+            if f.endswith((".json", ".ndjson", ".jsonl"))
+        )
+
+    newest = last_mtime
+    for path in [base] + delta_files:
+        if not os.path.exists(path):
+            continue
+        mtime = os.path.getmtime(path)
+        if last_mtime is not None and mtime <= last_mtime:
+            continue
+        newest = mtime if newest is None else max(newest, mtime)
+
+        folder, filename = os.path.split(path)
+        for doc in iter_local_json(filename, fields=fields, data_folder=folder):
+            if path == base and not _changed_since(doc, col_state["watermark"]):
+                continue
+            docs.append(doc)
+
+    col_state["synced_mtime"] = newest
+    return docs
+
+def _mongo_changes(collection, col_state, fields, sync_folder):
+    watermark = col_state["watermark"]
+    query = {}
+    if watermark is not None:
+        since = datetime.datetime.fromtimestamp(watermark, datetime.timezone.utc)
+        # Inclusive bounds: documents sharing the watermark timestamp are merged again, which is harmless.
+        # Documents without timestamps (tags, most categories) are read in full every time
+        query = {"$or": [
+            {"updatedAt": {"$gte": since}},
+            {"createdAt": {"$gte": since}},
+            {"updatedAt": None, "createdAt": None},
+        ]}
+
+    batch_size = MONGO_BATCH_SIZES.get(collection.name, DEFAULT_MONGO_BATCH_SIZE)
+    projection = list(fields) if fields is not None else None
+    docs = list(collection.find(query, projection).batch_size(batch_size))
+    if col_state["lines"] == 0 or all(_doc_timestamp(doc) is not None for doc in docs):
+        return docs
+
+    # Re-read documents without timestamps only count as changed if they differ from the synced copy
+    synced = {doc_id(doc): doc for doc in iter_local_json(collection.name + ".ndjson", data_folder=sync_folder)}
+    return [
+        doc for doc in docs
+        if _doc_timestamp(doc) is not None
+        or synced.get(doc_id(doc)) != json.loads(json.dumps(doc, default=_json_default))
+    ]
+
+def _doc_timestamp(doc):
+    value = doc.get("updatedAt") or doc.get("createdAt")
+    if value is None:
+        return None
+    return parse_timestamp(value)
+
+def _changed_since(doc, watermark):
+    if watermark is None:
+        return True
+    ts = _doc_timestamp(doc)
+    # Documents without timestamps cannot be compared, so they are always merged
+    return ts is None or ts >= watermark
+
+def _append_ndjson(path, docs):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(doc, default=_json_default))
+            f.write("\n")
+
+def _json_default(value):
+    # MongoDB types: ObjectId -> hex string, datetime -> ISO string
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+def _load_sync_state(sync_folder):
+    path = os.path.join(sync_folder, SYNC_STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_sync_state(state, sync_folder):
+    os.makedirs(sync_folder, exist_ok=True)
+    path = os.path.join(sync_folder, SYNC_STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+    os.replace(path + ".tmp", path)
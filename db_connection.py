@@ -1,10 +1,20 @@
 import pymongo
 
+# One client per process: MongoClient is thread-safe and pools its connections,
+# so concurrent collection fetches share it instead of opening new clients.
+_client = None
+
+def get_mongo_client(connection_string, max_pool_size=16):
+    global _client
+    if _client is None:
+        _client = pymongo.MongoClient(connection_string, maxPoolSize=max_pool_size)
+    return _client
+
 def get_database_connection():
 
     connection_string = (
         #Put your connection string
     )
-    client = pymongo.MongoClient(connection_string)
+    client = get_mongo_client(connection_string)
     db = client["unbiasly"]
     return db
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import ContextDecorator
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = "news_ranking"
+
+class Metrics:
+    """
+    Process-wide stage timings and counters.
+
+    Stage timings are aggregated per name (calls, total and max seconds).
+    With memory tracking on, each stage also records the tracemalloc peak
+    of the allocations made while it ran (nested stages included).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}     # name -> {"calls", "seconds", "max_seconds", "peak_bytes"}
+        self.counters = {}   # name -> value
+        self.track_memory = False
+        self._local = threading.local()
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def record(self, name, seconds, peak_bytes=None):
+        with self.lock:
+            stage = self.stages.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_bytes": None}
+            )
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+            if peak_bytes is not None:
+                stage["peak_bytes"] = max(stage["peak_bytes"] or 0, peak_bytes)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def stack(self):
+        # Open stages of the current thread, innermost last (used for memory peaks)
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+# The registry every module reports to
+METRICS = Metrics()
+
+class timed(ContextDecorator):
+    """
+    Times a stage, as a context manager or a decorator:
+
+        with timed("load_data"):
+            ...
+
+        @timed("assign_cohorts")
+        def assign_cohorts(...):
+            ...
+
+    After a with-block, .seconds holds the elapsed wall-clock time.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = None
+
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, so concurrent and recursive calls don't share state
+        return timed(self.name)
+
+    def __enter__(self):
+        if METRICS.track_memory and tracemalloc.is_tracing():
+            stack = METRICS.stack()
+            if stack:
+                # The parent keeps the peak reached so far before the counter is reset
+                stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            stack.append({"peak": 0})
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._start
+        peak = None
+        if METRICS.track_memory and tracemalloc.is_tracing() and METRICS.stack():
+            stack = METRICS.stack()
+            peak = max(stack.pop()["peak"], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+        METRICS.record(self.name, self.seconds, peak)
+        return False
+
+def count(name, value=1):
+    # Increments a counter, e.g. count("articles_scored", len(X))
+    METRICS.count(name, value)
+
+def enable_memory_tracking():
+    # Per-stage tracemalloc peaks from now on (slows down allocation-heavy code)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    METRICS.track_memory = True
+
+def format_report(metrics=METRICS):
+    """
+    Per-stage breakdown (slowest first) followed by the counters, as text.
+    """
+    with metrics.lock:
+        stages = sorted(metrics.stages.items(), key=lambda item: -item[1]["seconds"])
+        counters = sorted(metrics.counters.items())
+
+    lines = [f"{'stage':<36}{'calls':>8}{'total s':>11}{'max s':>10}{'peak MB':>10}"]
+    for name, stage in stages:
+        peak = "" if stage["peak_bytes"] is None else f"{stage['peak_bytes'] / 2**20:.1f}"
+        lines.append(
+            f"{name:<36}{stage['calls']:>8}{stage['seconds']:>11.3f}{stage['max_seconds']:>10.3f}{peak:>10}"
+        )
+    if counters:
+        lines.append("")
+        lines.append(f"{'counter':<36}{'value':>10}")
+        for name, value in counters:
+            lines.append(f"{name:<36}{value:>10}")
+    return "\n".join(lines)
+
+def prometheus_text(metrics=METRICS, prefix=METRIC_PREFIX):
+    """
+    The metrics in the Prometheus text exposition format.
+    """
+    with metrics.lock:
+        stages = sorted(metrics.stages.items())
+        counters = sorted(metrics.counters.items())
+
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{prefix}_{name}{labels} {value}")
+
+    family("stage_seconds_total", "counter", "Wall-clock seconds spent in each stage.",
+           [(f'{{stage="{name}"}}', f"{stage['seconds']:.6f}") for name, stage in stages])
+    family("stage_calls_total", "counter", "Number of times each stage ran.",
+           [(f'{{stage="{name}"}}', stage["calls"]) for name, stage in stages])
+    family("stage_max_seconds", "gauge", "Slowest single run of each stage.",
+           [(f'{{stage="{name}"}}', f"{stage['max_seconds']:.6f}") for name, stage in stages])
+    peaks = [(f'{{stage="{name}"}}', stage["peak_bytes"]) for name, stage in stages
+             if stage["peak_bytes"] is not None]
+    if peaks:
+        family("stage_peak_bytes", "gauge", "Peak traced memory allocated during each stage.", peaks)
+    for name, value in counters:
+        family(f"{name}_total", "counter", f"Total {name.replace('_', ' ')}.", [("", value)])
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path, metrics=METRICS):
+    # Writes the Prometheus text file atomically (e.g. for node_exporter's textfile collector)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(metrics))
+    os.replace(tmp, path)
@@ -1,19 +1,38 @@
 # main.py
 import argparse
+import cProfile
 import random
 import json
 import sys
+import numpy as np
+import xgboost as xgb
 
-from data_loader import load_data
+from data_loader import RANKING_PROJECTIONS, load_data
 from model_training import (
-    build_feature_matrix,
+    build_training_memmap,
+    iter_array_batches,
+    iter_training_batches,
     train_xgboost_model,
     save_model,
-    load_model
+    load_model,
+    load_manifest,
+    resolve_model_path,
+    trained_through,
+    MODEL_PATH
 )
-from user_cohort import assign_cohorts
+from user_cohort import assign_cohort_to_custom_user, get_cohort_model
 from article_ranking import rank_articles_for_user
-from utils import remove_duplicate_users, filter_users_with_categories
+from ranking_server import SYNC_INTERVAL, serve
+from batch_ranking import OUTPUT_FORMATS, run_batch
+from click_counters import CUSTOM_USER_ID, update_click_counters
+from ranking_cache import get_ranking_cache, rank_with_cache
+from article_store import build_article_store
+from utils import filter_users_with_categories, remove_duplicate_users
+from article_index import ArticleIndex
+from article_window import ArticleWindow
+from snapshot import corpus_key, load_corpus
+from compiled_scorer import compile_scorer, save_compiled_scorer, get_compiled_scorer
+from instrumentation import enable_memory_tracking, format_report, write_prometheus
 
 # DYNAMIC COLOR CODES
 COLOR_CODES = [
@@ -30,6 +49,9 @@ RESET_COLOR = "\033[0m"
 
 N_ART = 100
 
+# Maximum boosting rounds added by a retrain (early stopping usually ends it sooner)
+RETRAIN_ROUNDS = 50
+
 SHOW_ALL_USER_PLUS_COHORTS = False
 
 def get_dynamic_color(category_name: str) -> str:
@@ -42,22 +64,67 @@ def get_dynamic_color(category_name: str) -> str:
     return COLOR_CODES[idx]
 # ---------------------------------------------------------------
 
-def training_mode(use_local_json=True):
-    data_dict = load_data(use_local_json=use_local_json, db=None)
+def training_mode(use_local_json=True, workers=1, negatives=None, retrain=False):
+    data_dict = load_data(use_local_json=use_local_json, db=None, projections=RANKING_PROJECTIONS)
     users = data_dict["users"]
     user_prefs = data_dict["user_preferences"]
     articles = data_dict["articles"]
+    article_store = build_article_store(articles)
 
-    X, y = build_feature_matrix(users, user_prefs, articles)
-    if len(X) == 0:
+    # Retraining continues boosting from the saved model on articles updated since it was trained
+    previous_model = None
+    article_rows = None
+    if retrain:
+        try:
+            previous_model = load_model()
+            since = trained_through(load_manifest())
+        except (OSError, ValueError, xgb.core.XGBoostError):
+            print("No trained model (with a manifest) found. Please run a full training first.")
+            return
+        if not hasattr(previous_model, "save_raw"):
+            previous_model = previous_model.get_booster()
+        if since is None:
+            print("The saved model does not record its training data. Retraining on the full corpus.")
+        else:
+            article_rows = np.flatnonzero(article_store.updated_at > since)
+            print(f"Retraining on {len(article_rows)} articles updated since the last training.")
+
+    # Streaming the users x articles training set in bounded blocks (optionally
+    # negative-sampled), or building it once with several worker processes
+    # into memory-mapped arrays
+    if workers > 1:
+        X, y = build_training_memmap(users, user_prefs, articles, article_store=article_store,
+                                     workers=workers, article_rows=article_rows)
+        n_rows = len(X)
+
+        def batches():
+            return iter_array_batches(X, y)
+    else:
+        # Training users x trained articles, counted without building a block
+        n_articles = len(article_store) if article_rows is None else len(article_rows)
+        n_rows = len(filter_users_with_categories(remove_duplicate_users(users), user_prefs)) * n_articles
+
+        def batches():
+            return iter_training_batches(users, user_prefs, articles, article_store=article_store,
+                                         negatives=negatives, article_rows=article_rows)
+
+    if n_rows == 0:
         print("No data for training.")
         return
 
-    model = train_xgboost_model(X, y)
-    save_model(model)
-    print("\nXGBoost model training complete. Saved as trained_model.pkl")
+    model = train_xgboost_model(
+        batches=batches,
+        xgb_model=previous_model,
+        num_boost_round=RETRAIN_ROUNDS if retrain else 200
+    )
+    corpus_hash = corpus_key() if use_local_json else None
+    save_model(model, corpus_hash=corpus_hash, data_through=article_store.updated_at.max())
+
+    # Precomputing the model over the whole feature grid for fast serving
+    save_compiled_scorer(compile_scorer(model))
+    print(f"\nXGBoost model training complete. Saved as {MODEL_PATH}")
 
-def production_mode(use_local_json=True):
+def production_mode(use_local_json=True, refit_cohorts=False, horizon_days=None):
     # 1) Loading the stored trained model if found
     try:
         model = load_model()
@@ -65,29 +132,32 @@ def production_mode(use_local_json=True):
         print("No trained model found. Please run training first.")
         return
 
-    # 2) Loading data (local JSON files or MongoDB)
-    data_dict = load_data(use_local_json=use_local_json, db=None)
-    users = data_dict["users"]
-    user_prefs_list = data_dict["user_preferences"]
-    articles = data_dict["articles"]
-    categories = data_dict["article_categories"]
+    #   Scoring through the precomputed feature grid instead of the trees
+    model = get_compiled_scorer(model, model_path=resolve_model_path())
 
-    # 3) Building category map: OID -> name
-    category_map = {}
-    for cat in categories:
-        cat_id = str(cat["_id"])
-        cat_name = cat.get("name", "unknown")
-        category_map[cat_id] = cat_name
+    # 2) Loading the normalized corpus (snapshot, local JSON files or MongoDB)
+    article_store, user_store, category_map = load_corpus(use_local_json=use_local_json)
+    corpus_store = article_store
 
-    #   Also building an inverted category map
+    #   Inverted index: only each user's candidate articles are scored,
+    #   restricted to the articles inside the freshness horizon if one is set
+    if horizon_days is not None:
+        article_window = ArticleWindow(article_store, horizon_days=horizon_days)
+        article_store = article_window.article_store
+        article_index = article_window.article_index
+    else:
+        article_index = ArticleIndex(article_store)
+
+    # 3) Building an inverted category map: name -> OID
     inverted_category_map = {v: k for k, v in category_map.items()}
 
-    # 4) Cleaning the user data
-    users = remove_duplicate_users(users)
-    users = filter_users_with_categories(users, user_prefs_list)
+    # 4) The user store only holds de-duplicated users with categories
+    users = user_store.users()
+    user_prefs_list = user_store.user_preferences()
 
-    # 5) Cohorts for users in the DB (not for custom users)
-    user_cohort_map = assign_cohorts(users, user_prefs_list, category_map, n_clusters=15)
+    # 5) Cohorts for users in the DB, from the saved cohort model (new/changed users are predicted)
+    cohort_model = get_cohort_model(user_store, category_map, n_clusters=15, refit=refit_cohorts)
+    user_cohort_map = cohort_model.cohort_map()
 
     if SHOW_ALL_USER_PLUS_COHORTS:
         for u, c in user_cohort_map.items():
@@ -97,6 +167,10 @@ def production_mode(use_local_json=True):
     # 6) Mapping user_id -> user_pref to correctly fetch data
     prefs_map = {str(up["user_id"]): up for up in user_prefs_list}
 
+    #   Per-user click counters, with the events logged since the last run folded in
+    #   (resolved against the full corpus: clicks on articles outside the window count too)
+    click_counters = update_click_counters(corpus_store, category_map)
+
     # 7) Picking 20 random DB users
     if len(users) <= 20:
         chosen_users = users
@@ -133,28 +207,39 @@ def production_mode(use_local_json=True):
         print(f"Interested Categories: {category_names}")
         print(f"Cohort: {assigned_cohort}")
 
-        ranked_indices_scores = rank_articles_for_user(
+        cat_clicks, tag_clicks = click_counters.clicks(uid_str)
+        if cat_clicks or tag_clicks:
+            print(f"Clicks: {sum(cat_clicks.values())} on categories, {sum(tag_clicks.values())} on tags")
+
+        # Base rankings are shared by users with the same language, cohort and categories;
+        # click counts rerank the cached candidate pool
+        ranking_cache = get_ranking_cache(
+            model, article_store, user_store, user_cohort_map, resolve_model_path(),
+            article_index=article_index, lazy=True
+        )
+        ranked_indices_scores = rank_with_cache(
+            ranking_cache,
             model,
-            selected_user,
-            prefs_map,
-            articles,
+            article_store,
+            user_pref,
+            cohort=cluster_top_words,
+            top_k=N_ART,
             category_map=category_map,
-            custom_cat_clicks=None,
-            custom_tag_clicks=None
+            custom_cat_clicks=cat_clicks,
+            custom_tag_clicks=tag_clicks,
+            article_index=article_index
         )
+        if ranking_cache.misses:
+            # Keeping the newly ranked key for the next run
+            ranking_cache.save()
 
         top_n = ranked_indices_scores[:N_ART]
         print("\n--- Top 100 Articles for this user ---")
         for rank, (article_idx, final_score) in enumerate(top_n, start=1):
-            article = articles[article_idx]
-            article_title = article.get("title", "Untitled Article")
+            article_title = article_store.title(article_idx)
 
             # Finding the article's first category name
-            cat_oids = article.get("category", [])
-            cat_name = "unknown"
-            if cat_oids and isinstance(cat_oids, list) and "$oid" in cat_oids[0]:
-                cat_oid = cat_oids[0]["$oid"]
-                cat_name = category_map.get(cat_oid, "unknown")
+            cat_name = category_map.get(article_store.primary_category(article_idx), "unknown")
 
             # Color coding the article
             color_code = get_dynamic_color(cat_name)
@@ -183,6 +268,11 @@ def production_mode(use_local_json=True):
         for (tag_name, count) in favorite_tags:
             custom_tag_clicks[tag_name] = count
 
+        # Clicks logged by create_user.py sessions cover every session, so they take precedence
+        logged_cat_clicks, logged_tag_clicks = click_counters.clicks(CUSTOM_USER_ID)
+        if logged_cat_clicks or logged_tag_clicks:
+            custom_cat_clicks, custom_tag_clicks = logged_cat_clicks, logged_tag_clicks
+
         # Creating a list of OIDs for the custom user
         category_oids = []
         for (cat_name, _count) in favorite_categories:
@@ -195,7 +285,8 @@ def production_mode(use_local_json=True):
             "language": language_pref,
             "article_category": category_oids,
         }
-        assigned_cohort = f"{language_pref.lower()}-speaking custom fans"
+        custom_cohort = assign_cohort_to_custom_user(custom_data, cohort_model, category_map)
+        assigned_cohort = f"{language_pref.lower()}-speaking {custom_cohort} fans"
 
         print(f"\n--- Custom User Details ---")
         print(f"Language Preferences: {language_pref}")
@@ -220,23 +311,20 @@ def production_mode(use_local_json=True):
             model,
             selected_user,
             custom_prefs_map,
-            articles,
+            None,
             category_map=category_map,
             custom_cat_clicks=custom_cat_clicks,
-            custom_tag_clicks=custom_tag_clicks
+            custom_tag_clicks=custom_tag_clicks,
+            article_store=article_store,
+            top_k=N_ART,
+            article_index=article_index
         )
 
         top_n = ranked_indices_scores[:N_ART]
         print("\n--- Top 100 Articles for this custom user ---")
         for rank, (article_idx, final_score) in enumerate(top_n, start=1):
-            article = articles[article_idx]
-            article_title = article.get("title", "Untitled Article")
-
-            cat_oids = article.get("category", [])
-            cat_name = "unknown"
-            if cat_oids and isinstance(cat_oids, list) and "$oid" in cat_oids[0]:
-                cat_oid = cat_oids[0]["$oid"]
-                cat_name = category_map.get(cat_oid, "unknown")
+            article_title = article_store.title(article_idx)
+            cat_name = category_map.get(article_store.primary_category(article_idx), "unknown")
 
             color_code = get_dynamic_color(cat_name)
             print(f"{color_code}{rank}. [{final_score}/100] \"{article_title}\" ({cat_name}){RESET_COLOR}")
@@ -249,21 +337,139 @@ def main():
     parser.add_argument(
         "--mode",
         type=str,
-        choices=["training", "production"],
+        choices=["training", "production", "serve", "batch"],
         required=True,
-        help="Mode: training or production"
+        help="Mode: training, production, serve (long-running HTTP ranking server) "
+             "or batch (precomputes the feed of every user)"
     )
     parser.add_argument(
         "--local",
         action="store_true",
         help="Use local JSON files instead of MongoDB"
     )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the ranking server binds to (serve mode)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="Port the ranking server listens on (serve mode)"
+    )
+    parser.add_argument(
+        "--sync-interval",
+        type=int,
+        default=SYNC_INTERVAL,
+        help="Seconds between two syncs of changed documents into the ranking server, 0 disables them "
+             "(serve mode)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes building the training set (training mode) or ranking users (batch mode)"
+    )
+    parser.add_argument(
+        "--retrain",
+        action="store_true",
+        help="Continue boosting the saved model on articles updated since it was trained (training mode)"
+    )
+    parser.add_argument(
+        "--negatives",
+        type=int,
+        default=None,
+        help="Train on positive-like pairs plus this many sampled negatives per user (training mode). "
+             "Not combinable with --workers: the parallel build writes every block at a row offset "
+             "fixed in advance, and a sampled block's size is only known once it is drawn"
+    )
+    parser.add_argument(
+        "--horizon-days",
+        type=int,
+        default=None,
+        help="Only rank articles updated within this many days (whole corpus if omitted)"
+    )
+    parser.add_argument(
+        "--refit-cohorts",
+        action="store_true",
+        help="Refit the cohort model from scratch instead of updating the saved one"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        choices=OUTPUT_FORMATS,
+        default="npz",
+        help="Where batch mode writes the feeds: data/batch/feeds.npz, data/batch/feeds.ndjson "
+             "or a MongoDB collection"
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=100,
+        help="Articles per user feed (batch mode)"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint of an interrupted batch run and start from the first user"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a per-stage time and peak-memory breakdown at exit"
+    )
+    parser.add_argument(
+        "--cprofile",
+        type=str,
+        default=None,
+        help="Run under cProfile and dump the stats to this file (view with python -m pstats)"
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="Write the stage timings and counters to this file in Prometheus text format at exit"
+    )
     args = parser.parse_args()
+    if args.negatives is not None and args.workers > 1:
+        parser.error("--negatives streams a sampled set from one process; it cannot be combined with --workers "
+                     "(the parallel build needs every block's row count before it starts)")
 
+    if args.profile:
+        enable_memory_tracking()
+    profiler = cProfile.Profile() if args.cprofile else None
+    try:
+        if profiler is not None:
+            profiler.runcall(run_mode, args)
+        else:
+            run_mode(args)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(args.cprofile)
+            print(f"cProfile stats written to {args.cprofile}")
+        if args.profile:
+            print("\n" + format_report())
+        if args.metrics_file:
+            write_prometheus(args.metrics_file)
+
+def run_mode(args):
     if args.mode == "training":
-        training_mode(use_local_json=args.local)
+        training_mode(use_local_json=args.local, workers=args.workers, negatives=args.negatives,
+                      retrain=args.retrain)
     elif args.mode == "production":
-        production_mode(use_local_json=args.local)
+        production_mode(use_local_json=args.local, refit_cohorts=args.refit_cohorts,
+                        horizon_days=args.horizon_days)
+    elif args.mode == "serve":
+        serve(use_local_json=args.local, host=args.host, port=args.port,
+              refit_cohorts=args.refit_cohorts, horizon_days=args.horizon_days,
+              sync_interval=args.sync_interval)
+    elif args.mode == "batch":
+        run_batch(use_local_json=args.local, output=args.output, top_k=args.top_k, workers=args.workers,
+                  horizon_days=args.horizon_days, restart=args.restart)
 
 if __name__ == "__main__":
     main()
@@ -1,165 +1,534 @@
+import datetime
+import json
+import os
 import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import numpy as np
-import random
 from tqdm import tqdm
-from xgboost import XGBRegressor
-import datetime
+import xgboost as xgb
 
 from utils import (
     remove_duplicate_users,
-    filter_users_with_categories,
-    build_user_article_feature
+    filter_users_with_categories
+)
+from article_store import (
+    ArticleStore,
+    SECONDS_PER_DAY,
+    build_article_store,
+    build_users_features,
+    stack_users_features,
+    users_match_columns
 )
+from data_loader import DATA_FOLDER
+from instrumentation import timed
+
+MODEL_PATH = "trained_model.ubj"
+LEGACY_MODEL_PATH = "trained_model.pkl"
+MODEL_FORMAT_VERSION = 1
+
+# Column order of every feature matrix the model sees
+FEATURE_NAMES = ["language_feature", "lang_match", "cat_overlap", "days_old"]
 
-def build_feature_matrix(users, user_prefs, articles):
+# Scratch space for training sets built by several worker processes
+TRAINING_FOLDER = os.path.join(DATA_FOLDER, "training")
+
+# Labels are drawn from one random stream per group of this many users, so
+# they do not depend on how the users are split into blocks
+LABEL_GROUP_USERS = 64
+
+@timed("build_feature_matrix")
+def build_feature_matrix(users, user_prefs, articles, article_store=None, seed=42, negatives=None):
     """
     Builds a more complex partial-label dataset.
     1) Identify the LATEST article's updated_at date for 'freshness' reference.
     2) Build a global category frequency map for weighting partial labels by popularity.
     3) Incorporate a bigger random range to introduce more variance.
+
+    Materializes the whole users x articles matrix; use iter_training_batches
+    to stream it in bounded chunks instead. With `negatives`, only a sample
+    of the pairs is kept (see iter_training_batches) and (X, y, weights) is returned.
     """
-    # Finding the latest updatedAt among all articles to get the date of the latest article
-    max_dt = None
-    for art in articles:
-        updated_at_val = art.get("updatedAt")
-        article_dt = _parse_date(updated_at_val)
-        if (max_dt is None) or (article_dt > max_dt):
-            max_dt = article_dt
-
-    # Fallback to a default date if no dates found
-    if max_dt is None:
-        max_dt = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
-
-    # Building global category frequency map across all articles
-    cat_frequency = {}
-    total_articles = 0
-
-    for art in articles:
-        cat_list = art.get("category", [])
-        used_cats = []
-        for c in cat_list:
-            oid = c.get("$oid")
-            if oid:
-                used_cats.append(oid)
-        unique_cats = set(used_cats)
-        for cid in unique_cats:
-            cat_frequency[cid] = cat_frequency.get(cid, 0) + 1
-        total_articles += 1
-
-    # Converting frequency to [0..1] by dividing by the max
-    if cat_frequency:
-        max_freq = max(cat_frequency.values())
-    else:
-        max_freq = 1
+    blocks = list(iter_training_batches(
+        users, user_prefs, articles, article_store=article_store, seed=seed, progress=True,
+        negatives=negatives
+    ))
+
+    if not blocks:
+        X, y = np.empty((0, 4), dtype=float), np.empty(0, dtype=float)
+        return (X, y) if negatives is None else (X, y, np.empty(0, dtype=float))
+
+    return tuple(np.concatenate(column).astype(float) for column in zip(*blocks))
+
+def iter_training_batches(users, user_prefs, articles, article_store=None,
+                          chunk_size=1_000_000, seed=42, progress=False, now=None, negatives=None,
+                          article_rows=None):
+    """
+    Generator over the users x articles training set, yielding (X, y) blocks
+    of float32 with at most ~chunk_size rows (whole users per block).
+
+    The labels of the g-th group of LABEL_GROUP_USERS users are drawn from
+    np.random.default_rng([seed, g, 0]), so the output depends only on seed
+    and now (with negatives, block i is sampled with default_rng([seed, i, 2])
+    and the output depends on chunk_size as well).
+
+    With negatives=K, every positive-like pair (same language and at least
+    one shared category) is kept, plus about K negatives per user drawn
+    evenly from the negative strata (see NEGATIVE_STRATA). Blocks are then
+    (X, y, weights), the weights undoing the subsampling of each stratum.
+
+    article_rows restricts the pairs to those article rows (e.g. the articles
+    that arrived since the last training); labels still use corpus-wide
+    freshness and category popularity.
+    """
+    if article_store is None:
+        article_store = build_article_store(articles)
+
+    # Per-article label inputs are computed once for the whole corpus
+    article_factor = _article_freshness(article_store) * _category_frequency_factor(article_store)
+    if article_rows is not None:
+        article_factor = article_factor[article_rows]
+    n_articles = len(article_factor)
+    blocks = _training_blocks(users, user_prefs, n_articles, chunk_size)
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+
+    pbar = None
+    if progress:
+        total = sum(len(prefs) for prefs in blocks) * n_articles
+        pbar = tqdm(total=total, desc="Building feature matrix", ncols=80)
+
+    first_user = 0
+    for block_idx, prefs in enumerate(blocks):
+        if negatives is None:
+            X, y = _training_block(article_store, prefs, now, article_factor, seed, first_user,
+                                   rows=article_rows)
+            block = (X, y)
+        else:
+            block = _sampled_training_block(
+                article_store, prefs, now, article_factor, seed, first_user, block_idx, negatives,
+                rows=article_rows
+            )
+        first_user += len(prefs)
+        if pbar is not None:
+            pbar.update(len(prefs) * n_articles)
+        yield block
 
-    for cid in cat_frequency:
-        cat_frequency[cid] = cat_frequency[cid] / max_freq
+    if pbar is not None:
+        pbar.close()
 
-    # Creating matrix X, y with partial labeling
+@timed("build_training_memmap")
+def build_training_memmap(users, user_prefs, articles, article_store=None, workers=None,
+                          folder=TRAINING_FOLDER, chunk_size=1_000_000, seed=42, now=None,
+                          article_rows=None):
+    """
+    Builds the same training set as iter_training_batches with a pool of
+    worker processes, one block per task. The users are split into at least
+    one contiguous range per worker, so small corpora are parallelized too.
+
+    The article columns are written once as .npy files that every worker
+    memory-maps read-only, and each worker writes its block straight into
+    folder/X.npy and folder/y.npy at the block's row offset. Returns the
+    (X, y) arrays as read-only memory maps.
+    """
+    if article_store is None:
+        article_store = build_article_store(articles)
+    article_factor = _article_freshness(article_store) * _category_frequency_factor(article_store)
+    if article_rows is not None:
+        article_factor = article_factor[article_rows]
+    n_articles = len(article_factor)
+    blocks = _training_blocks(users, user_prefs, n_articles, chunk_size,
+                              n_blocks=workers or os.cpu_count() or 1)
+    if not blocks:
+        return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32)
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+
+    shutil.rmtree(folder, ignore_errors=True)
+    store_folder = os.path.join(folder, "articles")
+    os.makedirs(store_folder)
+    for name, arr in article_store.to_arrays().items():
+        np.save(os.path.join(store_folder, f"{name}.npy"), np.asarray(arr))
+    np.save(os.path.join(folder, "article_factor.npy"), article_factor)
+    if article_rows is not None:
+        np.save(os.path.join(folder, "article_rows.npy"), np.asarray(article_rows))
+
+    n_rows = sum(len(prefs) for prefs in blocks) * n_articles
+    X_path = os.path.join(folder, "X.npy")
+    y_path = os.path.join(folder, "y.npy")
+    np.lib.format.open_memmap(X_path, mode="w+", dtype=np.float32, shape=(n_rows, 4)).flush()
+    np.lib.format.open_memmap(y_path, mode="w+", dtype=np.float32, shape=(n_rows,)).flush()
+
+    first_users = np.cumsum([0] + [len(prefs) for prefs in blocks])
+    tasks = [
+        (int(first_users[block_idx]), prefs, int(first_users[block_idx]) * n_articles)
+        for block_idx, prefs in enumerate(blocks)
+    ]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_training_worker,
+                             initargs=(folder, now, seed)) as pool:
+        for _ in tqdm(pool.map(_write_training_block, tasks), total=len(tasks),
+                      desc="Building feature matrix", ncols=80):
+            pass
+
+    return np.load(X_path, mmap_mode="r"), np.load(y_path, mmap_mode="r")
+
+def iter_array_batches(X, y, chunk_size=1_000_000):
+    # (X, y) in blocks of chunk_size rows, e.g. over the memory maps of build_training_memmap
+    for start in range(0, len(X), chunk_size):
+        yield np.asarray(X[start:start + chunk_size]), np.asarray(y[start:start + chunk_size])
+
+def _training_blocks(users, user_prefs, n_articles, chunk_size, n_blocks=1):
+    # Preference documents of the training users, grouped into blocks of ~chunk_size rows
+    # (and at least n_blocks blocks if there are enough users)
     users = remove_duplicate_users(users)
     users = filter_users_with_categories(users, user_prefs)
     prefs_map = {str(up["user_id"]): up for up in user_prefs}
+    if n_articles == 0:
+        return []
+
+    prefs = [prefs_map.get(str(user["_id"]), {}) for user in users]
+    users_per_chunk = max(1, chunk_size // n_articles)
+    if n_blocks > 1:
+        users_per_chunk = min(users_per_chunk, max(1, -(-len(prefs) // n_blocks)))
+    return [prefs[start:start + users_per_chunk] for start in range(0, len(prefs), users_per_chunk)]
 
-    data = []
-    labels = []
+def _training_block(article_store, prefs, now, article_factor, seed, first_user, rows=None):
+    # features = [language_feature, lang_match, cat_overlap, days_old]
+    X = build_users_features(article_store, prefs, now, rows=rows, dtype=np.float32)
 
-    total_iterations = len(users) * len(articles)
-    pbar = tqdm(total=total_iterations, desc="Building feature matrix", ncols=80)
+    draws = _label_draws(seed, first_user, len(prefs), len(article_factor))
+    y = _partial_labels(X, np.tile(article_factor, len(prefs)), draws)
+    return X, y
 
-    for user in users:
-        for article in articles:
+def _label_draws(seed, first_user, n_users, n_articles):
+    # Uniform draws for the pairs of users first_user .. first_user + n_users - 1, see LABEL_GROUP_USERS
+    first_group = first_user // LABEL_GROUP_USERS
+    last_group = (first_user + n_users - 1) // LABEL_GROUP_USERS
+    draws = np.concatenate([
+        np.random.default_rng([seed, group, 0]).random(LABEL_GROUP_USERS * n_articles)
+        for group in range(first_group, last_group + 1)
+    ])
+    start = (first_user - first_group * LABEL_GROUP_USERS) * n_articles
+    return draws[start:start + n_users * n_articles]
 
-            # features = [language_feature, lang_match, cat_overlap, days_old]
-            features = build_user_article_feature(user, prefs_map, article)
-            data.append(features)
+# Negative pairs are sampled separately within each of these (lang_match, has_overlap) strata
+NEGATIVE_STRATA = ((0, False), (0, True), (1, False))
 
-            updated_at_val = article.get("updatedAt")
-            article_dt = _parse_date(updated_at_val)
-            days_diff = (max_dt - article_dt).days  # smaller -> more fresh
+def _sampled_training_block(article_store, prefs, now, article_factor, seed, first_user, block_idx,
+                            negatives, rows=None):
+    # _training_block restricted to positives plus stratified negatives, with weights.
+    # The pairs are sampled first, so features are only built for the kept ones
+    columns = users_match_columns(article_store, prefs, rows=rows)
+    rng = np.random.default_rng([seed, block_idx, 2])
+    keep, weights = _sample_pairs(columns[1].ravel(), columns[2].ravel() > 0, len(prefs), negatives, rng)
 
-            # we can override the features array or handle it in the partial labeling logic directly
+    X = stack_users_features(article_store, columns, now, rows=rows, dtype=np.float32, keep=keep)
+    draws = _label_draws(seed, first_user, len(prefs), len(article_factor))[keep]
+    y = _partial_labels(X, np.tile(article_factor, len(prefs))[keep], draws)
+    return X, y, weights
 
-            # Figuring out the article's primary category -> frequency factor
-            cat_list = article.get("category", [])
-            freq_factor = 0.0
-            if cat_list:
+def _sample_pairs(lang_match, has_overlap, n_users, negatives, rng):
+    """
+    Rows to keep from a block of n_users equally sized user blocks, given
+    each row's lang_match and whether it has a category overlap, and their weights.
+    Stratum 0 (positive-like) is kept whole; each negative stratum keeps at
+    most ceil(negatives / len(NEGATIVE_STRATA)) random rows per user, weighted
+    by stratum size / rows kept.
+    """
+    n_rows = len(lang_match)
+    stratum = np.zeros(n_rows, dtype=np.int64)
+    for s, (lang, overlap) in enumerate(NEGATIVE_STRATA, start=1):
+        stratum[(lang_match == bool(lang)) & (has_overlap == overlap)] = s
 
-                # If multiple categories are present, we use all of them
-                sum_factors = 0.0
-                for cdict in cat_list:
-                    cid = cdict.get("$oid")
-                    if cid:
-                        sum_factors += cat_frequency.get(cid, 0.0)
-                freq_factor = sum_factors / len(cat_list)
-            # freq_factor in [0..1], higher -> more popular categories
+    n_strata = len(NEGATIVE_STRATA) + 1
+    user_idx = np.repeat(np.arange(n_users), n_rows // n_users) if n_users else np.empty(0, dtype=np.int64)
+    group = user_idx * n_strata + stratum
+    sizes = np.bincount(group, minlength=n_users * n_strata)
 
-            # Partial label logic
-            lang_match = features[1]  # 0 or 1
-            cat_overlap = features[2] # int
+    per_stratum = -(-negatives // len(NEGATIVE_STRATA))
+    quota = np.tile(np.array([n_rows] + [per_stratum] * len(NEGATIVE_STRATA)), n_users)
 
-            # Freshness factor: smaller days_diff -> bigger impact on freshness
-            base_freshness = 0.9 - (days_diff / 180.0) * (0.9 - 0.3)
-            if base_freshness < 0.3:
-                base_freshness = 0.3
-            if base_freshness > 0.9:
-                base_freshness = 0.9
+    # A random rank within each (user, stratum) group decides which rows are kept
+    order = np.lexsort((rng.random(n_rows), group))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(n_rows) - starts[group[order]]
+    keep = np.sort(order[rank < quota[group[order]]])
 
-            # Base engagement
-            if lang_match == 1 and cat_overlap > 0:
+    kept_group = group[keep]
+    weights = sizes[kept_group] / np.minimum(sizes[kept_group], quota[kept_group])
+    return keep, weights.astype(np.float32)
 
-                base_engagement = random.uniform(0.6, 1.0)
-                # scaling by cat_overlap
-                overlap_scale = min(cat_overlap, 5) / 5.0
-                base_engagement *= (0.5 + 0.5 * overlap_scale)
-                base_engagement = min(base_engagement, 1.0)
-            else:
-                base_engagement = random.uniform(0.0, 0.4)
+# Per-process state of build_training_memmap workers
+_worker_state = {}
 
-            raw_label = base_engagement * base_freshness * freq_factor
+def _init_training_worker(folder, now, seed):
+    store_folder = os.path.join(folder, "articles")
+    _worker_state.update(
+        article_store=ArticleStore.from_arrays({
+            name: np.load(os.path.join(store_folder, f"{name}.npy"), mmap_mode="r")
+            for name in ArticleStore.ARRAY_FIELDS
+        }),
+        article_factor=np.load(os.path.join(folder, "article_factor.npy")),
+        article_rows=(
+            np.load(os.path.join(folder, "article_rows.npy"))
+            if os.path.exists(os.path.join(folder, "article_rows.npy")) else None
+        ),
+        X=np.load(os.path.join(folder, "X.npy"), mmap_mode="r+"),
+        y=np.load(os.path.join(folder, "y.npy"), mmap_mode="r+"),
+        now=now,
+        seed=seed,
+    )
 
-            labels.append(raw_label)
-            pbar.update(1)
+def _write_training_block(task):
+    first_user, prefs, offset = task
+    state = _worker_state
+    X, y = _training_block(
+        state["article_store"], prefs, state["now"], state["article_factor"], state["seed"], first_user,
+        rows=state["article_rows"]
+    )
+    state["X"][offset:offset + len(X)] = X
+    state["y"][offset:offset + len(y)] = y
+    state["X"].flush()
+    state["y"].flush()
 
-    pbar.close()
+def _partial_labels(X, article_factor, draws):
+    """
+    Partial label logic for a feature block.
+    article_factor is freshness * category popularity of each row's article,
+    draws one U(0, 1) draw per row.
+    """
+    lang_match = X[:, 1]  # 0 or 1
+    cat_overlap = X[:, 2] # int
+    engaged = (lang_match == 1) & (cat_overlap > 0)
 
-    X = np.array(data, dtype=float)
-    y = np.array(labels, dtype=float)
-    return X, y
+    # Base engagement: U(0.6, 1.0) when engaged, U(0.0, 0.4) otherwise
+    base_engagement = np.where(engaged, 0.6 + 0.4 * draws, 0.4 * draws)
 
-def train_xgboost_model(X, y):
+    # scaling by cat_overlap
+    overlap_scale = np.minimum(cat_overlap, 5) / 5.0
+    base_engagement = np.where(
+        engaged,
+        np.minimum(base_engagement * (0.5 + 0.5 * overlap_scale), 1.0),
+        base_engagement
+    )
+    return (base_engagement * article_factor).astype(np.float32)
 
-    print("Training XGBoost regressor...")
-    model = XGBRegressor(
-        n_estimators=200,
-        max_depth=7,
-        learning_rate=0.1,
-        random_state=42,
-        objective="reg:squarederror",
-        eval_metric="rmse"
+def _article_freshness(article_store):
+    """
+    Freshness factor per article relative to the LATEST article in the corpus:
+    smaller days_diff -> bigger impact on freshness, clipped to [0.3..0.9].
+    """
+    if len(article_store):
+        max_ts = article_store.updated_at.max()
+    else:
+        # Fallback to a default date if no dates found
+        max_ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+    days_diff = np.floor((max_ts - article_store.updated_at) / SECONDS_PER_DAY)
+    base_freshness = 0.9 - (days_diff / 180.0) * (0.9 - 0.3)
+    return np.clip(base_freshness, 0.3, 0.9)
+
+def _category_frequency_factor(article_store):
+    """
+    Average popularity of each article's categories, in [0..1].
+    Popularity is the number of articles using a category divided by the max.
+    """
+    # Every category appears at most once per CSR row, so this counts articles
+    cat_frequency = np.bincount(
+        article_store.cat_indices, minlength=len(article_store.cat_vocab)
+    ).astype(float)
+    if cat_frequency.size and cat_frequency.max() > 0:
+        cat_frequency /= cat_frequency.max()
+
+    # If multiple categories are present, we use all of them
+    counts = article_store.cat_counts
+    sum_factors = np.bincount(
+        article_store.cat_rows,
+        weights=counts * cat_frequency[article_store.cat_indices],
+        minlength=len(article_store)
     )
-    model.fit(X, y)
+    n_cats = np.bincount(article_store.cat_rows, weights=counts, minlength=len(article_store))
+    return np.divide(sum_factors, n_cats, out=np.zeros_like(sum_factors), where=n_cats > 0)
+
+class _BatchIter(xgb.DataIter):
+    """
+    Feeds (X, y) blocks from a restartable batch source into XGBoost.
+    make_batches is called again on every reset, since XGBoost reads the data more than once.
+    """
+
+    def __init__(self, make_batches):
+        self._make_batches = make_batches
+        self._it = None
+        super().__init__()
+
+    def next(self, input_data):
+        if self._it is None:
+            self._it = iter(self._make_batches())
+        try:
+            block = next(self._it)
+        except StopIteration:
+            return False
+        # Blocks are (X, y) or (X, y, weights)
+        input_data(data=block[0], label=block[1], weight=block[2] if len(block) > 2 else None)
+        return True
+
+    def reset(self):
+        self._it = None
+
+def train_xgboost_model(X=None, y=None, batches=None, weights=None, xgb_model=None,
+                        num_boost_round=200, nthread=None, validation_fraction=0.1,
+                        early_stopping_rounds=20, seed=42):
+    """
+    Trains the XGBoost regressor and returns the fitted Booster.
+
+    Either pass the full (X, y) arrays (optionally with instance weights), or
+    `batches`: a zero-argument callable returning a fresh iterable of (X, y)
+    or (X, y, weights) blocks (e.g. iter_training_batches).
+    Blocks are quantized one at a time into a QuantileDMatrix, so peak memory
+    is bounded by the block size instead of the raw float matrix.
+
+    A random validation_fraction of the rows is held out; boosting stops
+    after early_stopping_rounds rounds without improvement on it, and the
+    booster is cut back to its best iteration. With xgb_model (a Booster),
+    boosting continues from that model for up to num_boost_round more rounds.
+    Wall-clock time of every stage is printed.
+    """
+    if batches is None:
+        batches = lambda: [(X, y) if weights is None else (X, y, weights)]
+    train_batches, valid_batches = _split_batches(batches, validation_fraction, seed)
+
+    print("Training XGBoost regressor...")
+    params = {
+        "max_depth": 7,
+        "learning_rate": 0.1,
+        "seed": seed,
+        "objective": "reg:squarederror",
+        "eval_metric": "rmse",
+        "tree_method": "hist",
+        "nthread": nthread or os.cpu_count() or 1,
+    }
+
+    with _stage("Quantizing training data", "train_quantize"):
+        dtrain = xgb.QuantileDMatrix(_BatchIter(train_batches))
+
+    evals = []
+    with _stage("Building validation set", "train_validation_set"):
+        valid_blocks = list(valid_batches()) if validation_fraction > 0 else []
+        if sum(len(block[0]) for block in valid_blocks):
+            dvalid = xgb.QuantileDMatrix(
+                np.concatenate([block[0] for block in valid_blocks]),
+                label=np.concatenate([block[1] for block in valid_blocks]),
+                weight=(
+                    np.concatenate([block[2] for block in valid_blocks])
+                    if len(valid_blocks[0]) > 2 else None
+                ),
+                ref=dtrain
+            )
+            evals = [(dvalid, "validation")]
+
+    with _stage("Boosting", "train_boost"):
+        model = xgb.train(
+            params,
+            dtrain,
+            num_boost_round=num_boost_round,
+            evals=evals,
+            early_stopping_rounds=early_stopping_rounds if evals else None,
+            xgb_model=xgb_model,
+            verbose_eval=False
+        )
+
+    if evals:
+        # Dropping the rounds after the best validation score
+        best_iteration, best_score = model.best_iteration, model.best_score
+        model = model[:best_iteration + 1]
+        print(f"  Validation rmse {best_score:.4f} at round {best_iteration + 1}")
     return model
 
-def save_model(model, path="trained_model.pkl"):
-    with open(path, "wb") as f:
-        pickle.dump(model, f)
+def _split_batches(batches, validation_fraction, seed):
+    """
+    (train, validation) batch sources over the same blocks. Row i of block b
+    is held out when default_rng([seed, b, 1]) draws < validation_fraction,
+    so every pass over the data splits it the same way.
+    """
+    def split(keep_validation):
+        for block_idx, block in enumerate(batches()):
+            held_out = np.random.default_rng([seed, block_idx, 1]).random(len(block[0])) < validation_fraction
+            mask = held_out if keep_validation else ~held_out
+            yield tuple(np.asarray(column)[mask] for column in block)
 
-def load_model(path="trained_model.pkl"):
-    with open(path, "rb") as f:
-        return pickle.load(f)
+    return (lambda: split(False)), (lambda: split(True))
 
-def _parse_date(updated_at_val):
+@contextmanager
+def _stage(name, metric):
+    # Prints the wall-clock time of a training stage (also recorded as `metric`)
+    with timed(metric) as timer:
+        yield
+    print(f"  {name}: {timer.seconds:.2f}s")
 
-    import datetime
-    if isinstance(updated_at_val, dict):
-        updated_str = updated_at_val.get("$date", "")
-    elif isinstance(updated_at_val, str):
-        updated_str = updated_at_val
-    else:
-        updated_str = ""
+def save_model(model, path=MODEL_PATH, corpus_hash=None, data_through=None):
+    """
+    Saves the booster in XGBoost's native format (UBJSON for .ubj, JSON for .json),
+    plus a small manifest next to it (see manifest_path).
+    data_through is the latest article update time (epoch seconds) the model
+    was trained on; a retrain only uses articles updated after it.
+    """
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    booster.save_model(path)
+
+    manifest = {
+        "format_version": MODEL_FORMAT_VERSION,
+        "model_file": os.path.basename(path),
+        "feature_names": FEATURE_NAMES,
+        "corpus_hash": corpus_hash,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "data_through": (
+            None if data_through is None
+            else datetime.datetime.fromtimestamp(data_through, datetime.timezone.utc).isoformat()
+        ),
+        "xgboost_version": xgb.__version__,
+        "num_boosted_rounds": booster.num_boosted_rounds(),
+    }
+    with open(manifest_path(path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+def load_model(path=None):
+    """
+    Loads a bare Booster (serve it with inplace_predict, no DMatrix needed).
+    Falls back to the legacy pickled model when no native model file exists.
+    """
+    path = resolve_model_path(path)
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    booster = xgb.Booster()
+    booster.load_model(path)
+    return booster
+
+def load_manifest(path=MODEL_PATH):
+    with open(manifest_path(path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def trained_through(manifest):
+    """
+    Epoch seconds up to which articles were already trained on, from a
+    manifest's data_through; None for manifests written without it (their
+    training data is unknown, so a retrain has to use the full corpus).
+    """
+    value = manifest.get("data_through")
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+def resolve_model_path(path=None):
+    # The native model file, or the legacy pickle if only that one exists
+    if path is None:
+        path = MODEL_PATH
+        if not os.path.exists(path) and os.path.exists(LEGACY_MODEL_PATH):
+            path = LEGACY_MODEL_PATH
+    return path
 
-    try:
-        dt = datetime.datetime.fromisoformat(updated_str.replace("Z", "+00:00"))
-    except:
-        dt = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
-    return dt
+def manifest_path(path):
+    # trained_model.ubj -> trained_model.meta.json
+    return os.path.splitext(path)[0] + ".meta.json"
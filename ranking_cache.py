@@ -0,0 +1,198 @@
+import hashlib
+import os
+import numpy as np
+
+from article_ranking import click_bonus, min_max_scale, rank_articles_for_users
+from compiled_scorer import file_digest
+from data_loader import DATA_FOLDER
+from instrumentation import count
+
+RANKING_CACHE_PATH = os.path.join(DATA_FOLDER, "ranking_cache.npz")
+
+# Candidates kept per key: the default top_k of 100 plus as many again for
+# the click reranking to promote from. Larger top_k requests are ranked
+# directly and replace the entry
+DEFAULT_POOL_SIZE = 200
+
+class RankingCache:
+    """
+    Top-K base rankings per (language, cohort, category-set signature).
+
+    The base ranking depends only on the user's language and category set,
+    so users sharing a key share one model evaluation. Entries are valid
+    for one cache version (corpus fingerprint + model digest); a store or
+    model change yields a new version and the cache is rebuilt.
+    """
+
+    def __init__(self, version, pool_size=DEFAULT_POOL_SIZE):
+        self.version = version
+        self.pool_size = pool_size
+        self.entries = {}   # key -> (int32 indices, float32 base scores), best first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            count("ranking_cache_misses")
+        else:
+            self.hits += 1
+            count("ranking_cache_hits")
+        return entry
+
+    def put(self, key, indices, scores):
+        self.entries[key] = (np.asarray(indices, dtype=np.int32), np.asarray(scores, dtype=np.float32))
+
+    def save(self, path=RANKING_CACHE_PATH):
+        """
+        Writes the entries as two padded (keys x longest entry) arrays plus
+        the length of each entry. The file is written next to path and
+        renamed into place, so readers never see a partial cache.
+        """
+        keys = list(self.entries)
+        lengths = np.array([len(self.entries[key][0]) for key in keys], dtype=np.int32)
+        width = int(lengths.max(initial=0))
+        indices = np.full((len(keys), width), -1, dtype=np.int32)
+        scores = np.zeros((len(keys), width), dtype=np.float32)
+        for i, key in enumerate(keys):
+            indices[i, :lengths[i]], scores[i, :lengths[i]] = self.entries[key]
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                version=self.version,
+                pool_size=self.pool_size,
+                keys=np.array(["\t".join(key) for key in keys], dtype=str),
+                lengths=lengths,
+                indices=indices,
+                scores=scores,
+            )
+        os.replace(tmp, path)
+
+def load_ranking_cache(version, path=RANKING_CACHE_PATH):
+    """
+    Loads the cache saved at path, or returns None if it is missing or
+    belongs to another corpus/model version.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if "lengths" not in data.files or str(data["version"]) != version:
+            return None
+        cache = RankingCache(version, pool_size=int(data["pool_size"]))
+        rows = zip(data["keys"].tolist(), data["lengths"].tolist(), data["indices"], data["scores"])
+        for key, length, indices, scores in rows:
+            cache.put(tuple(key.split("\t")), indices[:length], scores[:length])
+    return cache
+
+def cache_key(user_pref, cohort):
+    # (language, cohort, hash of the distinct category OIDs)
+    language = user_pref.get("language", "english").lower()
+    categories = sorted(set(user_pref.get("article_category", [])))
+    signature = hashlib.sha1("\n".join(categories).encode("utf-8")).hexdigest()[:16]
+    return (language, cohort or "general", signature)
+
+def cache_version(article_store, model_path, article_index=None):
+    """
+    Fingerprint of the article corpus (ids, update times and pinned days_old
+    reference), the model file and the candidate retrieval settings.
+    Adding or updating articles, a daily window refresh, retraining or
+    changing the index settings changes it.
+    """
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(article_store.article_ids).tobytes())
+    h.update(np.ascontiguousarray(article_store.updated_at).tobytes())
+    h.update(str(article_store.days_old_reference()).encode("utf-8"))
+    h.update(file_digest(model_path).encode("utf-8"))
+    h.update(("all" if article_index is None else article_index.signature()).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def build_ranking_cache(model, article_store, user_store, user_cohort_map, version,
+                        pool_size=DEFAULT_POOL_SIZE, chunk_size=256, article_index=None):
+    """
+    Ranks one representative user per distinct key, chunk_size keys per model call.
+    """
+    cache = RankingCache(version, pool_size=pool_size)
+    representatives = {}
+    for pref in user_store.user_preferences():
+        key = cache_key(pref, user_cohort_map.get(pref["user_id"]))
+        representatives.setdefault(key, pref)
+
+    keys = list(representatives)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        prefs_map = {str(i): representatives[key] for i, key in enumerate(chunk)}
+        indices, scores = rank_articles_for_users(
+            model,
+            [{"_id": str(i)} for i in range(len(chunk))],
+            prefs_map,
+            None,
+            article_store=article_store,
+            top_k=pool_size,
+            article_index=article_index
+        )
+        for i, key in enumerate(chunk):
+            cache.put(key, indices[i], scores[i])
+    return cache
+
+def get_ranking_cache(model, article_store, user_store, user_cohort_map, model_path,
+                      path=RANKING_CACHE_PATH, article_index=None, lazy=False):
+    """
+    Loads the saved cache for the current corpus/model, or builds and saves
+    a new one. With lazy=True a missing cache starts empty instead and is
+    filled by rank_with_cache as keys are requested (one-off runs that rank
+    a few users); the caller saves it afterwards.
+    """
+    version = cache_version(article_store, model_path, article_index)
+    cache = load_ranking_cache(version, path)
+    if cache is None and lazy:
+        cache = RankingCache(version)
+    elif cache is None:
+        cache = build_ranking_cache(model, article_store, user_store, user_cohort_map, version,
+                                    article_index=article_index)
+        cache.save(path)
+    return cache
+
+def rank_with_cache(cache, model, article_store, user_pref, cohort=None, top_k=100,
+                    category_map=None, custom_cat_clicks=None, custom_tag_clicks=None,
+                    article_index=None, **bonus_params):
+    """
+    Ranked [(article_idx, score), ...] for one user, served from the cache.
+
+    Without click data this is the exact base ranking (for top_k <= pool size).
+    With click data the click bonus and novelty boost are applied to the
+    cached candidate pool only, then re-scaled over that pool.
+    """
+    key = cache_key(user_pref, cohort)
+    entry = cache.get(key)
+    if entry is None or len(entry[0]) < min(top_k, len(article_store)):
+        indices, scores = rank_articles_for_users(
+            model, [{"_id": "user"}], {"user": user_pref}, None,
+            article_store=article_store, top_k=max(top_k, cache.pool_size),
+            article_index=article_index
+        )
+        cache.put(key, indices[0], scores[0])
+        entry = cache.entries[key]
+
+    indices, scores = entry
+    if not custom_cat_clicks and not custom_tag_clicks:
+        return list(zip(indices[:top_k].tolist(), scores[:top_k].tolist()))
+
+    final_scores = scores + click_bonus(
+        article_store,
+        user_pref.get("language", "english"),
+        category_map,
+        custom_cat_clicks or {},
+        custom_tag_clicks or {},
+        rows=indices,
+        **bonus_params
+    )
+    final_scaled_scores = min_max_scale(final_scores)
+    # Ties keep ascending article order, as in rank_articles_for_user
+    order = np.lexsort((indices, -final_scaled_scores))[:top_k]
+    return list(zip(indices[order].tolist(), final_scaled_scores[order].tolist()))
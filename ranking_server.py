@@ -0,0 +1,471 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from article_index import ArticleIndex
+from article_window import ArticleWindow
+from article_ranking import rank_articles_for_users
+from click_counters import update_click_counters
+from compiled_scorer import get_compiled_scorer
+from instrumentation import prometheus_text
+from model_training import load_model, resolve_model_path
+from ranking_cache import RankingCache, cache_key, cache_version, get_ranking_cache, rank_with_cache
+from snapshot import load_corpus, refresh_corpus
+from user_cohort import get_cohort_model
+
+DEFAULT_TOP_K = 100
+MAX_TOP_K = 1000
+
+# Largest request body accepted (bytes); a custom user's preferences fit easily
+MAX_BODY = 1 << 20
+
+# Micro-batching: wait at most MAX_BATCH_WAIT seconds to collect up to MAX_BATCH requests
+MAX_BATCH = 64
+MAX_BATCH_WAIT = 0.005
+
+# Least seconds between two foldings of the click log into the counters (each takes a file lock)
+CLICK_REFRESH_INTERVAL = 1.0
+
+# Seconds between two syncs of changed documents into the running server (None disables them)
+SYNC_INTERVAL = 300
+
+class RankingService:
+    """
+    Everything a ranking request needs, loaded once and kept resident:
+    the scorer, the article/user encodings, the category map and the cohorts.
+    With an article window, the articles are the active window, refreshed
+    (eviction and days_old) on the first request of each day. With click
+    counters, users with clicks get the click reranking, and events appended
+    to the click log are folded in before a batch, at most once every
+    CLICK_REFRESH_INTERVAL seconds. With the full corpus encodings (corpus),
+    documents changed at the source are applied by sync(), which also
+    assigns cohorts to new and changed users with the cohort model.
+    """
+
+    def __init__(self, model, article_store, user_store, category_map, user_cohort_map, ranking_cache,
+                 article_index=None, article_window=None, model_path=None, click_counters=None,
+                 corpus=None, use_local_json=True, cohort_model=None):
+        self.model = model
+        # Article rows, their index and the rankings cached over them, replaced
+        # together so a request never pairs an index with another store
+        self.articles = (article_store, article_index, ranking_cache)
+        self.article_window = article_window
+        self.model_path = model_path
+        self._window_lock = threading.Lock()
+        self.category_map = category_map
+        self.inverted_category_map = {v: k for k, v in category_map.items()}
+        self.user_cohort_map = user_cohort_map
+        self.cohort_model = cohort_model
+        self.prefs_map = user_store.prefs_map()
+        self.click_counters = click_counters
+        self._clicks_lock = threading.Lock()
+        self._clicks_refreshed = None
+        self.corpus = corpus
+        self.use_local_json = use_local_json
+
+    def rank_users(self, user_ids, top_k):
+        """
+        Base ranking for several known users: cached rankings where available,
+        one vectorized model call for the rest.
+        Returns one result dict per user id (None for unknown users).
+        """
+        self.refresh_window()
+        self.refresh_clicks()
+        store, index, cache = self.articles
+        ranked = {}
+        misses = {}
+        for uid in user_ids:
+            if uid not in self.prefs_map or uid in ranked:
+                continue
+            key = cache_key(self.prefs_map[uid], self.user_cohort_map.get(uid))
+            entry = cache.get(key)
+            if entry is not None and len(entry[0]) >= min(top_k, len(store)):
+                ranked[uid] = list(zip(entry[0][:top_k].tolist(), entry[1][:top_k].tolist()))
+            else:
+                misses[uid] = key
+
+        # Cache misses are ranked together with one model call and cached for the next requests
+        if misses:
+            indices, scores = rank_articles_for_users(
+                self.model,
+                [{"_id": uid} for uid in misses],
+                self.prefs_map,
+                None,
+                article_store=store,
+                top_k=max(top_k, cache.pool_size),
+                article_index=index
+            )
+            for i, (uid, key) in enumerate(misses.items()):
+                cache.put(key, indices[i], scores[i])
+                entry = cache.entries[key]
+                ranked[uid] = list(zip(entry[0][:top_k].tolist(), entry[1][:top_k].tolist()))
+
+        results = []
+        for uid in user_ids:
+            if uid not in ranked:
+                results.append(None)
+                continue
+            pref = self.prefs_map[uid]
+            cat_clicks, tag_clicks = self._clicks(uid)
+            if cat_clicks or tag_clicks:
+                # Click reranking of the cached candidate pool
+                ranked[uid] = rank_with_cache(
+                    cache, self.model, store, pref,
+                    cohort=self.user_cohort_map.get(uid), top_k=top_k, category_map=self.category_map,
+                    custom_cat_clicks=cat_clicks, custom_tag_clicks=tag_clicks,
+                    article_index=index
+                )
+            results.append({
+                "user_id": uid,
+                "language": pref.get("language", "english"),
+                "cohort": self.user_cohort_map.get(uid, "general"),
+                "articles": self._articles(store, ranked[uid]),
+            })
+        return results
+
+    def rank_custom(self, custom_data, top_k):
+        """
+        Ranking for a custom user described like user_data.json:
+        {"language": ..., "favorite_categories": [[name, clicks], ...], "favorite_tags": [[name, clicks], ...]}
+        The click adjustments are applied to the cached candidate pool.
+        """
+        self.refresh_window()
+        store, index, cache = self.articles
+        language_pref = custom_data.get("language", "english")
+        custom_cat_clicks = {name: count for name, count in custom_data.get("favorite_categories", [])}
+        custom_tag_clicks = {name: count for name, count in custom_data.get("favorite_tags", [])}
+        category_oids = [
+            self.inverted_category_map[name] for name in custom_cat_clicks
+            if name in self.inverted_category_map
+        ]
+
+        custom_pref = {"language": language_pref, "article_category": category_oids}
+        ranked = rank_with_cache(
+            cache,
+            self.model,
+            store,
+            custom_pref,
+            cohort="custom",
+            top_k=top_k,
+            category_map=self.category_map,
+            custom_cat_clicks=custom_cat_clicks,
+            custom_tag_clicks=custom_tag_clicks,
+            article_index=index
+        )
+        return {
+            "user_id": "custom_user",
+            "language": language_pref,
+            "articles": self._articles(store, ranked),
+        }
+
+    def refresh_window(self):
+        # Daily window refresh; rankings cached for the previous day are dropped
+        if self.article_window is None:
+            return
+        with self._window_lock:
+            window = self.article_window
+            if not window.refresh():
+                return
+            self._set_articles(window.article_store, window.article_index)
+
+    def sync(self):
+        """
+        Applies the documents changed at the source since the last sync (see
+        snapshot.refresh_corpus): changed articles join the window through
+        ArticleWindow.add, or replace their rows of the full store; new users
+        and changed preferences are ranked with their current preferences and
+        get their cohort from CohortModel.update (saved when it changed).
+        """
+        if self.corpus is None:
+            return
+        with self._window_lock:
+            article_store, user_store, category_map, changes = refresh_corpus(
+                *self.corpus, use_local_json=self.use_local_json
+            )
+            self.corpus = (article_store, user_store, category_map)
+            if changes["users"] or changes["user_preferences"]:
+                self.prefs_map = user_store.prefs_map()
+                if self.cohort_model is not None:
+                    n_before = len(self.cohort_model.user_ids)
+                    if self.cohort_model.update(user_store) or len(self.cohort_model.user_ids) != n_before:
+                        self.cohort_model.save()
+                    self.user_cohort_map = self.cohort_model.cohort_map()
+            if changes["article_categories"]:
+                self.category_map = category_map
+                self.inverted_category_map = {v: k for k, v in category_map.items()}
+
+            if self.article_window is not None:
+                if self.article_window.add(changes["articles"]):
+                    self._set_articles(self.article_window.article_store, self.article_window.article_index)
+            elif changes["articles"]:
+                self._set_articles(article_store, ArticleIndex(article_store))
+
+    def _set_articles(self, article_store, article_index):
+        # New article rows: rankings cached for the previous ones are dropped
+        ranking_cache = RankingCache(
+            cache_version(article_store, self.model_path, article_index),
+            pool_size=self.articles[2].pool_size
+        )
+        self.articles = (article_store, article_index, ranking_cache)
+
+    def refresh_clicks(self):
+        # Folding click events logged since the last refresh into the counters. Events
+        # are resolved against the full corpus, not the window: clicks on older articles count
+        if self.click_counters is None:
+            return
+        with self._clicks_lock:
+            now = time.monotonic()
+            if self._clicks_refreshed is not None and now - self._clicks_refreshed < CLICK_REFRESH_INTERVAL:
+                return
+            self._clicks_refreshed = now
+            article_store = self.articles[0] if self.corpus is None else self.corpus[0]
+            self.click_counters = update_click_counters(article_store, self.category_map,
+                                                        counters=self.click_counters)
+
+    def _clicks(self, uid):
+        if self.click_counters is None:
+            return {}, {}
+        with self._clicks_lock:
+            return self.click_counters.clicks(uid)
+
+    def _articles(self, store, ranked):
+        return [
+            {
+                "article_id": str(store.article_ids[idx]),
+                "title": store.title(idx),
+                "category": self.category_map.get(store.primary_category(idx), "unknown"),
+                "score": int(score),
+            }
+            for idx, score in ranked
+        ]
+
+class MicroBatcher:
+    """
+    Collects concurrent rank(user_id, top_k) requests and serves each batch
+    with a single RankingService.rank_users call on a worker thread.
+    """
+
+    def __init__(self, service, max_batch=MAX_BATCH, max_wait=MAX_BATCH_WAIT):
+        self.service = service
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def rank(self, user_id, top_k):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((user_id, top_k, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            user_ids = [uid for uid, _, _ in batch]
+            top_k = max(k for _, k, _ in batch)
+            try:
+                results = await loop.run_in_executor(None, self.service.rank_users, user_ids, top_k)
+            except Exception as exc:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            for (_, k, future), result in zip(batch, results):
+                if result is not None:
+                    result = {**result, "articles": result["articles"][:k]}
+                if not future.done():
+                    future.set_result(result)
+
+class RankingServer:
+    """
+    Minimal HTTP/1.1 front end (stdlib asyncio, keep-alive supported).
+
+      GET  /health
+      GET  /metrics       stage timings and counters, Prometheus text format
+      GET  /rank?user_id=<id>&top_k=<n>
+      POST /rank/custom   body: user_data.json-style object, optional "top_k"
+
+    Every sync_interval seconds the service syncs changed documents on a worker thread.
+    """
+
+    def __init__(self, service, host="127.0.0.1", port=8080, sync_interval=SYNC_INTERVAL):
+        self.service = service
+        self.batcher = MicroBatcher(service)
+        self.host = host
+        self.port = port
+        self.sync_interval = sync_interval
+
+    async def serve_forever(self):
+        batch_task = asyncio.create_task(self.batcher.run())
+        sync_task = asyncio.create_task(self._sync_periodically()) if self.sync_interval else None
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"Ranking server listening on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            if sync_task is not None:
+                sync_task.cancel()
+
+    async def _sync_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await loop.run_in_executor(None, self.service.sync)
+            except Exception as exc:
+                # A failed sync (e.g. the database is unreachable) is retried at the next interval
+                print(f"Sync failed: {exc}")
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request line"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                    if length < 0:
+                        raise ValueError
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad content-length"}, keep_alive=False)
+                    break
+                if length > MAX_BODY:
+                    # The body is not read, so the connection cannot be reused
+                    await self._respond(writer, 413, {"error": f"body larger than {MAX_BODY} bytes"},
+                                        keep_alive=False)
+                    break
+                body = b""
+                if length:
+                    body = await reader.readexactly(length)
+
+                keep_alive = (
+                    version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                )
+                status, payload = await self._dispatch(method, target, body)
+                await self._respond(writer, status, payload, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        try:
+            if method == "GET" and url.path == "/health":
+                return 200, {"status": "ok"}
+
+            if method == "GET" and url.path == "/metrics":
+                return 200, prometheus_text()
+
+            if method == "GET" and url.path == "/rank":
+                user_id = query.get("user_id", [""])[0]
+                top_k = _top_k(query.get("top_k", [DEFAULT_TOP_K])[0])
+                result = await self.batcher.rank(user_id, top_k)
+                if result is None:
+                    return 404, {"error": f"unknown user_id: {user_id}"}
+                return 200, result
+
+            if method == "POST" and url.path == "/rank/custom":
+                custom_data = json.loads(body or b"{}")
+                if not isinstance(custom_data, dict):
+                    raise ValueError("the body must be a JSON object")
+                top_k = _top_k(custom_data.get("top_k", DEFAULT_TOP_K))
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, self.service.rank_custom, custom_data, top_k)
+                return 200, result
+        except (ValueError, TypeError) as exc:
+            return 400, {"error": str(exc)}
+        except Exception as exc:
+            # The connection stays usable; the failure is reported instead of dropping it
+            print(f"Error handling {method} {url.path}: {exc!r}")
+            return 500, {"error": "internal error"}
+
+        return 404, {"error": f"no route for {method} {url.path}"}
+
+    async def _respond(self, writer, status, payload, keep_alive=True):
+        # Text payloads (/metrics) are sent as is, everything else as JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        reason = {
+            200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"
+        }.get(status, "")
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+def _top_k(value):
+    top_k = int(value)
+    if top_k <= 0:
+        raise ValueError("top_k must be positive")
+    return min(top_k, MAX_TOP_K)
+
+def load_service(use_local_json=True, refit_cohorts=False, horizon_days=None):
+    # Loading the model, the corpus and the cohorts once for the server's lifetime
+    model_path = resolve_model_path()
+    model = get_compiled_scorer(load_model(), model_path=model_path)
+    article_store, user_store, category_map = load_corpus(use_local_json=use_local_json)
+    corpus_store = article_store
+    cohort_model = get_cohort_model(user_store, category_map, n_clusters=15, refit=refit_cohorts)
+    user_cohort_map = cohort_model.cohort_map()
+
+    # Only articles inside the freshness horizon are kept and ranked, if one is set
+    article_window = None
+    if horizon_days is not None:
+        article_window = ArticleWindow(article_store, horizon_days=horizon_days)
+        article_store = article_window.article_store
+        article_index = article_window.article_index
+    else:
+        article_index = ArticleIndex(article_store)
+
+    ranking_cache = get_ranking_cache(model, article_store, user_store, user_cohort_map, model_path,
+                                      article_index=article_index)
+    click_counters = update_click_counters(corpus_store, category_map)
+    return RankingService(model, article_store, user_store, category_map, user_cohort_map, ranking_cache,
+                          article_index=article_index, article_window=article_window,
+                          model_path=model_path, click_counters=click_counters,
+                          corpus=(corpus_store, user_store, category_map), use_local_json=use_local_json,
+                          cohort_model=cohort_model)
+
+def serve(use_local_json=True, host="127.0.0.1", port=8080, refit_cohorts=False, horizon_days=None,
+          sync_interval=SYNC_INTERVAL):
+    service = load_service(use_local_json=use_local_json, refit_cohorts=refit_cohorts,
+                           horizon_days=horizon_days)
+    asyncio.run(RankingServer(service, host=host, port=port, sync_interval=sync_interval).serve_forever())
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+from data_loader import (
+    COLLECTIONS,
+    DATA_FOLDER,
+    RANKING_PROJECTIONS,
+    SYNC_FOLDER,
+    SYNC_STATE_FILE,
+    load_data,
+    local_collection_file,
+    load_synced_collection,
+    sync_collections
+)
+from article_store import ArticleStore, build_article_store, update_article_store
+from user_store import UserStore, build_user_store, update_user_store
+from utils import build_category_map
+from instrumentation import timed
+
+SNAPSHOT_FOLDER = os.path.join(DATA_FOLDER, "snapshots")
+
+# Key of the last local snapshot, so the one it replaces can be removed
+LOCAL_KEY_FILE = "local.key"
+
+def corpus_key(data_folder=DATA_FOLDER, names=COLLECTIONS):
+    """
+    Content hash of the input collections (whichever of <name>.json,
+    .ndjson or .jsonl is read for each). Hashing the raw bytes is much
+    cheaper than parsing them, so a hit skips JSON parsing entirely.
+    """
+    h = hashlib.sha256()
+    for name in names:
+        filename = local_collection_file(name, data_folder)
+        h.update(filename.encode("utf-8"))
+        file_path = os.path.join(data_folder, filename)
+        if not os.path.exists(file_path):
+            h.update(b"<missing>")
+            continue
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+def sync_key(sync_folder):
+    """
+    Key of the synced copy's current state (the per-collection sync marks),
+    so a snapshot of it is only found again while nothing was synced since.
+    """
+    state = {}
+    path = os.path.join(sync_folder, SYNC_STATE_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    marks = {name: [col.get("watermark"), col.get("synced_mtime")] for name, col in state.items()}
+    h = hashlib.sha256(json.dumps(marks, sort_keys=True).encode("utf-8"))
+    return "sync-" + h.hexdigest()[:16]
+
+def write_snapshot(key, article_store, user_store, category_map, folder=SNAPSHOT_FOLDER):
+    """
+    Writes every column as its own .npy file under folder/<key>/ so it can be memory-mapped.
+    The directory is renamed into place only once complete.
+    """
+    target = os.path.join(folder, key)
+    tmp = target + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    arrays = {}
+    arrays.update({f"article_{name}": arr for name, arr in article_store.to_arrays().items()})
+    arrays.update({f"user_{name}": arr for name, arr in user_store.to_arrays().items()})
+    arrays["category_map_ids"] = np.array(list(category_map.keys()), dtype=str)
+    arrays["category_map_names"] = np.array(list(category_map.values()), dtype=str)
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(arr))
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+
+def load_snapshot(key, folder=SNAPSHOT_FOLDER):
+    """
+    Memory-maps the snapshot for key.
+    Returns (article_store, user_store, category_map), or None if there is no snapshot for key.
+    Pages are shared through the OS page cache between processes reading the same snapshot.
+    """
+    target = os.path.join(folder, key)
+    if not os.path.isdir(target):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(target, f"{name}.npy"), mmap_mode="r")
+
+    article_store = ArticleStore.from_arrays(
+        {name: load(f"article_{name}") for name in ArticleStore.ARRAY_FIELDS}
+    )
+    user_store = UserStore.from_arrays(
+        {name: load(f"user_{name}") for name in UserStore.ARRAY_FIELDS}
+    )
+    category_map = dict(zip(
+        load("category_map_ids").tolist(),
+        load("category_map_names").tolist()
+    ))
+    return article_store, user_store, category_map
+
+@timed("load_corpus")
+def load_corpus(use_local_json=True, db=None, data_folder=DATA_FOLDER, snapshot_folder=SNAPSHOT_FOLDER,
+                sync_folder=None):
+    """
+    Returns (article_store, user_store, category_map) for ranking.
+
+    With local JSON files the result is cached as a snapshot keyed by
+    corpus_key(), so unchanged inputs are memory-mapped instead of parsed.
+    With MongoDB the snapshot is keyed by the sync state (sync_key): the
+    snapshot of the last sync is memory-mapped and only the documents
+    changed since are downloaded and applied to it (see refresh_corpus).
+    Without one, the synced copy is brought up to date and encoded in full.
+    """
+    if use_local_json:
+        key = corpus_key(data_folder)
+        snapshot = load_snapshot(key, snapshot_folder)
+        if snapshot is not None:
+            return snapshot
+        data_dict = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=data_folder)
+    else:
+        sync_folder = sync_folder or _sync_folder(use_local_json)
+        snapshot = load_snapshot(sync_key(sync_folder), snapshot_folder)
+        if snapshot is not None:
+            return refresh_corpus(*snapshot, use_local_json=False, db=db, data_folder=data_folder,
+                                  snapshot_folder=snapshot_folder, sync_folder=sync_folder)[:3]
+        sync_collections(use_local_json=False, db=db, projections=RANKING_PROJECTIONS,
+                         sync_folder=sync_folder)
+        data_dict = {name: load_synced_collection(name, sync_folder) for name in COLLECTIONS}
+        key = sync_key(sync_folder)
+
+    article_store = build_article_store(data_dict["articles"])
+    user_store = build_user_store(data_dict["users"], data_dict["user_preferences"])
+    category_map = build_category_map(data_dict["article_categories"])
+    write_snapshot(key, article_store, user_store, category_map, snapshot_folder)
+    if use_local_json:
+        _replace_local_key(key, snapshot_folder)
+    return article_store, user_store, category_map
+
+@timed("refresh_corpus")
+def refresh_corpus(article_store, user_store, category_map, use_local_json=True, db=None,
+                   data_folder=DATA_FOLDER, snapshot_folder=SNAPSHOT_FOLDER, sync_folder=None):
+    """
+    Fetches documents changed since the last sync and applies them to the
+    encodings, touching only the affected rows. With MongoDB the updated
+    encodings replace the snapshot of the previous sync state.
+    Returns the updated (article_store, user_store, category_map) and the
+    changed documents of each collection.
+    """
+    sync_folder = sync_folder or _sync_folder(use_local_json)
+    previous_key = sync_key(sync_folder)
+    changes = sync_collections(use_local_json=use_local_json, db=db, projections=RANKING_PROJECTIONS,
+                               sync_folder=sync_folder, data_folder=data_folder)
+    if not any(changes.values()):
+        return article_store, user_store, category_map, changes
+
+    article_store = update_article_store(article_store, changes["articles"])
+
+    # Preferences of users outside the store need their user document to be admitted
+    users = changes["users"]
+    unknown = (
+        {str(up["user_id"]) for up in changes["user_preferences"]}
+        - set(user_store.id_index())
+        - {str(user["_id"]) for user in users}
+    )
+    if unknown:
+        users = users + [
+            user for user in load_synced_collection("users", sync_folder)
+            if str(user["_id"]) in unknown
+        ]
+    user_store = update_user_store(user_store, changes["user_preferences"], users=users)
+
+    category_map = {**category_map, **build_category_map(changes["article_categories"])}
+
+    # Documents at the watermark are fetched again by every sync, so only an
+    # advanced sync state needs a new snapshot. Readers that already mapped
+    # the previous one keep their (unlinked) pages
+    key = sync_key(sync_folder)
+    if not use_local_json and key != previous_key:
+        write_snapshot(key, article_store, user_store, category_map, snapshot_folder)
+        shutil.rmtree(os.path.join(snapshot_folder, previous_key), ignore_errors=True)
+    return article_store, user_store, category_map, changes
+
+def _sync_folder(use_local_json):
+    # Local files and MongoDB keep separate synced copies
+    return os.path.join(SYNC_FOLDER, "local" if use_local_json else "mongo")
+
+def _replace_local_key(key, snapshot_folder):
+    # Removing the local snapshot of the previous input version; readers that
+    # already mapped it keep their (unlinked) pages
+    path = os.path.join(snapshot_folder, LOCAL_KEY_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            previous_key = f.read().strip()
+        if previous_key and previous_key != key:
+            shutil.rmtree(os.path.join(snapshot_folder, previous_key), ignore_errors=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(key)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,210 @@
+import argparse
+import datetime
+import json
+import os
+import numpy as np
+
+# Word pool for category and tag names (cohort labels are built from these words)
+NAME_WORDS = (
+    "politics", "business", "technology", "sports", "health", "education", "crime",
+    "world", "entertainment", "science", "economy", "environment", "travel", "food",
+    "fashion", "culture", "elections", "markets", "startups", "cricket", "football",
+    "movies", "music", "space", "energy", "climate", "law", "defence", "religion",
+    "automotive", "gaming", "finance", "real estate", "agriculture", "wildlife",
+    "aviation", "tourism", "television", "banking", "insurance",
+)
+
+LANGUAGES = ("english", "hindi")
+LANGUAGE_WEIGHTS = (0.8, 0.2)
+
+# Share of users without a preferences document (dropped by the ranking filters)
+USERS_WITHOUT_PREFS = 0.02
+
+# Collection id prefixes, so ids are unique across collections
+_ID_PREFIX = {"users": 1, "user_preferences": 2, "articles": 3, "article_categories": 4, "tags": 5}
+
+def object_id(collection, i):
+    # Deterministic 24-hex-digit id
+    return f"{_ID_PREFIX[collection]:08x}{i:016x}"
+
+def generate_corpus(folder, n_users=1000, n_articles=10_000, n_categories=60, n_tags=200,
+                    days=365, seed=0, now=None):
+    """
+    Writes a synthetic corpus with the schema of the MongoDB exports in data/:
+    users.json, user_preferences.json, articles.json, article_categories.json,
+    tags.json and tag.json.
+
+    Category popularity follows a power law, so users and articles cluster on a
+    few popular categories; articles are spread over the last `days` days.
+    Documents are written one at a time, so large corpora are never held in memory.
+    """
+    rng = np.random.default_rng(seed)
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    os.makedirs(folder, exist_ok=True)
+
+    cat_ids = [object_id("article_categories", i) for i in range(n_categories)]
+    cat_names = _names(n_categories, rng)
+    tag_names = _names(n_tags, rng)
+    cat_weights = _power_weights(n_categories)
+    tag_weights = _power_weights(n_tags)
+
+    _write_json_array(os.path.join(folder, "article_categories.json"), (
+        {
+            "_id": cat_ids[i],
+            "name": cat_names[i],
+            "slug": cat_names[i].lower().replace(" ", "-"),
+            "createdAt": _iso(now - datetime.timedelta(days=days)),
+            "updatedAt": _iso(now - datetime.timedelta(days=days)),
+            "__v": 0,
+            "status": "active",
+        }
+        for i in range(n_categories)
+    ))
+    tags = [
+        {"_id": object_id("tags", i), "slug": name.replace(" ", "-"), "name": name}
+        for i, name in enumerate(tag_names)
+    ]
+    _write_json_array(os.path.join(folder, "tags.json"), tags)
+    _write_json_array(os.path.join(folder, "tag.json"), tags[:min(len(tags), 20)])
+
+    # Users and their preferences
+    user_created = now - datetime.timedelta(days=days)
+    _write_json_array(os.path.join(folder, "users.json"), (
+        {
+            "_id": object_id("users", i),
+            "user_id": f"synthetic-user-{i}",
+            "device_token": [],
+            "status": "active",
+            "createdAt": _iso(user_created),
+            "updatedAt": _iso(user_created),
+            "__v": 0,
+        }
+        for i in range(n_users)
+    ))
+
+    has_prefs = rng.random(n_users) >= USERS_WITHOUT_PREFS
+    user_langs = rng.choice(len(LANGUAGES), size=n_users, p=LANGUAGE_WEIGHTS)
+    user_cats = _draw_sets(rng, n_users, n_categories, 1, 8, cat_weights)
+
+    def preferences():
+        for i in np.flatnonzero(has_prefs).tolist():
+            cats = user_cats[i]
+            yield {
+                "_id": object_id("user_preferences", i),
+                "user_id": object_id("users", i),
+                "language": LANGUAGES[user_langs[i]],
+                "article_category": [cat_ids[c] for c in cats],
+                "article_tag": [],
+                "source": [],
+                "notification": True,
+                "createdAt": _iso(user_created),
+                "updatedAt": _iso(user_created),
+                "__v": 0,
+            }
+
+    _write_json_array(os.path.join(folder, "user_preferences.json"), preferences())
+
+    # Articles
+    article_langs = rng.choice(len(LANGUAGES), size=n_articles, p=LANGUAGE_WEIGHTS)
+    ages = rng.random(n_articles) * days * 86400.0
+    article_cats = _draw_sets(rng, n_articles, n_categories, 1, 3, cat_weights)
+    article_tags = _draw_sets(rng, n_articles, n_tags, 0, 3, tag_weights)
+
+    def articles():
+        for i in range(n_articles):
+            cats = article_cats[i]
+            updated = now - datetime.timedelta(seconds=float(ages[i]))
+            words = [cat_names[c].lower() for c in cats]
+            yield {
+                "_id": {"$oid": object_id("articles", i)},
+                "title": f"Article {i} on {' and '.join(words)}",
+                "body": f"Synthetic coverage of {', '.join(words)}. " * 3,
+                "language": LANGUAGES[article_langs[i]],
+                "category": [{"$oid": cat_ids[c]} for c in cats],
+                "tags": [tag_names[t] for t in article_tags[i]],
+                "createdAt": {"$date": _iso(updated)},
+                "updatedAt": {"$date": _iso(updated)},
+            }
+
+    _write_json_array(os.path.join(folder, "articles.json"), articles())
+
+def _draw_sets(rng, n_rows, n_items, low, high, weights):
+    """
+    For every row, between low and high distinct items drawn by popularity.
+    All draws are made at once; repeated draws within a row are dropped,
+    so popular items shorten the sets slightly.
+    """
+    high = min(high, n_items)
+    if n_items == 0 or high == 0:
+        return [[] for _ in range(n_rows)]
+    draws = rng.choice(n_items, size=(n_rows, high), p=weights).tolist()
+    sizes = rng.integers(low, high + 1, size=n_rows).tolist()
+    return [list(dict.fromkeys(row[:size])) for row, size in zip(draws, sizes)]
+
+def _names(n, rng):
+    """
+    n distinct names: single words first, then two-word combinations, then
+    numbered copies ("Politics 2", ...) once every combination is used.
+    """
+    words = [word.title() for word in NAME_WORDS]
+    names = list(words)
+    n_pairs = len(words) * (len(words) - 1)
+    if 2 * (n - len(names)) <= n_pairs:
+        # Few pairs needed: random draws rarely repeat
+        seen = set(names)
+        while len(names) < n:
+            first, second = rng.choice(len(words), size=2, replace=False)
+            name = f"{words[first]} {words[second]}"
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+        return names[:n]
+
+    # Otherwise the pairs are drawn without replacement from a permutation of all of them
+    for i in rng.permutation(n_pairs)[:n - len(names)].tolist():
+        first, second = divmod(i, len(words) - 1)
+        names.append(f"{words[first]} {words[second + (second >= first)]}")
+    base = list(names)
+    copy = 2
+    while len(names) < n:
+        names.extend(f"{name} {copy}" for name in base[:n - len(names)])
+        copy += 1
+    return names[:n]
+
+def _power_weights(n, exponent=1.1):
+    # Zipf-like popularity over n items
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def _iso(dt):
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def _write_json_array(path, docs):
+    # Streams documents into a JSON array file
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, doc in enumerate(docs):
+            f.write(",\n" if i else "\n")
+            f.write(json.dumps(doc))
+        f.write("\n]\n")
+    os.replace(tmp, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic corpus generator")
+    parser.add_argument("--out", type=str, required=True, help="Folder the JSON collections are written to")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--articles", type=int, default=10_000)
+    parser.add_argument("--categories", type=int, default=60)
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365, help="Articles are spread over this many past days")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_corpus(args.out, n_users=args.users, n_articles=args.articles,
+                    n_categories=args.categories, n_tags=args.tags, days=args.days, seed=args.seed)
+    print(f"Synthetic corpus written to {args.out}")
+
+if __name__ == "__main__":
+    main()
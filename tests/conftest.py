@@ -0,0 +1,51 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from synthetic_corpus import generate_corpus  # noqa: E402
+
+# Fixed reference time of the synthetic corpora
+NOW = datetime.datetime(2026, 1, 15, tzinfo=datetime.timezone.utc)
+
+class LinearModel:
+    # Stand-in for the booster: a fixed linear function of the 4 features
+    weights = np.array([0.5, 2.0, 1.5, -0.01])
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        return np.asarray(X, dtype=float) @ self.weights
+
+@pytest.fixture(scope="session")
+def corpus_folder(tmp_path_factory):
+    # Small synthetic corpus in the schema of the MongoDB exports
+    folder = str(tmp_path_factory.mktemp("corpus"))
+    generate_corpus(folder, n_users=80, n_articles=400, n_categories=24, n_tags=30, days=60, seed=3,
+                    now=NOW)
+    return folder
+
+@pytest.fixture
+def mongo_db(corpus_folder):
+    # mongomock database holding the synthetic corpus (extended JSON decoded to ObjectId/datetime)
+    mongomock = pytest.importorskip("mongomock")
+    from bson import json_util
+
+    db = mongomock.MongoClient().db
+    for name in ("users", "user_preferences", "articles", "article_categories", "tags", "tag"):
+        with open(os.path.join(corpus_folder, f"{name}.json"), "r", encoding="utf-8") as f:
+            db[name].insert_many(json_util.loads(f.read()))
+    return db
+
+@pytest.fixture
+def in_repo_root(monkeypatch):
+    # The trained model files are resolved relative to the working directory
+    monkeypatch.chdir(REPO_ROOT)
+    return REPO_ROOT
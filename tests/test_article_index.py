@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from article_index import ArticleIndex
+from article_store import build_article_store
+from data_loader import RANKING_PROJECTIONS, load_data
+
+@pytest.fixture(scope="module")
+def article_store(corpus_folder):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    return build_article_store(data["articles"])
+
+def _newest(store, rows, n):
+    # Reference: the n most recently updated of rows (ties by row)
+    rows = np.asarray(rows, dtype=np.int64)
+    return rows[np.lexsort((rows, -np.asarray(store.updated_at)[rows]))][:n]
+
+def _reference_candidates(store, language, category_oids, max_postings, backfill):
+    lang_id = store.lang_index[language]
+    in_language = np.flatnonzero(np.asarray(store.lang_ids) == lang_id)
+    parts = [_newest(store, in_language, backfill)]
+    for oid in category_oids:
+        cat_id = store.cat_index[oid]
+        rows = [row for row in in_language
+                if cat_id in store.cat_indices[store.cat_indptr[row]:store.cat_indptr[row + 1]]]
+        parts.append(_newest(store, rows, max_postings))
+    return np.unique(np.concatenate(parts))
+
+@pytest.mark.parametrize("max_postings, backfill", [(3, 5), (20, 0), (1000, 200)])
+def test_candidates_are_the_newest_postings(article_store, max_postings, backfill):
+    index = ArticleIndex(article_store, max_postings=max_postings, backfill=backfill)
+    category_oids = article_store.cat_vocab[:4]
+    for language in article_store.lang_vocab:
+        expected = _reference_candidates(article_store, language, category_oids, max_postings, backfill)
+        assert np.array_equal(index.candidates(language, category_oids), expected)
+
+def test_short_candidate_lists_are_filled_with_the_newest_articles(article_store):
+    index = ArticleIndex(article_store, max_postings=2, backfill=0)
+    rows = index.candidates("english", article_store.cat_vocab[:1], min_candidates=50)
+    assert len(rows) >= 50
+    assert set(_newest(article_store, np.arange(len(article_store)), 50).tolist()) <= set(rows.tolist())
+    assert len(index.candidates("klingon", min_candidates=10)) == 10
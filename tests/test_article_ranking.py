@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from article_ranking import top_k_indices
+
+def _stable_top_k(scores, top_k):
+    # Reference: stable sort on descending score, ties in ascending index order
+    return np.argsort(-np.asarray(scores, dtype=np.int64), axis=-1, kind="stable")[..., :top_k]
+
+@pytest.mark.parametrize("top_k", [1, 3, 10, 50, None])
+def test_ties_keep_ascending_article_order(top_k):
+    rng = np.random.default_rng(0)
+    # Few distinct scores, so most of the ranking is decided by ties
+    scores = rng.integers(0, 4, size=(6, 40))
+    expected = _stable_top_k(scores, 40 if top_k is None else top_k)
+    assert np.array_equal(top_k_indices(scores, top_k), expected)
+    assert np.array_equal(top_k_indices(scores[0], top_k), expected[0])
+
+def test_all_equal_scores_rank_by_index():
+    assert top_k_indices(np.full(8, 5), 4).tolist() == [0, 1, 2, 3]
+
+def test_top_k_edge_cases():
+    scores = np.array([3, 9, 9, 1])
+    assert top_k_indices(scores, 0).shape == (0,)
+    assert top_k_indices(scores, 10).tolist() == [1, 2, 0, 3]
+    assert top_k_indices(np.zeros((2, 0), dtype=int), 3).shape == (2, 0)
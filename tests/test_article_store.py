@@ -0,0 +1,43 @@
+import random
+
+import numpy as np
+import pytest
+
+import article_store
+from article_store import build_article_store, category_overlaps
+
+def _corpus(n_categories, seed):
+    rng = random.Random(seed)
+    cats = [f"{i:024x}" for i in range(n_categories)]
+    articles = [
+        {
+            "_id": f"{n_categories:08x}{i:016x}",
+            "title": f"Article {i}",
+            "language": "english",
+            # Duplicates within an article count once
+            "category": rng.choices(cats, k=rng.randint(0, 4)),
+            "tags": [],
+            "updatedAt": "2025-01-01T00:00:00Z",
+        }
+        for i in range(300)
+    ]
+    sets = [rng.choices(cats, k=rng.randint(0, 8)) + ["unknown"] * rng.randint(0, 1) for _ in range(40)]
+    return articles, sets
+
+@pytest.mark.parametrize("n_categories", [5, 64, 130])
+@pytest.mark.parametrize("rows", [None, np.arange(0, 300, 7)])
+def test_bitmask_and_sparse_overlaps_agree(monkeypatch, n_categories, rows):
+    articles, sets = _corpus(n_categories, seed=n_categories)
+    store = build_article_store(articles)
+    encoded = store.encode_categories(sets)
+
+    selected = articles if rows is None else [articles[i] for i in rows]
+    expected = np.array([[len(set(s) & set(a["category"])) for a in selected] for s in sets])
+
+    monkeypatch.setattr(article_store, "MAX_BITMASK_WORDS", 4)
+    bitmask = category_overlaps(store, *encoded, rows=rows)
+    monkeypatch.setattr(article_store, "MAX_BITMASK_WORDS", 0)
+    sparse = category_overlaps(store, *encoded, rows=rows)
+
+    assert np.array_equal(bitmask, expected)
+    assert np.array_equal(sparse, expected)
@@ -0,0 +1,56 @@
+import datetime
+
+from article_store import SECONDS_PER_DAY, build_article_store, update_article_store
+from article_window import ArticleWindow
+
+NOW = datetime.datetime(2026, 1, 15, 12, tzinfo=datetime.timezone.utc).timestamp()
+
+def _article(i, days_ago, title=None):
+    updated = datetime.datetime.fromtimestamp(NOW - days_ago * SECONDS_PER_DAY, datetime.timezone.utc)
+    return {
+        "_id": f"{i:024x}",
+        "title": title or f"Article {i}",
+        "language": "english",
+        "category": ["c1"],
+        "tags": [],
+        "updatedAt": updated.isoformat(),
+    }
+
+def test_add_places_new_and_changed_articles():
+    store = build_article_store([_article(i, days_ago=i) for i in range(10)])
+    window = ArticleWindow(store, horizon_days=30, now=NOW)
+    assert len(window) == 10
+
+    # The full store the window was built from is updated first, as the server's sync does
+    corpus = update_article_store(store, [_article(20, days_ago=0)])
+    assert len(corpus) == 11 and len(store) == 10
+
+    assert window.add([_article(20, days_ago=0), _article(2, days_ago=0, title="Changed"),
+                       _article(30, days_ago=40)])
+    index = window.article_store.id_index()
+    assert len(window) == len(index) == 11
+    assert f"{30:024x}" not in index
+    assert window.article_store.title(index[f"{2:024x}"]) == "Changed"
+    assert len(window.row_buckets) == len(window)
+    assert not window.add([_article(31, days_ago=40)])
+
+def test_eviction_keeps_the_horizon():
+    store = build_article_store([_article(i, days_ago=i) for i in range(10)])
+    window = ArticleWindow(store, horizon_days=5, now=NOW)
+    # Buckets end at midnight: the articles of the last 6 days plus the partial current day
+    assert len(window) == 7
+    assert window.refresh(now=NOW + 2 * SECONDS_PER_DAY)
+    assert len(window) == 5
+    assert not window.refresh(now=NOW + 2 * SECONDS_PER_DAY + 60)
+
+def test_stores_are_not_pinned_in_place():
+    store = build_article_store([_article(i, days_ago=i) for i in range(10)])
+    window = ArticleWindow(store, horizon_days=30, now=NOW)
+    assert window.article_store is not store
+    assert store.days_old_reference() is None
+    assert window.article_store.days_old_reference() == window.as_of
+
+    previous = window.article_store
+    assert window.refresh(now=NOW + SECONDS_PER_DAY)
+    assert window.article_store is not previous
+    assert previous.days_old_reference() == window.as_of - SECONDS_PER_DAY
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+import batch_ranking
+from batch_ranking import feed_for_user, load_feeds, run_batch
+from snapshot import load_corpus
+from user_store import build_user_store
+
+CHUNK_SIZE = 16
+
+class _Interrupted(Exception):
+    pass
+
+@pytest.fixture
+def batch_corpus(in_repo_root, corpus_folder, tmp_path, monkeypatch):
+    # run_batch ranks the synthetic corpus with the committed model
+    snapshot_folder = str(tmp_path / "snapshots")
+
+    def corpus(use_local_json=True):
+        return load_corpus(data_folder=corpus_folder, snapshot_folder=snapshot_folder)
+
+    monkeypatch.setattr(batch_ranking, "load_corpus", corpus)
+    return corpus
+
+def _run(folder, output, **kwargs):
+    return run_batch(output=output, top_k=10, chunk_size=CHUNK_SIZE, workers=1, folder=folder, **kwargs)
+
+def _interrupt_after(monkeypatch, chunks):
+    # Fails right after the checkpoint of the given number of chunks was saved
+    count = batch_ranking.count
+    written = []
+
+    def counting(name, value=1):
+        count(name, value)
+        if name == "batch_users_ranked":
+            written.append(value)
+            if len(written) == chunks:
+                raise _Interrupted()
+
+    monkeypatch.setattr(batch_ranking, "count", counting)
+
+@pytest.mark.parametrize("output", ["ndjson", "npz"])
+def test_interrupted_run_resumes_to_the_same_feeds(batch_corpus, tmp_path, monkeypatch, output):
+    complete = _run(str(tmp_path / "complete"), output)
+
+    folder = str(tmp_path / "resumed")
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, 2)
+        with pytest.raises(_Interrupted):
+            _run(folder, output)
+    ranked = []
+    with monkeypatch.context() as patch:
+        count = batch_ranking.count
+        patch.setattr(batch_ranking, "count",
+                      lambda name, value=1: (ranked.append(value), count(name, value)))
+        resumed = _run(folder, output)
+
+    n_users = len(batch_corpus()[1])
+    assert sum(ranked) == n_users - 2 * CHUNK_SIZE
+    if output == "ndjson":
+        with open(complete, "rb") as a, open(resumed, "rb") as b:
+            assert a.read() == b.read()
+    else:
+        expected, actual = load_feeds(complete), load_feeds(resumed)
+        assert expected.keys() == actual.keys()
+        assert all(np.array_equal(expected[name], actual[name]) for name in expected)
+
+def test_restart_ignores_the_checkpoint(batch_corpus, tmp_path, monkeypatch):
+    folder = str(tmp_path / "batch")
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, 1)
+        with pytest.raises(_Interrupted):
+            _run(folder, "npz")
+
+    ranked = []
+    count = batch_ranking.count
+    monkeypatch.setattr(batch_ranking, "count", lambda name, value=1: (ranked.append(value), count(name, value)))
+    feeds = load_feeds(_run(folder, "npz", restart=True))
+    assert sum(ranked) == len(batch_corpus()[1]) == len(feeds["user_ids"])
+
+    user_id = str(feeds["user_ids"][0])
+    feed = feed_for_user(feeds, user_id)
+    assert 0 < len(feed) <= 10
+    assert [score for _, score in feed] == sorted((score for _, score in feed), reverse=True)
+    assert feed_for_user(feeds, "no-such-user") is None
+
+def test_run_without_users(in_repo_root, corpus_folder, tmp_path, monkeypatch):
+    article_store, _, category_map = load_corpus(data_folder=corpus_folder,
+                                                 snapshot_folder=str(tmp_path / "snapshots"))
+    monkeypatch.setattr(batch_ranking, "load_corpus",
+                        lambda use_local_json=True: (article_store, build_user_store([], []), category_map))
+    feeds = load_feeds(_run(str(tmp_path / "batch"), "npz"))
+    assert len(feeds["user_ids"]) == 0
+
+def test_the_loaded_store_is_not_pinned(batch_corpus, tmp_path, monkeypatch):
+    stores = []
+
+    def corpus(use_local_json=True):
+        stores.append(batch_corpus()[0])
+        return (stores[-1],) + batch_corpus()[1:]
+
+    monkeypatch.setattr(batch_ranking, "load_corpus", corpus)
+    _run(str(tmp_path / "batch"), "npz")
+    assert stores[0].days_old_reference() is None
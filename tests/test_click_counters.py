@@ -0,0 +1,204 @@
+import json
+import os
+import random
+from collections import Counter
+
+import pytest
+
+import click_counters
+from article_store import build_article_store
+from click_counters import (
+    COMPACT_EVERY,
+    ClickCounters,
+    compact_click_counters,
+    ingest_clicks,
+    load_click_counters,
+    log_clicks,
+    update_click_counters
+)
+
+USERS = [f"user-{i}" for i in range(6)]
+CATEGORIES = ["Politics", "Sports", "Business", "Health"]
+TAGS = ["cricket", "elections", "markets"]
+
+def _events(rng, n):
+    return [
+        {
+            "user_id": rng.choice(USERS),
+            "article_id": "a",
+            "categories": rng.sample(CATEGORIES, rng.randint(1, 2)),
+            "tags": rng.sample(TAGS, rng.randint(0, 2)),
+        }
+        for _ in range(n)
+    ]
+
+def _expected(events):
+    cats, tags = Counter(), Counter()
+    for event in events:
+        for cat in set(event["categories"]):
+            cats[event["user_id"], cat] += 1
+        for tag in set(event["tags"]):
+            tags[event["user_id"], tag] += 1
+    return cats, tags
+
+def _assert_counts(counters, events):
+    cats, tags = _expected(events)
+    for user in USERS:
+        cat_clicks, tag_clicks = counters.clicks(user)
+        assert cat_clicks == {c: n for (u, c), n in cats.items() if u == user}
+        assert tag_clicks == {t: n for (u, t), n in tags.items() if u == user}
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "clicks.ndjson"), str(tmp_path / "clicks")
+
+def test_counters_match_the_log_across_deltas_and_compactions(paths):
+    log_path, folder = paths
+    rng = random.Random(0)
+    counters = load_click_counters(folder)
+    logged = []
+    for _ in range(2 * COMPACT_EVERY + 3):
+        events = _events(rng, rng.randint(1, 20))
+        log_clicks(events, log_path)
+        logged += events
+        counters = update_click_counters(counters=counters, log_path=log_path, folder=folder)
+        _assert_counts(counters, logged)
+
+    _assert_counts(load_click_counters(folder), logged)
+    state = json.load(open(os.path.join(folder, "state.json")))
+    assert state["generation"] == 2
+    assert len(state["deltas"]) == 3
+    assert state["offset"] == os.path.getsize(log_path)
+
+def test_incomplete_trailing_line_waits_for_the_next_ingestion(paths):
+    log_path, folder = paths
+    events = _events(random.Random(1), 5)
+    log_clicks(events[:4], log_path)
+    line = json.dumps(events[4])
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(line[:10])
+
+    counters, ingested = ingest_clicks(load_click_counters(folder), log_path=log_path, folder=folder)
+    assert ingested == 4
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(line[10:] + "\n")
+    counters, ingested = ingest_clicks(counters, log_path=log_path, folder=folder)
+    assert ingested == 1
+    _assert_counts(counters, events)
+
+def test_concurrent_ingesters_count_every_event_once(paths):
+    # Two processes (server, CLI) each holding counters loaded at startup
+    log_path, folder = paths
+    rng = random.Random(2)
+    a = load_click_counters(folder)
+    b = load_click_counters(folder)
+    logged = []
+    for step in range(COMPACT_EVERY + 5):
+        events = _events(rng, 3)
+        log_clicks(events, log_path)
+        logged += events
+        if step % 3 == 0:
+            a = update_click_counters(counters=a, log_path=log_path, folder=folder)
+        else:
+            b = update_click_counters(counters=b, log_path=log_path, folder=folder)
+        if step == 7:
+            b = compact_click_counters(b, folder)
+
+    a = update_click_counters(counters=a, log_path=log_path, folder=folder)
+    b = update_click_counters(counters=b, log_path=log_path, folder=folder)
+    _assert_counts(a, logged)
+    _assert_counts(b, logged)
+    _assert_counts(load_click_counters(folder), logged)
+    state = json.load(open(os.path.join(folder, "state.json")))
+    assert len(state["deltas"]) == len(set(state["deltas"]))
+
+def test_interrupted_compaction_keeps_the_previous_state(paths, monkeypatch):
+    log_path, folder = paths
+    rng = random.Random(3)
+    events = _events(rng, 30)
+    log_clicks(events, log_path)
+    counters = update_click_counters(log_path=log_path, folder=folder)
+
+    def fail(folder, state):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(click_counters, "_save_state", fail)
+        with pytest.raises(OSError):
+            compact_click_counters(counters, folder)
+    _assert_counts(load_click_counters(folder), events)
+
+    more = _events(rng, 10)
+    log_clicks(more, log_path)
+    counters = update_click_counters(log_path=log_path, folder=folder)
+    compact_click_counters(counters, folder)
+    _assert_counts(load_click_counters(folder), events + more)
+    assert sorted(os.listdir(folder)) == ["base-00000001.npz", "ingest.lock", "state.json"]
+
+def test_delta_names_are_never_listed_twice(paths):
+    _, folder = paths
+    os.makedirs(folder)
+    with open(os.path.join(folder, "state.json"), "w", encoding="utf-8") as f:
+        json.dump({"generation": 0, "offset": 0, "deltas": ["delta-00000000-000001.npz"]}, f)
+    delta = ClickCounters()
+    delta.add(["user-0"], [["Politics"]], [[]])
+    with pytest.raises(RuntimeError):
+        click_counters._save_delta(delta, 10, folder)
+
+def test_events_are_resolved_through_the_article_store(paths):
+    log_path, folder = paths
+    store = build_article_store([{
+        "_id": "a1", "title": "t", "language": "english",
+        "category": ["c1", "c2"], "tags": ["cricket"], "updatedAt": "2025-01-01T00:00:00Z",
+    }])
+    category_map = {"c1": "Politics", "c2": "Sports"}
+    log_clicks([{"user_id": "u", "article_id": "a1"}, {"user_id": "u", "article_id": "missing"}], log_path)
+
+    counters, ingested = ingest_clicks(ClickCounters(), store, category_map, log_path=log_path, folder=folder)
+    assert ingested == 1
+    assert counters.clicks("u") == ({"Politics": 1, "Sports": 1}, {"cricket": 1})
+
+def test_clicks_before_their_article_is_synced_are_counted_later(paths, monkeypatch):
+    log_path, folder = paths
+    article = {
+        "_id": "a1", "title": "t", "language": "english",
+        "category": ["c1"], "tags": ["cricket"], "updatedAt": "2025-01-01T00:00:00Z",
+    }
+    old_store = build_article_store([dict(article, _id="a0")])
+    category_map = {"c1": "Politics"}
+    log_clicks([{"user_id": "u", "article_id": "a1"}, {"user_id": "u", "article_id": "a0"}], log_path)
+
+    counters, ingested = ingest_clicks(ClickCounters(), old_store, category_map, log_path=log_path, folder=folder)
+    assert ingested == 1
+    assert counters.offset == os.path.getsize(log_path)
+
+    # Nothing new is logged and the article is still unknown: no empty delta segment
+    deltas = list(counters.deltas)
+    counters, ingested = ingest_clicks(counters, old_store, category_map, log_path=log_path, folder=folder)
+    assert ingested == 0 and counters.deltas == deltas
+
+    store = build_article_store([dict(article, _id="a0"), article])
+    counters, ingested = ingest_clicks(counters, store, category_map, log_path=log_path, folder=folder)
+    assert ingested == 1
+    assert counters.clicks("u") == ({"Politics": 2}, {"cricket": 2})
+    assert load_click_counters(folder).clicks("u") == ({"Politics": 2}, {"cricket": 2})
+    counters, ingested = ingest_clicks(counters, store, category_map, log_path=log_path, folder=folder)
+    assert ingested == 0
+
+    # Events whose article never appears are skipped once the retry period is over
+    log_clicks([{"user_id": "u", "article_id": "missing"}], log_path)
+    counters, _ = ingest_clicks(counters, store, category_map, log_path=log_path, folder=folder)
+    assert json.load(open(os.path.join(folder, "state.json")))["unresolved"]
+    now = click_counters.time.time()
+    monkeypatch.setattr(click_counters.time, "time", lambda: now + click_counters.UNRESOLVED_RETRY_SECONDS)
+    counters, _ = ingest_clicks(counters, store, category_map, log_path=log_path, folder=folder)
+    assert json.load(open(os.path.join(folder, "state.json")))["unresolved"] is None
+    assert not [name for name in os.listdir(folder) if name.startswith("unresolved-")]
+
+def test_invalid_lines_advance_the_offset_without_a_delta(paths):
+    log_path, folder = paths
+    with open(log_path, "w", encoding="utf-8") as f:
+        f.write("{not json\n")
+    counters, ingested = ingest_clicks(ClickCounters(), log_path=log_path, folder=folder)
+    assert ingested == 0 and counters.deltas == []
+    assert load_click_counters(folder).offset == os.path.getsize(log_path)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from compiled_scorer import compile_scorer, get_compiled_scorer, load_compiled_scorer
+from conftest import LinearModel
+
+def test_grid_and_fallback_match_the_model():
+    model = LinearModel()
+    scorer = compile_scorer(model, max_overlap=4, max_days=30)
+    assert scorer.table.shape == (2, 2, 5, 31) and model.calls == 1
+
+    X = np.array([
+        [1, 0, 0, 0],
+        [2, 1, 4, 30],
+        [2, 1, 5, 3],     # overlap outside the grid
+        [1, 0, 2, 45],    # days_old outside the grid
+        [1, 1, 1, 2.5],   # not an integer row
+    ], dtype=float)
+    assert np.allclose(scorer.predict(X), model.predict(X), atol=1e-5)
+
+def test_in_grid_rows_do_not_call_the_model():
+    model = LinearModel()
+    scorer = compile_scorer(model, max_overlap=4, max_days=30)
+    scorer.predict(np.array([[1, 1, 3, 10], [2, 0, 0, 0]], dtype=float))
+    assert model.calls == 1
+
+def test_saved_grid_is_tied_to_the_model_file(tmp_path):
+    model_path = tmp_path / "model.ubj"
+    model_path.write_bytes(b"first model")
+    model = LinearModel()
+    scorer = get_compiled_scorer(model, str(model_path))
+    assert np.array_equal(load_compiled_scorer(model, str(model_path)).table, scorer.table)
+
+    model_path.write_bytes(b"retrained model")
+    assert load_compiled_scorer(model, str(model_path)) is None
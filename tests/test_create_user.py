@@ -0,0 +1,58 @@
+import copy
+
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+import create_user
+from data_loader import load_data
+
+@pytest.fixture(autouse=True)
+def plain_tokenizer(monkeypatch):
+    # Whitespace tokens and a fixed stopword list instead of the nltk downloads
+    monkeypatch.setattr(create_user, "_stop_words", lambda: frozenset({"and", "of", "on", "the"}))
+    monkeypatch.setattr(create_user, "word_tokenize", str.split)
+
+def _articles(corpus_folder, n=None):
+    articles = load_data(use_local_json=True, data_folder=corpus_folder)["articles"][:n]
+    return {art["_id"]["$oid"]: [art["language"], art["title"], "category", art["body"]] for art in articles}
+
+def test_batched_tags_match_per_article_similarity(corpus_folder):
+    articles = _articles(corpus_folder, 60)
+    tagged = create_user.tag_articles(copy.deepcopy(articles), workers=1)
+
+    # Reference: one vectorizer transform and cosine similarity per article
+    vectorizer = TfidfVectorizer()
+    tag_matrix = vectorizer.fit_transform([create_user.clean_text(tag) for tag in create_user.TAG_OPTIONS])
+    for art_no, art in articles.items():
+        text = vectorizer.transform([create_user.clean_text(art[1] + " " + art[3])])
+        best = cosine_similarity(text, tag_matrix)[0].argmax()
+        assert tagged[art_no] == art + [create_user.TAG_OPTIONS[best]]
+
+def test_parallel_cleaning_matches_serial(monkeypatch):
+    monkeypatch.setattr(create_user, "CLEAN_CHUNK_SIZE", 4)
+    texts = [f"The economy of region {i}, and its elections!" for i in range(40)]
+    assert create_user.clean_texts(texts, workers=2) == [create_user.clean_text(text) for text in texts]
+
+def test_only_new_articles_are_tagged(corpus_folder, tmp_path, monkeypatch):
+    data = load_data(use_local_json=True, data_folder=corpus_folder)
+    monkeypatch.setattr(create_user, "load_data", lambda **kwargs: copy.deepcopy(data))
+    monkeypatch.chdir(tmp_path)
+    tagged_counts = []
+    tag_articles = create_user.tag_articles
+
+    def counting_tag_articles(articles, **kwargs):
+        tagged_counts.append(len(articles))
+        return tag_articles(articles, **kwargs)
+
+    monkeypatch.setattr(create_user, "tag_articles", counting_tag_articles)
+    first = create_user.make_local_users(workers=1)
+    assert tagged_counts == [len(data["articles"])] == [len(first)]
+    assert create_user.make_local_users(workers=1) == first
+    assert tagged_counts == [len(data["articles"])]
+
+    added = dict(data["articles"][0], _id={"$oid": "added"}, title="Added article")
+    data["articles"].append(added)
+    second = create_user.make_local_users(workers=1)
+    assert tagged_counts[1:] == [1]
+    assert second.keys() == first.keys() | {"added"}
@@ -0,0 +1,116 @@
+import datetime
+import json
+import os
+import shutil
+import threading
+
+import data_loader
+from article_store import doc_id, parse_timestamp
+from data_loader import (
+    COLLECTIONS,
+    RANKING_PROJECTIONS,
+    load_data,
+    load_synced_collection,
+    sync_collections
+)
+
+def test_mongo_load_applies_projections(mongo_db, corpus_folder):
+    data = load_data(use_local_json=False, db=mongo_db, projections=RANKING_PROJECTIONS)
+    local = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+
+    for name in COLLECTIONS:
+        allowed = set(RANKING_PROJECTIONS[name]) | {"_id"}
+        assert len(data[name]) == mongo_db[name].count_documents({})
+        assert all(set(doc) <= allowed for doc in data[name])
+        # MongoDB always returns _id; local files keep only the projected fields
+        if "_id" in RANKING_PROJECTIONS[name]:
+            key = doc_id
+        else:
+            field = RANKING_PROJECTIONS[name][0]
+            key = lambda doc: str(doc[field])  # noqa: E731
+        assert sorted(map(key, data[name])) == sorted(map(key, local[name]))
+
+    assert "body" not in data["articles"][0]
+    titles = {doc_id(doc): doc["title"] for doc in local["articles"]}
+    assert all(titles[doc_id(doc)] == doc["title"] for doc in data["articles"])
+
+def test_mongo_load_fetches_collections_concurrently(mongo_db, monkeypatch):
+    # Every fetch waits for all the others: a sequential load would break the barrier
+    barrier = threading.Barrier(len(COLLECTIONS), timeout=10)
+    fetch = data_loader.fetch_collection_as_list
+
+    def fetch_together(collection, projection=None, batch_size=None):
+        barrier.wait()
+        return fetch(collection, projection=projection, batch_size=batch_size)
+
+    monkeypatch.setattr(data_loader, "fetch_collection_as_list", fetch_together)
+    data = load_data(use_local_json=False, db=mongo_db, projections=RANKING_PROJECTIONS)
+    assert set(data) == set(COLLECTIONS)
+    assert len(data["articles"]) == mongo_db.articles.count_documents({})
+
+def test_sync_fetches_only_documents_past_the_watermark(mongo_db, tmp_path):
+    sync_folder = str(tmp_path / "sync")
+
+    def sync():
+        return sync_collections(use_local_json=False, db=mongo_db, projections=RANKING_PROJECTIONS,
+                                sync_folder=sync_folder)
+
+    first = sync()
+    assert len(first["articles"]) == mongo_db.articles.count_documents({})
+    assert all(set(doc) <= set(RANKING_PROJECTIONS["articles"]) | {"_id", "createdAt"}
+               for doc in first["articles"])
+
+    # Only the documents sharing the watermark timestamp are fetched again
+    latest = max(parse_timestamp(doc["updatedAt"]) for doc in first["articles"])
+    second = sync()
+    assert second["articles"]
+    assert all(parse_timestamp(doc["updatedAt"]) == latest for doc in second["articles"])
+
+    changed = mongo_db.articles.find_one({}, sort=[("updatedAt", 1)])
+    later = datetime.datetime.fromtimestamp(latest, datetime.timezone.utc) + datetime.timedelta(hours=1)
+    mongo_db.articles.update_one({"_id": changed["_id"]}, {"$set": {"title": "Changed", "updatedAt": later}})
+    third = sync()
+    assert str(changed["_id"]) in {doc_id(doc) for doc in third["articles"]}
+    assert all(parse_timestamp(doc["updatedAt"]) >= latest for doc in third["articles"])
+
+    synced = {doc_id(doc): doc for doc in load_synced_collection("articles", sync_folder)}
+    assert len(synced) == mongo_db.articles.count_documents({})
+    assert synced[str(changed["_id"])]["title"] == "Changed"
+
+def test_sync_rereads_documents_without_timestamps(mongo_db, tmp_path):
+    sync_folder = str(tmp_path / "sync")
+
+    def sync():
+        return sync_collections(use_local_json=False, db=mongo_db, projections=RANKING_PROJECTIONS,
+                                sync_folder=sync_folder)
+
+    assert len(sync()["tags"]) == mongo_db.tags.count_documents({})
+    assert sync()["tags"] == []
+
+    renamed = mongo_db.tags.find_one()
+    mongo_db.tags.update_one({"_id": renamed["_id"]}, {"$set": {"name": "renamed"}})
+    mongo_db.tags.insert_one({"name": "added"})
+    changed = sync()["tags"]
+    assert sorted(doc["name"] for doc in changed) == ["added", "renamed"]
+    synced = {doc_id(doc): doc for doc in load_synced_collection("tags", sync_folder)}
+    assert synced[str(renamed["_id"])]["name"] == "renamed"
+
+def test_local_sync_reads_the_given_folders(corpus_folder, tmp_path):
+    data_folder = str(tmp_path / "data")
+    shutil.copytree(corpus_folder, data_folder)
+    sync_folder = str(tmp_path / "sync")
+
+    def sync():
+        return sync_collections(use_local_json=True, projections=RANKING_PROJECTIONS,
+                                sync_folder=sync_folder, data_folder=data_folder)
+
+    first = sync()
+    assert len(first["articles"]) == len(load_data(data_folder=data_folder)["articles"])
+    assert not any(sync().values())
+
+    # Files dropped into <data_folder>/deltas/<name>/ are taken whole
+    os.makedirs(os.path.join(data_folder, "deltas", "articles"))
+    added = dict(first["articles"][0], _id="added", title="Added")
+    with open(os.path.join(data_folder, "deltas", "articles", "0001.ndjson"), "w", encoding="utf-8") as f:
+        f.write(json.dumps(added) + "\n")
+    assert [doc["_id"] for doc in sync()["articles"]] == ["added"]
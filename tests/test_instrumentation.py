@@ -0,0 +1,62 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from article_ranking import predict_scores
+from compiled_scorer import compile_scorer
+from conftest import LinearModel
+from instrumentation import METRICS, Metrics, count, format_report, prometheus_text, timed
+
+@pytest.fixture
+def metrics():
+    METRICS.reset()
+    yield METRICS
+    METRICS.reset()
+    METRICS.track_memory = False
+
+def test_stages_and_counters(metrics):
+    @timed("outer")
+    def outer():
+        with timed("inner"):
+            count("items", 3)
+
+    outer()
+    outer()
+    assert metrics.stages["outer"]["calls"] == metrics.stages["inner"]["calls"] == 2
+    assert metrics.stages["outer"]["seconds"] >= metrics.stages["inner"]["seconds"]
+    assert metrics.counters == {"items": 6}
+    assert "outer" in format_report()
+
+def test_memory_peaks_include_nested_stages(metrics):
+    started = not tracemalloc.is_tracing()
+    tracemalloc.start()
+    metrics.track_memory = True
+    try:
+        with timed("outer"):
+            with timed("inner"):
+                block = bytearray(4 << 20)
+            del block
+    finally:
+        if started:
+            tracemalloc.stop()
+    assert metrics.stages["inner"]["peak_bytes"] >= 4 << 20
+    assert metrics.stages["outer"]["peak_bytes"] >= metrics.stages["inner"]["peak_bytes"]
+
+def test_prometheus_text():
+    metrics = Metrics()
+    metrics.record("load_data", 1.5)
+    metrics.count("model_calls", 2)
+    lines = prometheus_text(metrics, prefix="test").splitlines()
+    assert 'test_stage_seconds_total{stage="load_data"} 1.500000' in lines
+    assert 'test_stage_calls_total{stage="load_data"} 1' in lines
+    assert "# TYPE test_model_calls_total counter" in lines
+    assert "test_model_calls_total 2" in lines
+
+def test_compiled_scorer_counts_one_model_call(metrics):
+    scorer = compile_scorer(LinearModel(), max_overlap=4, max_days=30)
+    metrics.reset()
+    X = np.array([[1, 0, 2, 3], [2, 1, 9, 3], [1, 1, 1, 400]], dtype=float)
+    predict_scores(scorer, X)
+    assert metrics.counters == {"model_calls": 1, "articles_scored": 3}
+    assert metrics.stages["predict"]["calls"] == 1
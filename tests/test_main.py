@@ -0,0 +1,14 @@
+import main
+
+def test_training_without_rows_builds_no_block(corpus_folder, monkeypatch, capsys):
+    data = main.load_data(use_local_json=True, projections=main.RANKING_PROJECTIONS, data_folder=corpus_folder)
+    for pref in data["user_preferences"]:
+        pref["article_category"] = []
+    monkeypatch.setattr(main, "load_data", lambda **kwargs: data)
+
+    def iter_training_batches(*args, **kwargs):
+        raise AssertionError("a training block was built")
+
+    monkeypatch.setattr(main, "iter_training_batches", iter_training_batches)
+    main.training_mode()
+    assert "No data for training." in capsys.readouterr().out
@@ -0,0 +1,89 @@
+import numpy as np
+
+from conftest import NOW
+from data_loader import RANKING_PROJECTIONS, load_data
+from model_training import (
+    _split_batches,
+    build_training_memmap,
+    iter_training_batches,
+    load_manifest,
+    load_model,
+    save_model,
+    train_xgboost_model,
+    trained_through
+)
+
+def _concat(blocks):
+    return [np.concatenate(column) for column in zip(*blocks)]
+
+def test_training_set_does_not_depend_on_blocks_or_workers(corpus_folder, tmp_path):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    args = (data["users"], data["user_preferences"], data["articles"])
+    now = NOW.timestamp()
+
+    X, y = _concat(iter_training_batches(*args, now=now))
+    X_small, y_small = _concat(iter_training_batches(*args, now=now, chunk_size=5000))
+    assert np.array_equal(X, X_small) and np.array_equal(y, y_small)
+
+    # One user range per worker, written into shared memory maps
+    X_mm, y_mm = build_training_memmap(*args, workers=3, now=now, folder=str(tmp_path / "training"))
+    assert np.array_equal(X, X_mm) and np.array_equal(y, y_mm)
+
+def test_sampled_blocks_keep_positives_and_weight_negatives(corpus_folder):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    args = (data["users"], data["user_preferences"], data["articles"])
+    now = NOW.timestamp()
+
+    X, _ = _concat(iter_training_batches(*args, now=now))
+    X_s, y_s, weights = _concat(iter_training_batches(*args, now=now, negatives=6))
+    positive = (X[:, 1] == 1) & (X[:, 2] > 0)
+    sampled_positive = (X_s[:, 1] == 1) & (X_s[:, 2] > 0)
+    assert sampled_positive.sum() == positive.sum()
+    assert np.all(weights[sampled_positive] == 1)
+    # The weights undo the subsampling: every pair of the full set is represented once
+    assert np.isclose(weights.sum(), len(X))
+    assert len(X_s) == len(y_s) < len(X)
+
+def test_article_rows_restrict_the_pairs(corpus_folder):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    args = (data["users"], data["user_preferences"], data["articles"])
+    now = NOW.timestamp()
+    n_articles = len(data["articles"])
+    rows = np.arange(0, n_articles, 7)
+
+    X, _ = _concat(iter_training_batches(*args, now=now))
+    X_rows, _ = _concat(iter_training_batches(*args, now=now, article_rows=rows))
+    assert np.array_equal(X.reshape(-1, n_articles, 4)[:, rows].reshape(-1, 4), X_rows)
+
+def test_retraining_continues_the_saved_model(corpus_folder, tmp_path):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    args = (data["users"], data["user_preferences"], data["articles"])
+    now = NOW.timestamp()
+    path = str(tmp_path / "model.ubj")
+
+    def batches():
+        return iter_training_batches(*args, now=now, chunk_size=5000)
+
+    model = train_xgboost_model(batches=batches, num_boost_round=5, validation_fraction=0, nthread=1)
+    save_model(model, path=path, data_through=now - 3600)
+    assert trained_through(load_manifest(path)) == now - 3600
+    assert load_manifest(path)["num_boosted_rounds"] == 5
+
+    retrained = train_xgboost_model(batches=batches, xgb_model=load_model(path), num_boost_round=3,
+                                    validation_fraction=0, nthread=1)
+    assert retrained.num_boosted_rounds() == 8
+    assert trained_through({"data_through": None}) is None
+
+def test_validation_split_is_the_same_on_every_pass(corpus_folder):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    args = (data["users"], data["user_preferences"], data["articles"])
+
+    def batches():
+        return iter_training_batches(*args, now=NOW.timestamp(), chunk_size=5000)
+
+    train, valid = _split_batches(batches, 0.2, seed=1)
+    X_train, _ = _concat(train())
+    X_valid, _ = _concat(valid())
+    assert np.array_equal(_concat(train())[0], X_train)
+    assert len(X_train) + len(X_valid) == len(_concat(batches())[0])
+    assert 0.1 < len(X_valid) / (len(X_train) + len(X_valid)) < 0.3
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from article_ranking import rank_articles_for_users
+from article_store import build_article_store
+from conftest import LinearModel
+from data_loader import RANKING_PROJECTIONS, load_data
+from ranking_cache import (
+    RankingCache,
+    build_ranking_cache,
+    cache_key,
+    get_ranking_cache,
+    load_ranking_cache,
+    rank_with_cache
+)
+from user_store import build_user_store
+
+@pytest.fixture(scope="module")
+def stores(corpus_folder):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    return build_article_store(data["articles"]), build_user_store(data["users"], data["user_preferences"])
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = tmp_path / "model.ubj"
+    path.write_bytes(b"model")
+    return str(path)
+
+def test_entries_are_the_base_ranking(stores):
+    article_store, user_store = stores
+    model = LinearModel()
+    cache = build_ranking_cache(model, article_store, user_store, {}, "v1", pool_size=50)
+
+    pref = user_store.pref(0)
+    indices, scores = cache.entries[cache_key(pref, None)]
+    assert indices.dtype == np.int32 and scores.dtype == np.float32
+    expected_indices, expected_scores = rank_articles_for_users(
+        model, [{"_id": "u"}], {"u": pref}, None, article_store=article_store, top_k=50
+    )
+    assert np.array_equal(indices, expected_indices[0])
+    assert np.allclose(scores, expected_scores[0])
+
+def test_save_pads_entries_of_different_lengths(tmp_path):
+    cache = RankingCache("v1", pool_size=3)
+    cache.put(("english", "general", "a"), [4, 2, 7], [0.9, 0.5, 0.1])
+    cache.put(("hindi", "general", "b"), [1, 3, 5, 6, 0], [1.0, 0.8, 0.6, 0.4, 0.2])
+    cache.put(("hindi", "sports", "c"), [], [])
+    path = str(tmp_path / "cache.npz")
+    cache.save(path)
+    assert os.listdir(tmp_path) == ["cache.npz"]
+
+    loaded = load_ranking_cache("v1", path)
+    assert loaded.entries.keys() == cache.entries.keys()
+    for key, (indices, scores) in cache.entries.items():
+        assert np.array_equal(loaded.entries[key][0], indices)
+        assert np.array_equal(loaded.entries[key][1], scores)
+    assert load_ranking_cache("v2", path) is None
+
+def test_lazy_cache_fills_requested_keys(stores, model_path, tmp_path):
+    article_store, user_store = stores
+    model = LinearModel()
+    path = str(tmp_path / "cache.npz")
+    cache = get_ranking_cache(model, article_store, user_store, {}, model_path, path=path, lazy=True)
+    assert len(cache) == 0 and not os.path.exists(path)
+
+    pref = user_store.pref(0)
+    ranked = rank_with_cache(cache, model, article_store, pref, top_k=10)
+    assert len(cache) == 1 and cache.misses == 1
+    assert [idx for idx, _ in ranked] == cache.entries[cache_key(pref, None)][0][:10].tolist()
+    cache.save(path)
+
+    reloaded = get_ranking_cache(model, article_store, user_store, {}, model_path, path=path, lazy=True)
+    assert rank_with_cache(reloaded, model, article_store, pref, top_k=10) == ranked
+    assert reloaded.hits == 1
@@ -0,0 +1,137 @@
+import asyncio
+import functools
+import json
+
+import numpy as np
+
+import ranking_server
+from article_store import build_article_store, filter_article_store
+from click_counters import ClickCounters, log_clicks, update_click_counters
+from data_loader import RANKING_PROJECTIONS, load_data
+from ranking_cache import RankingCache
+from ranking_server import RankingServer, RankingService
+from user_cohort import fit_cohort_model
+from user_store import build_user_store, update_user_store
+from utils import build_category_map
+
+class _Service:
+    # Stand-in for RankingService: echoes custom requests, or fails
+    fail = False
+
+    def rank_custom(self, custom_data, top_k):
+        if self.fail:
+            raise RuntimeError("scorer crashed")
+        return {"user_id": "custom_user", "language": custom_data.get("language"), "top_k": top_k}
+
+class _Writer:
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def _exchange(raw, service=None):
+    # Feeds one raw HTTP request to the connection handler; returns [(status, payload), ...]
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        writer = _Writer()
+        await RankingServer(service or _Service())._handle_connection(reader, writer)
+        assert writer.closed
+        return writer.data
+
+    responses = []
+    for response in asyncio.run(run()).split(b"HTTP/1.1 ")[1:]:
+        head, _, body = response.partition(b"\r\n\r\n")
+        responses.append((int(head.split(b" ")[0]), json.loads(body)))
+    return responses
+
+def _post(body, length=None):
+    length = len(body) if length is None else length
+    return (f"POST /rank/custom HTTP/1.1\r\nContent-Length: {length}\r\nConnection: close\r\n\r\n"
+            .encode("latin-1") + body)
+
+def test_custom_ranking_round_trip():
+    [(status, payload)] = _exchange(_post(b'{"language": "hindi", "top_k": 3}'))
+    assert status == 200
+    assert payload == {"user_id": "custom_user", "language": "hindi", "top_k": 3}
+
+def test_bad_content_length_is_a_400():
+    assert _exchange(_post(b"{}", length="abc"))[0][0] == 400
+    assert _exchange(_post(b"{}", length=-5))[0][0] == 400
+
+def test_oversized_body_is_a_413(monkeypatch):
+    monkeypatch.setattr(ranking_server, "MAX_BODY", 16)
+    assert _exchange(_post(b'{"language": "english"}'))[0][0] == 413
+    assert _exchange(_post(b'{"top_k": 3}'))[0][0] == 200
+
+def test_body_must_be_a_json_object():
+    for body in (b"[1, 2]", b'"text"', b"{not json", b'{"top_k": -1}'):
+        assert _exchange(_post(body))[0][0] == 400
+
+def test_unexpected_errors_are_a_500_and_keep_the_connection():
+    service = _Service()
+    service.fail = True
+    keep_alive = b"POST /rank/custom HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}"
+    responses = _exchange(keep_alive + b"GET /health HTTP/1.1\r\n\r\n", service)
+    assert [status for status, _ in responses] == [500, 200]
+
+def test_sync_assigns_cohorts_to_new_users(corpus_folder, monkeypatch):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    article_store = build_article_store(data["articles"])
+    user_store = build_user_store(data["users"], data["user_preferences"])
+    category_map = build_category_map(data["article_categories"])
+    cohort_model = fit_cohort_model(user_store, category_map, n_clusters=5)
+    monkeypatch.setattr(cohort_model, "save", lambda *args: None)
+    service = RankingService(None, article_store, user_store, category_map, cohort_model.cohort_map(),
+                             RankingCache("v1"), corpus=(article_store, user_store, category_map),
+                             cohort_model=cohort_model)
+
+    copied = user_store.pref(0)
+    new_user = {"_id": "new-user"}
+    new_pref = dict(copied, user_id="new-user")
+
+    def refresh_corpus(article_store, user_store, category_map, use_local_json=True):
+        changes = {name: [] for name in data}
+        changes.update(users=[new_user], user_preferences=[new_pref])
+        return (article_store, update_user_store(user_store, [new_pref], users=[new_user]), category_map,
+                changes)
+
+    monkeypatch.setattr(ranking_server, "refresh_corpus", refresh_corpus)
+    service.sync()
+    assert "new-user" in service.prefs_map
+    assert service.user_cohort_map["new-user"] == service.user_cohort_map[copied["user_id"]]
+
+def test_clicks_resolve_against_the_corpus_at_most_once_per_interval(corpus_folder, tmp_path, monkeypatch):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    article_store = build_article_store(data["articles"])
+    user_store = build_user_store(data["users"], data["user_preferences"])
+    category_map = build_category_map(data["article_categories"])
+    # The ranked rows (a window) hold only the first half of the corpus
+    keep = np.arange(len(article_store)) < len(article_store) // 2
+    window_store = filter_article_store(article_store, keep)
+    log_path = str(tmp_path / "clicks.ndjson")
+    monkeypatch.setattr(ranking_server, "update_click_counters",
+                        functools.partial(update_click_counters, log_path=log_path, folder=str(tmp_path / "clicks")))
+    service = RankingService(None, window_store, user_store, category_map, {}, RankingCache("v1"),
+                             click_counters=ClickCounters(), corpus=(article_store, user_store, category_map))
+
+    old_article = str(article_store.article_ids[len(article_store) - 1])
+    log_clicks([{"user_id": "u", "article_id": old_article}], log_path)
+    service.refresh_clicks()
+    assert sum(service._clicks("u")[0].values()) > 0
+
+    log_clicks([{"user_id": "u2", "article_id": old_article}], log_path)
+    service.refresh_clicks()
+    assert service._clicks("u2") == ({}, {})
+    monkeypatch.setattr(ranking_server, "CLICK_REFRESH_INTERVAL", 0)
+    service.refresh_clicks()
+    assert service._clicks("u2") == service._clicks("u")
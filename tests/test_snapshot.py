@@ -0,0 +1,91 @@
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+
+from snapshot import corpus_key, load_corpus, sync_key
+
+def _same_store(a, b):
+    arrays_a, arrays_b = a.to_arrays(), b.to_arrays()
+    return arrays_a.keys() == arrays_b.keys() and all(
+        np.array_equal(np.asarray(arrays_a[name]), np.asarray(arrays_b[name])) for name in arrays_a
+    )
+
+def _snapshots(folder):
+    return sorted(name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name)))
+
+def test_local_snapshot_is_reused_until_the_inputs_change(corpus_folder, tmp_path):
+    data_folder = str(tmp_path / "data")
+    shutil.copytree(corpus_folder, data_folder)
+    snapshot_folder = str(tmp_path / "snapshots")
+
+    built = load_corpus(data_folder=data_folder, snapshot_folder=snapshot_folder)
+    key = corpus_key(data_folder)
+    assert _snapshots(snapshot_folder) == [key]
+
+    mapped = load_corpus(data_folder=data_folder, snapshot_folder=snapshot_folder)
+    assert isinstance(mapped[0].updated_at, np.memmap)
+    assert _same_store(built[0], mapped[0])
+    assert _same_store(built[1], mapped[1])
+    assert built[2] == mapped[2]
+
+    with open(os.path.join(data_folder, "articles.json"), "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert corpus_key(data_folder) != key
+    rebuilt = load_corpus(data_folder=data_folder, snapshot_folder=snapshot_folder)
+    assert not isinstance(rebuilt[0].updated_at, np.memmap)
+    assert _same_store(built[0], rebuilt[0])
+    # The snapshot of the previous inputs is removed
+    assert _snapshots(snapshot_folder) == [corpus_key(data_folder)]
+
+def test_corpus_key_covers_ndjson_inputs(corpus_folder, tmp_path):
+    data_folder = str(tmp_path / "data")
+    shutil.copytree(corpus_folder, data_folder)
+    with open(os.path.join(data_folder, "users.json"), "r", encoding="utf-8") as f:
+        users = json.load(f)
+    os.remove(os.path.join(data_folder, "users.json"))
+    with open(os.path.join(data_folder, "users.ndjson"), "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(user) + "\n" for user in users)
+    key = corpus_key(data_folder)
+
+    with open(os.path.join(data_folder, "users.ndjson"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"_id": "added", "user_id": "added"}) + "\n")
+    assert corpus_key(data_folder) != key
+
+def test_mongo_snapshot_is_refreshed_with_synced_changes(mongo_db, tmp_path):
+    snapshot_folder = str(tmp_path / "snapshots")
+    sync_folder = str(tmp_path / "sync")
+
+    def load():
+        return load_corpus(use_local_json=False, db=mongo_db, snapshot_folder=snapshot_folder,
+                           sync_folder=sync_folder)
+
+    load()
+    first_key = sync_key(sync_folder)
+    assert _snapshots(snapshot_folder) == [first_key]
+
+    # Nothing new: the snapshot is mapped again and kept
+    article_store, _, _ = load()
+    assert sync_key(sync_folder) == first_key
+    assert _snapshots(snapshot_folder) == [first_key]
+
+    changed = mongo_db.articles.find_one()
+    later = datetime.datetime(2030, 1, 1)
+    mongo_db.articles.update_one({"_id": changed["_id"]}, {"$set": {"title": "Changed", "updatedAt": later}})
+    refreshed, user_store, category_map = load()
+    assert _snapshots(snapshot_folder) == [sync_key(sync_folder)] != [first_key]
+    assert refreshed.title(refreshed.id_index()[str(changed["_id"])]) == "Changed"
+
+    # The refreshed encodings equal a full build from scratch
+    fresh, fresh_users, fresh_categories = load_corpus(
+        use_local_json=False, db=mongo_db, snapshot_folder=str(tmp_path / "fresh"),
+        sync_folder=str(tmp_path / "fresh_sync")
+    )
+    index = refreshed.id_index()
+    rows = [index[str(article_id)] for article_id in fresh.article_ids]
+    assert [refreshed.title(row) for row in rows] == [fresh.title(i) for i in range(len(fresh))]
+    assert np.array_equal(refreshed.updated_at[rows], fresh.updated_at)
+    assert _same_store(user_store, fresh_users)
+    assert category_map == fresh_categories
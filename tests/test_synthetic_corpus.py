@@ -0,0 +1,39 @@
+import filecmp
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from benchmark import StageRecorder
+from conftest import NOW
+from synthetic_corpus import NAME_WORDS, _names, generate_corpus
+
+@pytest.mark.parametrize("n", [5, len(NAME_WORDS) + 10, len(NAME_WORDS) ** 2, 3 * len(NAME_WORDS) ** 2])
+def test_names_are_distinct_beyond_the_word_pool(n):
+    names = _names(n, np.random.default_rng(0))
+    assert len(names) == len(set(names)) == n
+
+def test_corpus_depends_only_on_the_seed(tmp_path):
+    params = dict(n_users=30, n_articles=50, n_categories=8, n_tags=10, days=10, now=NOW)
+    generate_corpus(str(tmp_path / "a"), seed=1, **params)
+    generate_corpus(str(tmp_path / "b"), seed=1, **params)
+    generate_corpus(str(tmp_path / "c"), seed=2, **params)
+    files = sorted(os.listdir(tmp_path / "a"))
+    assert files == sorted(os.listdir(tmp_path / "b"))
+    assert filecmp.cmpfiles(tmp_path / "a", tmp_path / "b", files, shallow=False)[0] == files
+    assert not filecmp.cmp(tmp_path / "a" / "articles.json", tmp_path / "c" / "articles.json", shallow=False)
+
+def test_stage_recorder_leaves_running_tracing_on():
+    recorder = StageRecorder()
+    recorder.run("alloc", lambda: bytearray(1 << 20))
+    assert not tracemalloc.is_tracing()
+    assert recorder.stages["alloc"]["peak_mb"] >= 1
+
+    tracemalloc.start()
+    try:
+        recorder.run("alloc_traced", lambda: bytearray(1 << 20))
+        assert tracemalloc.is_tracing()
+        assert recorder.stages["alloc_traced"]["peak_mb"] >= 1
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from data_loader import RANKING_PROJECTIONS, load_data
+from user_cohort import (
+    assign_cohort_to_custom_user,
+    assign_cohorts,
+    fit_cohort_model,
+    get_cohort_model,
+    load_cohort_model
+)
+from user_store import build_user_store, update_user_store
+from utils import build_category_map
+
+@pytest.fixture(scope="module")
+def corpus(corpus_folder):
+    data = load_data(use_local_json=True, projections=RANKING_PROJECTIONS, data_folder=corpus_folder)
+    return data, build_user_store(data["users"], data["user_preferences"]), build_category_map(
+        data["article_categories"])
+
+def test_sparse_cohorts_group_identical_category_sets(corpus):
+    data, user_store, category_map = corpus
+    cohorts = assign_cohorts(data["users"], data["user_preferences"], category_map, n_clusters=4,
+                             method="sparse")
+    assert set(cohorts) == {str(user["_id"]) for user in data["users"]}
+
+    words = {word for name in category_map.values() for word in name.lower().split()}
+    assert all(set(label.split("-")) <= words for label in cohorts.values())
+    by_categories = {}
+    for pref in data["user_preferences"]:
+        key = frozenset(pref.get("article_category", []))
+        by_categories.setdefault(key, set()).add(cohorts[str(pref["user_id"])])
+    assert all(len(labels) == 1 for labels in by_categories.values())
+
+def test_saved_model_round_trip(corpus, tmp_path):
+    _, user_store, category_map = corpus
+    path = str(tmp_path / "cohorts.npz")
+    model = get_cohort_model(user_store, category_map, n_clusters=5, path=path)
+    loaded = load_cohort_model(path)
+    assert loaded.cohort_map() == model.cohort_map()
+    assert set(model.cohort_map()) == set(user_store.user_ids.tolist())
+
+    # Nothing changed: no user is reassigned
+    assert loaded.update(user_store) == 0
+    assert get_cohort_model(user_store, category_map, n_clusters=6, path=path).n_clusters == 6
+
+def test_update_reassigns_only_changed_users(corpus):
+    _, user_store, category_map = corpus
+    model = fit_cohort_model(user_store, category_map, n_clusters=5)
+    before = model.cohort_map()
+    centers = model.centers.copy()
+
+    moved, dropped = user_store.user_ids[:2].tolist()
+    new_categories = list(category_map)[-3:]
+    updated = update_user_store(user_store, [
+        {"user_id": moved, "language": "english", "article_category": new_categories},
+        {"user_id": dropped, "language": "english", "article_category": []},
+        {"user_id": "new-user", "language": "hindi", "article_category": new_categories},
+    ], users=[{"_id": "new-user"}])
+
+    assert model.update(updated) == 2
+    after = model.cohort_map()
+    assert dropped not in after and after["new-user"] == after[moved]
+    assert {uid: label for uid, label in after.items() if uid not in (moved, "new-user")} == {
+        uid: label for uid, label in before.items() if uid not in (moved, dropped)}
+    assert not np.array_equal(model.centers, centers)
+
+def test_custom_user_gets_the_cohort_of_matching_users(corpus):
+    _, user_store, category_map = corpus
+    model = fit_cohort_model(user_store, category_map, n_clusters=5)
+    pref = user_store.pref(0)
+    custom_user = {"favorite_categories": [[category_map[oid], 1] for oid in pref["article_category"]]}
+    assert assign_cohort_to_custom_user(custom_user, model, category_map) == model.cohort_map()[pref["user_id"]]
@@ -0,0 +1,23 @@
+from user_store import build_user_store, update_user_store
+
+def _pref(uid, categories, language="english"):
+    return {"user_id": uid, "language": language, "article_category": categories}
+
+def test_update_leaves_the_original_store_unchanged():
+    store = build_user_store([{"_id": "u1"}, {"_id": "u2"}], [_pref("u1", ["c1"]), _pref("u2", ["c2", "c3"])])
+    index = store.id_index()
+
+    updated = update_user_store(store, [_pref("u3", ["c1"], "hindi"), _pref("u1", ["c4"])],
+                                users=[{"_id": "u3"}])
+    assert len(updated) == 3 and updated.id_index()["u3"] == 2
+    assert updated.pref(updated.id_index()["u1"])["article_category"] == ["c4"]
+
+    assert store.id_index() is index and set(index) == {"u1", "u2"}
+    assert len(store) == 2
+    assert store.pref(index["u1"])["article_category"] == ["c1"]
+
+def test_users_without_categories_leave_the_store():
+    store = build_user_store([{"_id": "u1"}, {"_id": "u2"}], [_pref("u1", ["c1"]), _pref("u2", ["c2"])])
+    updated = update_user_store(store, [_pref("u1", [])])
+    assert updated.user_ids.tolist() == ["u2"] and updated.id_index() == {"u2": 0}
+    assert store.id_index() == {"u1": 0, "u2": 1}
@@ -1,22 +1,42 @@
+import os
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.preprocessing import normalize
 import numpy as np
+import scipy.sparse as sp
+
+from data_loader import DATA_FOLDER
+from instrumentation import timed
+
+COHORT_MODEL_PATH = os.path.join(DATA_FOLDER, "cohort_model.npz")
 
 # Ensure nltk resources are downloaded
 # nltk.download('punkt')
 # nltk.download('stopwords')
 
-def assign_cohorts(users, user_preferences, category_map, n_clusters=5):
+@timed("assign_cohorts")
+def assign_cohorts(users, user_preferences, category_map, n_clusters=5, method="text", use_idf=True):
     """
     Dynamically assigns cohorts to all users via clustering on their
-    preferred categories (converted to text).
+    preferred categories.
+
+    method="text"   : category names joined into a document per user, nltk
+                      tokenization, TF-IDF and KMeans.
+    method="sparse" : users x categories multi-hot matrix (IDF-weighted if
+                      use_idf) clustered with MiniBatchKMeans; no per-user
+                      text processing. Labels use the same category-name words.
     
     Returned dictionary:
         user_cohort_map: dict { user['_id'] -> "cohort_label" }
     """
+    if method == "sparse":
+        return _assign_cohorts_sparse(users, user_preferences, category_map, n_clusters, use_idf)
+    if method != "text":
+        raise ValueError(f"Unknown cohort method: {method}")
+
     # Building map user_id -> user_preferences doc
     prefs_map = {str(up["user_id"]): up for up in user_preferences}
 
@@ -68,27 +88,252 @@ def assign_cohorts(users, user_preferences, category_map, n_clusters=5):
 
     return user_cohort_map
 
-def assign_cohort_to_custom_user(custom_user, kmeans, vectorizer, top_words_per_cluster):
+def _assign_cohorts_sparse(users, user_preferences, category_map, n_clusters, use_idf):
+    prefs_map = {str(up["user_id"]): up for up in user_preferences}
+
+    # Only categories with a name take part, as in the text pipeline
+    cat_ids = list(category_map)
+    cat_index = {cid: i for i, cid in enumerate(cat_ids)}
+
+    user_ids = []
+    indptr = [0]
+    indices = []
+    for user in users:
+        uid = str(user["_id"])
+        user_ids.append(uid)
+        cat_oids = prefs_map.get(uid, {}).get("article_category", [])
+        indices.extend({cat_index[cid] for cid in cat_oids if cid in cat_index})
+        indptr.append(len(indices))
+
+    X = sp.csr_matrix(
+        (np.ones(len(indices)), indices, indptr), shape=(len(user_ids), len(cat_ids))
+    )
+    X = TfidfTransformer(use_idf=use_idf).fit_transform(X)
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=4096, n_init=3)
+    clusters = kmeans.fit_predict(X)
+
+    top_words_per_cluster = _get_top_category_words(kmeans, category_map, cat_ids, top_n=2)
+    return {uid: top_words_per_cluster[clusters[i]] for i, uid in enumerate(user_ids)}
+
+def _get_top_category_words(kmeans_model, category_map, cat_ids, top_n=2):
     """
-    Assigns a cohort to the custom user based on the clusters formed.
+    Cohort labels for clusters over category columns: centroid weights are
+    spread onto the words of the category names, then the top_n words are joined.
     """
-    stop_words = set(stopwords.words("english"))
-    # Prepare the custom user's document
-    category_names = [cat[0].lower() for cat in custom_user["favorite_categories"]]
-    tag_names = [tag[0].lower() for tag in custom_user["favorite_tags"]]
-    doc_text = " ".join(category_names + tag_names)
-    tokens = word_tokenize(doc_text)
-    filtered_tokens = [word for word in tokens if word not in stop_words]
-    filtered_doc = " ".join(filtered_tokens)
-
-    # Vectorize the custom user's document
-    custom_user_vector = vectorizer.transform([filtered_doc])
-
-    # Predict the cluster for the custom user
-    cluster_id = kmeans.predict(custom_user_vector)[0]
-    cohort_label = top_words_per_cluster[cluster_id]
-    
-    return cohort_label
+    names = [category_map[cid].lower() for cid in cat_ids]
+    word_vectorizer = CountVectorizer(stop_words="english")
+    try:
+        category_words = word_vectorizer.fit_transform(names)   # categories x words
+    except ValueError:
+        # No usable words in any category name
+        return ["none"] * len(kmeans_model.cluster_centers_)
+    feature_names = word_vectorizer.get_feature_names_out()
+
+    word_weights = np.asarray(category_words.T.dot(kmeans_model.cluster_centers_.T)).T
+    top_words_list = []
+    for center in word_weights:
+        top_indices = center.argsort()[::-1][:top_n]
+        top_words_list.append("-".join(feature_names[idx] for idx in top_indices))
+    return top_words_list
+
+def assign_cohort_to_custom_user(custom_user, cohort_model, category_map):
+    """
+    Assigns a cohort to the custom user (user_data.json format) with the
+    persisted cohort model, from the names of its favorite categories.
+    """
+    inverted_category_map = {v: k for k, v in category_map.items()}
+    category_oids = [
+        inverted_category_map[name] for name, _count in custom_user.get("favorite_categories", [])
+        if name in inverted_category_map
+    ]
+    cols = np.array([cohort_model.cat_index.get(oid, -1) for oid in category_oids], dtype=np.int64)
+    cols = cols[cols >= 0]
+    X = cohort_model.weight(_multi_hot(np.zeros(len(cols), dtype=np.int64), cols, 1, len(cohort_model.cat_ids)))
+    cluster_id = cohort_model.predict(X)[0]
+    return str(cohort_model.labels[cluster_id])
+
+class CohortModel:
+    """
+    Persisted sparse cohort model (see method="sparse" in assign_cohorts).
+
+        cat_ids     : category OIDs, one matrix column each
+        idf         : per-column weights (ones without IDF)
+        centers     : cluster centroids, shape (n_clusters, n_categories)
+        counts      : users absorbed by each centroid so far (partial_fit step sizes)
+        labels      : "word1-word2" label per cluster, fixed until the next refit
+        user_ids, user_hashes, user_clusters :
+                      last known assignment of every user, with a hash of the
+                      category columns it was computed from
+    """
+
+    ARRAY_FIELDS = (
+        "cat_ids", "idf", "centers", "counts", "labels",
+        "user_ids", "user_hashes", "user_clusters",
+    )
+
+    def __init__(self, cat_ids, idf, centers, counts, labels,
+                 user_ids=(), user_hashes=(), user_clusters=()):
+        self.cat_ids = np.asarray(cat_ids, dtype=str)
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.centers = np.asarray(centers, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=str)
+        self.user_ids = np.asarray(user_ids, dtype=str)
+        self.user_hashes = np.asarray(user_hashes, dtype=np.uint64)
+        self.user_clusters = np.asarray(user_clusters, dtype=np.int32)
+        self.cat_index = {cid: i for i, cid in enumerate(self.cat_ids.tolist())}
+
+    @property
+    def n_clusters(self):
+        return len(self.centers)
+
+    def transform(self, user_store):
+        """
+        Weighted, L2-normalized users x categories matrix for the rows of
+        user_store, and a per-row hash of its category columns.
+        Categories unknown to the model are ignored.
+        """
+        vocab_cols = np.array(
+            [self.cat_index.get(oid, -1) for oid in user_store.cat_vocab], dtype=np.int64
+        )
+        cols = vocab_cols[user_store.cat_indices] if len(vocab_cols) else np.empty(0, dtype=np.int64)
+        rows = np.repeat(np.arange(len(user_store)), np.diff(user_store.cat_indptr))
+        known = cols >= 0
+        X = _multi_hot(rows[known], cols[known], len(user_store), len(self.cat_ids))
+        return self.weight(X), _row_hashes(X)
+
+    def weight(self, X):
+        return normalize(X.multiply(self.idf).tocsr())
+
+    def predict(self, X):
+        # Nearest centroid: argmin ||c||^2 - 2 x.c (||x||^2 is constant per row)
+        distances = (self.centers ** 2).sum(axis=1) - 2 * np.asarray(X @ self.centers.T)
+        return distances.argmin(axis=1).astype(np.int32)
+
+    def partial_fit(self, X):
+        """
+        One mini-batch k-means step: every centroid moves to the running mean
+        of the users assigned to it so far.
+        """
+        clusters = self.predict(X)
+        assignment = sp.csr_matrix(
+            (np.ones(len(clusters)), (clusters, np.arange(len(clusters)))),
+            shape=(self.n_clusters, X.shape[0])
+        )
+        batch_counts = np.bincount(clusters, minlength=self.n_clusters)
+        batch_sums = np.asarray((assignment @ X).todense())
+
+        moved = batch_counts > 0
+        new_counts = self.counts + batch_counts
+        self.centers[moved] = (
+            self.centers[moved] * self.counts[moved, None] + batch_sums[moved]
+        ) / new_counts[moved, None]
+        self.counts = new_counts
+        return clusters
+
+    @timed("update_cohort_model")
+    def update(self, user_store):
+        """
+        Brings the stored assignments in line with user_store: new users and
+        users whose categories changed are predicted and fed to partial_fit,
+        the others keep their cluster, and users no longer in the store are dropped.
+        Returns the number of users that were (re)assigned.
+        """
+        X, hashes = self.transform(user_store)
+        previous = {uid: i for i, uid in enumerate(self.user_ids.tolist())}
+        user_ids = user_store.user_ids
+        old_rows = np.array([previous.get(uid, -1) for uid in user_ids.tolist()], dtype=np.int64)
+
+        clusters = np.zeros(len(user_ids), dtype=np.int32)
+        seen = old_rows >= 0
+        changed = ~seen
+        changed[seen] = self.user_hashes[old_rows[seen]] != hashes[seen]
+        clusters[~changed] = self.user_clusters[old_rows[~changed]]
+        if changed.any():
+            clusters[changed] = self.partial_fit(X[np.flatnonzero(changed)])
+
+        self.user_ids = np.asarray(user_ids, dtype=str)
+        self.user_hashes = hashes
+        self.user_clusters = clusters
+        return int(changed.sum())
+
+    def cohort_map(self):
+        # user_id -> "cohort_label" for every assigned user
+        return dict(zip(self.user_ids.tolist(), self.labels[self.user_clusters].tolist()))
+
+    def save(self, path=COHORT_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, **{name: getattr(self, name) for name in self.ARRAY_FIELDS})
+
+def load_cohort_model(path=COHORT_MODEL_PATH):
+    # Returns None if no cohort model was saved yet
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return CohortModel(**{name: data[name] for name in CohortModel.ARRAY_FIELDS})
+
+@timed("fit_cohort_model")
+def fit_cohort_model(user_store, category_map, n_clusters=15, use_idf=True):
+    """
+    Full fit of a cohort model on every user of user_store (MiniBatchKMeans
+    over the users x categories matrix, as in assign_cohorts(method="sparse")).
+    """
+    cat_ids = list(category_map)
+    model = CohortModel(cat_ids, np.ones(len(cat_ids)), np.zeros((n_clusters, len(cat_ids))),
+                        np.zeros(n_clusters), [""] * n_clusters)
+    X, hashes = model.transform(user_store)
+    if use_idf:
+        # Smoothed IDF, as computed by TfidfTransformer
+        df = np.bincount(X.indices, minlength=len(cat_ids))
+        model.idf = np.log((1 + X.shape[0]) / (1 + df)) + 1
+        X = model.weight(X)
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=4096, n_init=3)
+    clusters = kmeans.fit_predict(X).astype(np.int32)
+
+    model.centers = kmeans.cluster_centers_.astype(np.float64)
+    model.counts = np.bincount(clusters, minlength=n_clusters).astype(np.float64)
+    model.labels = np.asarray(_get_top_category_words(kmeans, category_map, cat_ids, top_n=2), dtype=str)
+    model.user_ids = np.asarray(user_store.user_ids, dtype=str)
+    model.user_hashes = hashes
+    model.user_clusters = clusters
+    return model
+
+def get_cohort_model(user_store, category_map, n_clusters=15, refit=False, path=COHORT_MODEL_PATH):
+    """
+    Loads the saved cohort model and updates it for new/changed users, or
+    fits a new one when none is saved, refit is requested or n_clusters differs.
+    The model is saved again whenever it changed.
+    """
+    model = None if refit else load_cohort_model(path)
+    if model is None or model.n_clusters != n_clusters:
+        model = fit_cohort_model(user_store, category_map, n_clusters=n_clusters)
+        model.save(path)
+        return model
+
+    n_before = len(model.user_ids)
+    if model.update(user_store) or len(model.user_ids) != n_before:
+        model.save(path)
+    return model
+
+def _multi_hot(rows, cols, n_rows, n_cols):
+    # Binary CSR matrix; repeated (row, col) pairs count once
+    X = sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(n_rows, n_cols)
+    )
+    X.sum_duplicates()
+    X.data[:] = 1.0
+    return X
+
+def _row_hashes(X):
+    # Order-independent hash of each row's column set (sum of splitmix64 mixes)
+    z = X.indices.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    sums = np.concatenate(([np.uint64(0)], np.cumsum(z, dtype=np.uint64)))
+    return sums[X.indptr[1:]] - sums[X.indptr[:-1]]
 
 def _get_top_words(kmeans_model, vectorizer, top_n=2):
     """
@@ -0,0 +1,197 @@
+import numpy as np
+
+from article_store import boolean_csr, category_overlaps, splice_column, splice_csr
+from utils import remove_duplicate_users, filter_users_with_categories
+
+class UserStore:
+    """
+    Compact encoding of the ranked users and their preferences.
+
+    Columns (one row per user, after de-duplication and filtering):
+        user_ids : user OID strings
+        lang_ids : interned preferred language (index into lang_vocab)
+    Preferred categories are kept in CSR form (cat_indptr, cat_indices),
+    where cat_indices index into cat_vocab.
+    """
+
+    # Array attributes written to / read back from a snapshot, see to_arrays()
+    ARRAY_FIELDS = (
+        "user_ids", "lang_ids", "lang_vocab",
+        "cat_indptr", "cat_indices", "cat_vocab",
+    )
+
+    def __init__(self, user_ids, lang_ids, lang_vocab, cat_indptr, cat_indices, cat_vocab):
+        self.user_ids = user_ids
+        self.lang_ids = lang_ids
+        self.lang_vocab = list(lang_vocab)
+        self.cat_indptr = cat_indptr
+        self.cat_indices = cat_indices
+        self.cat_vocab = list(cat_vocab)
+        self._id_index = None
+        self._cat_matrix = None
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def id_index(self):
+        # user id -> row, built on first use
+        if self._id_index is None:
+            self._id_index = {uid: i for i, uid in enumerate(self.user_ids.tolist())}
+        return self._id_index
+
+    def pref(self, i):
+        # Minimal user_preferences document for row i
+        start, end = self.cat_indptr[i], self.cat_indptr[i + 1]
+        return {
+            "user_id": str(self.user_ids[i]),
+            "language": self.lang_vocab[self.lang_ids[i]],
+            "article_category": [self.cat_vocab[c] for c in self.cat_indices[start:end]],
+        }
+
+    def category_matrix(self):
+        # Sparse boolean users x cat_vocab matrix, built on first use
+        if self._cat_matrix is None:
+            self._cat_matrix = boolean_csr(self.cat_indptr, self.cat_indices, len(self.cat_vocab))
+        return self._cat_matrix
+
+    def category_overlaps(self, article_store, users=None, rows=None):
+        """
+        Category overlap of every user (or the user rows in `users`) with every
+        article (or the article rows in `rows`), as one (n_users, n_articles)
+        matrix (see article_store.category_overlaps). The result is dense, so
+        large user bases should be passed in chunks.
+        """
+        matrix = self.category_matrix()
+        if users is not None:
+            matrix = matrix[np.asarray(users)]
+        # User categories re-indexed into the article store's vocabulary
+        remap = np.array([article_store.cat_index.get(oid, -1) for oid in self.cat_vocab], dtype=np.int64)
+        cats = remap[matrix.indices]
+        known = cats >= 0
+        user_rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        lengths = np.bincount(user_rows[known], minlength=matrix.shape[0])
+        indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return category_overlaps(article_store, indptr, cats[known], rows=rows)
+
+    def users(self):
+        # Minimal user documents, in row order
+        return [{"_id": str(uid)} for uid in self.user_ids]
+
+    def user_preferences(self):
+        return [self.pref(i) for i in range(len(self))]
+
+    def prefs_map(self):
+        # user_id -> minimal user_preferences document
+        return {pref["user_id"]: pref for pref in self.user_preferences()}
+
+    def to_arrays(self):
+        arrays = {}
+        for name in self.ARRAY_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = np.array(value, dtype=str)
+            arrays[name] = value
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        kwargs = {name: arrays[name] for name in cls.ARRAY_FIELDS}
+        for name in ("lang_vocab", "cat_vocab"):
+            kwargs[name] = np.asarray(kwargs[name]).tolist()
+        return cls(**kwargs)
+
+def build_user_store(users, user_preferences, lang_vocab=(), cat_vocab=()):
+    """
+    Encodes the users that can be ranked (de-duplicated, with at least one
+    preferred category) together with their language and categories.
+    The vocabularies start from the given ones (extended as needed).
+    """
+    users = remove_duplicate_users(users)
+    users = filter_users_with_categories(users, user_preferences)
+    prefs_map = {str(up["user_id"]): up for up in user_preferences}
+
+    lang_index = {v: i for i, v in enumerate(lang_vocab)}
+    cat_index = {v: i for i, v in enumerate(cat_vocab)}
+
+    user_ids = []
+    lang_ids = []
+    cat_indptr = [0]
+    cat_indices = []
+
+    for user in users:
+        uid = str(user["_id"])
+        user_pref = prefs_map.get(uid, {})
+        user_ids.append(uid)
+
+        lang = user_pref.get("language", "english")
+        lang_ids.append(lang_index.setdefault(lang, len(lang_index)))
+
+        for oid in user_pref.get("article_category", []):
+            cat_indices.append(cat_index.setdefault(oid, len(cat_index)))
+        cat_indptr.append(len(cat_indices))
+
+    return UserStore(
+        user_ids=np.array(user_ids, dtype=str),
+        lang_ids=np.array(lang_ids, dtype=np.int32),
+        lang_vocab=list(lang_index),
+        cat_indptr=np.array(cat_indptr, dtype=np.int64),
+        cat_indices=np.array(cat_indices, dtype=np.int32),
+        cat_vocab=list(cat_index),
+    )
+
+def update_user_store(store, user_preferences, users=()):
+    """
+    Applies changed user_preferences documents to a store.
+
+    A changed user already in the store gets its row rewritten, or dropped
+    if no categories are left. Users not yet in the store are appended when
+    they appear in `users` and have categories. Python-level work is
+    proportional to the number of changed documents. Returns a new store;
+    `store` is left unchanged (its id index is copied, not extended).
+    """
+    # The last version of a document wins
+    prefs = {str(up["user_id"]): up for up in user_preferences}
+    if not prefs:
+        return store
+
+    index = dict(store.id_index())
+    known = {str(user["_id"]) for user in users} | {uid for uid in prefs if uid in index}
+    delta = build_user_store(
+        [{"_id": uid} for uid in prefs if uid in known],
+        list(prefs.values()),
+        lang_vocab=store.lang_vocab,
+        cat_vocab=store.cat_vocab
+    )
+    # Users whose preferences lost all categories leave the store
+    dropped = [index[uid] for uid, up in prefs.items()
+               if uid in index and not up.get("article_category")]
+
+    n_rows = len(store)
+    target = np.empty(len(delta), dtype=np.int64)
+    for j, uid in enumerate(delta.user_ids.tolist()):
+        if uid not in index:
+            index[uid] = n_rows
+            n_rows += 1
+        target[j] = index[uid]
+
+    keep = None
+    if dropped:
+        keep = np.ones(n_rows, dtype=bool)
+        keep[dropped] = False
+
+    cat_indptr, (cat_indices,) = splice_csr(
+        store.cat_indptr, (store.cat_indices,), delta.cat_indptr, (delta.cat_indices,),
+        target, n_rows, keep=keep
+    )
+    updated = UserStore(
+        user_ids=splice_column(store.user_ids, delta.user_ids, target, n_rows, keep=keep),
+        lang_ids=splice_column(store.lang_ids, delta.lang_ids, target, n_rows, keep=keep),
+        lang_vocab=delta.lang_vocab,
+        cat_indptr=cat_indptr,
+        cat_indices=cat_indices,
+        cat_vocab=delta.cat_vocab,
+    )
+    # Row numbers shift when users are dropped, so the index is rebuilt lazily then
+    if keep is None:
+        updated._id_index = index
+    return updated
@@ -64,4 +64,13 @@ def build_user_article_feature(user, prefs_map, article):
     if days_old < 0:
         days_old = 0
 
-    return [language_feature, lang_match, cat_overlap, days_old]
\ No newline at end of file
+    return [language_feature, lang_match, cat_overlap, days_old]
+
+def build_category_map(categories):
+    # Category OID -> category name
+    category_map = {}
+    for cat in categories:
+        cat_id = str(cat["_id"])
+        cat_name = cat.get("name", "unknown")
+        category_map[cat_id] = cat_name
+    return category_map